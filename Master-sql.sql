@@ -456,6 +456,7 @@ CREATE INDEX IF NOT EXISTS idx_prompts_ai_model ON prompts(ai_model);
 CREATE INDEX IF NOT EXISTS idx_prompts_optimization_level ON prompts(optimization_level);
 CREATE INDEX IF NOT EXISTS idx_prompts_tokens_saved ON prompts(tokens_saved DESC);
 CREATE INDEX IF NOT EXISTS idx_prompts_user_status ON prompts(user_id, status);
+CREATE INDEX IF NOT EXISTS idx_prompts_user_created_id ON prompts(user_id, created_at DESC, id);
 
 -- Analytics indexes
 CREATE INDEX IF NOT EXISTS idx_analytics_daily_user_date ON analytics_daily(user_id, date DESC);
@@ -1,4 +1,5 @@
 from supabase import create_client, Client
+from typing import Optional
 import os
 from dotenv import load_dotenv
 
@@ -13,9 +14,12 @@ SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")  # Service role key for
 print(f"SUPABASE_URL: {SUPABASE_URL}")
 print(f"SUPABASE_SERVICE_KEY: {'SET' if SUPABASE_SERVICE_KEY else 'NOT SET'}")
 
-# Create Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# Supabase client, created on first use so STORAGE_BACKEND=sqlite runs without a project
+supabase: Optional[Client] = None
 
 def get_supabase():
     """Get Supabase client instance"""
+    global supabase
+    if supabase is None:
+        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
     return supabase
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Load driver for the LLM pipeline.
+
+Two modes:
+- router: drives LLMRouter in-process against provider endpoints (normally the mock server),
+          measuring the provider call (and first token / full stream when --stream is set)
+- http:   drives a running backend's /api/llm/chat or /api/llm/stream; per-stage timings are
+          read from the Server-Timing response header when the backend sends one
+
+Reports throughput and p50/p95/p99 latency per stage. Runs fully offline with --spawn-mock.
+
+Usage:
+    python loadtest/load_driver.py --mode router --spawn-mock --provider openai -n 500 -c 50
+    python loadtest/load_driver.py --mode http --base-url http://localhost:8000 --api-key pt_... -n 200 -c 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PROMPT = (
+    "Summarize the main trade-offs between latency, throughput and cost when serving "
+    "large language models behind a shared API gateway."
+)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Parse `name;dur=12.3, other;dur=4` into {name: seconds}."""
+    stages: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        fields = [f.strip() for f in part.split(";") if f.strip()]
+        if not fields:
+            continue
+        for f in fields[1:]:
+            if f.startswith("dur="):
+                try:
+                    stages[fields[0]] = float(f[4:]) / 1000.0
+                except ValueError:
+                    pass
+    return stages
+
+
+class Recorder:
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.completed = 0
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage].append(seconds)
+
+    def report(self, wall: float) -> str:
+        lines = [
+            f"requests ok: {self.completed}   errors: {sum(self.errors.values())}   wall: {wall:.2f}s   "
+            f"throughput: {self.completed / wall if wall > 0 else 0:.1f} req/s",
+            f"{'stage':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'max ms':>10}",
+        ]
+        for stage, values in self.stages.items():
+            lines.append(
+                f"{stage:<24}{len(values):>8}"
+                f"{percentile(values, 0.50) * 1000:>10.1f}{percentile(values, 0.95) * 1000:>10.1f}"
+                f"{percentile(values, 0.99) * 1000:>10.1f}{sum(values) / len(values) * 1000:>10.1f}"
+                f"{max(values) * 1000:>10.1f}"
+            )
+        for kind, count in self.errors.most_common():
+            lines.append(f"error: {kind} x{count}")
+        return "\n".join(lines)
+
+
+def spawn_mock(port: int, args) -> None:
+    """Start the mock provider server on a background thread and wait until it accepts requests."""
+    import uvicorn
+    from loadtest.mock_providers import MockConfig, create_app
+
+    config = MockConfig.from_env()
+    config.latency_ms = args.mock_latency_ms
+    config.error_rate = args.mock_error_rate
+    config.rate_429 = args.mock_rate_429
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 10
+    while not server.started and time.time() < deadline:
+        time.sleep(0.05)
+    if not server.started:
+        raise RuntimeError("mock provider server failed to start")
+
+
+def point_router_at(mock_url: str) -> None:
+    """Route every HTTP provider to the mock server (only fills values that are not already set)."""
+    base = mock_url.rstrip("/")
+    defaults = {
+        "OPENAI_API_BASE": f"{base}/v1/chat/completions",
+        "ANTHROPIC_API_BASE": f"{base}/v1/messages",
+        "GROK_API_BASE": f"{base}/v1/chat/completions",
+        "CUSTOM_LLM_ENDPOINT": f"{base}/custom",
+        "OPENAI_API_KEY": "mock",
+        "ANTHROPIC_API_KEY": "mock",
+        "GROK_API_KEY": "mock",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+async def run_router(args, rec: Recorder) -> None:
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    from services.llm_router import LLMRouter
+
+    router = LLMRouter()
+    await router.startup()
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int) -> None:
+        async with sem:
+            key = f"key-{i % args.keys}"
+            started = time.perf_counter()
+            try:
+                if args.stream:
+                    first = None
+                    async for _ in router.stream(args.provider, args.prompt, args.max_output_tokens, args.model, api_key_id=key):
+                        if first is None:
+                            first = time.perf_counter() - started
+                            rec.add("provider.first_token", first)
+                    rec.add("provider.stream_total", time.perf_counter() - started)
+                else:
+                    result = await router.call(args.provider, args.prompt, args.max_output_tokens, args.model, api_key_id=key)
+                    if result.get("error"):
+                        rec.errors[result.get("status_code", "error")] += 1
+                        return
+                    rec.add("provider.call", time.perf_counter() - started)
+                rec.completed += 1
+            except Exception as e:
+                rec.errors[type(e).__name__] += 1
+
+    try:
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+    finally:
+        print(json.dumps({"rate_limits": router.rate_limit_stats(), "breakers": router.breaker_stats()}, indent=2))
+        await router.aclose()
+
+
+async def run_http(args, rec: Recorder) -> None:
+    import httpx
+
+    path = "/api/llm/stream" if args.stream else "/api/llm/chat"
+    url = args.base_url.rstrip("/") + path
+    headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+    payload = {
+        "provider": args.provider,
+        "model": args.model,
+        "prompt": args.prompt,
+        "max_output_tokens": args.max_output_tokens,
+    }
+    sem = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        async def one(_: int) -> None:
+            async with sem:
+                started = time.perf_counter()
+                try:
+                    if args.stream:
+                        async with client.stream("POST", url, headers=headers, json=payload) as resp:
+                            if resp.status_code >= 400:
+                                rec.errors[f"HTTP {resp.status_code}"] += 1
+                                return
+                            first = None
+                            async for chunk in resp.aiter_text():
+                                if chunk and first is None:
+                                    first = time.perf_counter() - started
+                                    rec.add("first_byte", first)
+                    else:
+                        resp = await client.post(url, headers=headers, json=payload)
+                        if resp.status_code >= 400:
+                            rec.errors[f"HTTP {resp.status_code}"] += 1
+                            return
+                        for stage, seconds in parse_server_timing(resp.headers.get("server-timing")).items():
+                            rec.add(stage, seconds)
+                    rec.add("total", time.perf_counter() - started)
+                    rec.completed += 1
+                except Exception as e:
+                    rec.errors[type(e).__name__] += 1
+
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PromptTrim LLM pipeline load driver")
+    parser.add_argument("--mode", choices=["router", "http"], default="router")
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument("--provider", default="openai")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--max-output-tokens", type=int, default=128)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--keys", type=int, default=4, help="distinct API keys to spread load over (router mode)")
+    parser.add_argument("--base-url", default="http://localhost:8000", help="backend URL (http mode)")
+    parser.add_argument("--api-key", default=os.getenv("PROMPTTRIM_API_KEY"))
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--mock-url", default=None, help="point router-mode providers at this mock server")
+    parser.add_argument("--spawn-mock", action="store_true", help="start the mock provider server in-process")
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--mock-latency-ms", type=float, default=300.0)
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-rate-429", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    if args.spawn_mock:
+        spawn_mock(args.mock_port, args)
+        args.mock_url = args.mock_url or f"http://127.0.0.1:{args.mock_port}"
+    if args.mode == "router" and args.mock_url:
+        point_router_at(args.mock_url)
+
+    rec = Recorder()
+    started = time.perf_counter()
+    asyncio.run(run_router(args, rec) if args.mode == "router" else run_http(args, rec))
+    print(rec.report(time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
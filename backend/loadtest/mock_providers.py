@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Offline mock LLM provider server for load testing.
+
+Speaks the request/response formats LLMRouter uses, streaming and non-streaming:
+- POST /v1/chat/completions   OpenAI and Grok (chat.completion / chat.completion.chunk SSE)
+- POST /v1/messages           Anthropic messages (message / content_block_delta SSE)
+- POST /custom                Custom endpoint ({"text": ...} / NDJSON lines)
+
+Latency, error rate and 429 behaviour are configurable from the CLI, from MOCK_* env vars,
+or at runtime via POST /mock/config.
+
+Usage:
+    python loadtest/mock_providers.py --port 9100 --latency-ms 400 --error-rate 0.01 --rate-429 0.02
+
+Point the backend at it:
+    OPENAI_API_BASE=http://127.0.0.1:9100/v1/chat/completions
+    ANTHROPIC_API_BASE=http://127.0.0.1:9100/v1/messages
+    GROK_API_BASE=http://127.0.0.1:9100/v1/chat/completions
+    CUSTOM_LLM_ENDPOINT=http://127.0.0.1:9100/custom
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "the model returns a concise answer that covers the key points of the request "
+    "with enough detail to be useful while staying within the token budget"
+).split()
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 300.0          # median time to first token / full response
+    latency_sigma: float = 0.4         # lognormal sigma; 0 = fixed latency
+    token_ms: float = 10.0             # per-token delay when streaming
+    output_tokens: int = 120           # tokens generated (capped by max_tokens)
+    error_rate: float = 0.0            # fraction of requests answered with HTTP 500
+    rate_429: float = 0.0              # fraction of requests answered with HTTP 429
+    retry_after_s: float = 1.0         # Retry-After sent with 429s
+    rpm_limit: int = 0                 # >0 enforces a requests-per-minute window and sends x-ratelimit-* headers
+    tpm_limit: int = 0                 # advertised tokens-per-minute limit
+
+    @classmethod
+    def from_env(cls) -> "MockConfig":
+        cfg = cls()
+        for name, value in asdict(cfg).items():
+            env = os.getenv(f"MOCK_{name.upper()}")
+            if env is not None:
+                setattr(cfg, name, type(value)(env))
+        return cfg
+
+
+class MockState:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.window: Deque[float] = deque()
+        self.counters: Dict[str, int] = {"requests": 0, "ok": 0, "errors_500": 0, "errors_429": 0}
+
+    def sample_latency(self) -> float:
+        cfg = self.config
+        if cfg.latency_sigma <= 0:
+            return cfg.latency_ms / 1000.0
+        return random.lognormvariate(math.log(max(cfg.latency_ms, 0.001)), cfg.latency_sigma) / 1000.0
+
+    def rate_headers(self) -> Dict[str, str]:
+        cfg = self.config
+        headers: Dict[str, str] = {}
+        if cfg.rpm_limit > 0:
+            now = time.monotonic()
+            while self.window and now - self.window[0] > 60:
+                self.window.popleft()
+            headers["x-ratelimit-limit-requests"] = str(cfg.rpm_limit)
+            headers["x-ratelimit-remaining-requests"] = str(max(0, cfg.rpm_limit - len(self.window)))
+            if self.window:
+                headers["x-ratelimit-reset-requests"] = f"{max(0.0, 60 - (now - self.window[0])):.1f}s"
+        if cfg.tpm_limit > 0:
+            headers["x-ratelimit-limit-tokens"] = str(cfg.tpm_limit)
+        return headers
+
+    def admit(self) -> Optional[JSONResponse]:
+        """Return an error response if this request should fail, else None."""
+        cfg = self.config
+        self.counters["requests"] += 1
+        if cfg.rpm_limit > 0:
+            now = time.monotonic()
+            while self.window and now - self.window[0] > 60:
+                self.window.popleft()
+            if len(self.window) >= cfg.rpm_limit:
+                return self._too_many()
+            self.window.append(now)
+        roll = random.random()
+        if roll < cfg.rate_429:
+            return self._too_many()
+        if roll < cfg.rate_429 + cfg.error_rate:
+            self.counters["errors_500"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "mock internal error"}})
+        self.counters["ok"] += 1
+        return None
+
+    def _too_many(self) -> JSONResponse:
+        self.counters["errors_429"] += 1
+        headers = self.rate_headers()
+        headers["retry-after"] = str(self.config.retry_after_s)
+        return JSONResponse(status_code=429, content={"error": {"message": "mock rate limit"}}, headers=headers)
+
+    def text(self, max_tokens: int) -> list:
+        n = max(1, min(int(max_tokens or self.config.output_tokens), self.config.output_tokens))
+        return [WORDS[i % len(WORDS)] for i in range(n)]
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    state = MockState(config or MockConfig.from_env())
+    app = FastAPI(title="PromptTrim mock LLM providers")
+
+    async def _token_stream(tokens: list) -> AsyncIterator[str]:
+        await asyncio.sleep(state.sample_latency())
+        for i, tok in enumerate(tokens):
+            if i and state.config.token_ms > 0:
+                await asyncio.sleep(state.config.token_ms / 1000.0)
+            yield tok if i == 0 else " " + tok
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        error = state.admit()
+        if error is not None:
+            return error
+        tokens = state.text(body.get("max_tokens"))
+        model = body.get("model", "mock")
+        headers = state.rate_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if body.get("stream"):
+            async def _sse():
+                async for delta in _token_stream(tokens):
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                             "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(_sse(), media_type="text/event-stream", headers=headers)
+
+        await asyncio.sleep(state.sample_latency() + len(tokens) * state.config.token_ms / 1000.0)
+        return JSONResponse(headers=headers, content={
+            "id": completion_id,
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(tokens)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(str(body.get("messages", "")).split()), "completion_tokens": len(tokens)},
+        })
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        error = state.admit()
+        if error is not None:
+            return error
+        tokens = state.text(body.get("max_tokens"))
+        model = body.get("model", "mock")
+        headers = state.rate_headers()
+        message_id = f"msg_{uuid.uuid4().hex[:12]}"
+
+        if body.get("stream"):
+            async def _sse():
+                start = {"type": "message_start", "message": {"id": message_id, "type": "message", "role": "assistant", "model": model, "content": []}}
+                yield f"event: message_start\ndata: {json.dumps(start)}\n\n"
+                yield 'event: content_block_start\ndata: {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}\n\n'
+                async for delta in _token_stream(tokens):
+                    event = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": delta}}
+                    yield f"event: content_block_delta\ndata: {json.dumps(event)}\n\n"
+                yield 'event: content_block_stop\ndata: {"type": "content_block_stop", "index": 0}\n\n'
+                yield 'event: message_stop\ndata: {"type": "message_stop"}\n\n'
+            return StreamingResponse(_sse(), media_type="text/event-stream", headers=headers)
+
+        await asyncio.sleep(state.sample_latency() + len(tokens) * state.config.token_ms / 1000.0)
+        return JSONResponse(headers=headers, content={
+            "id": message_id,
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": " ".join(tokens)}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": len(str(body.get("messages", "")).split()), "output_tokens": len(tokens)},
+        })
+
+    @app.post("/custom")
+    async def custom(request: Request):
+        body = await request.json()
+        error = state.admit()
+        if error is not None:
+            return error
+        tokens = state.text(body.get("max_tokens"))
+        headers = state.rate_headers()
+
+        if body.get("stream"):
+            async def _ndjson():
+                async for delta in _token_stream(tokens):
+                    yield json.dumps({"text": delta}) + "\n"
+            return StreamingResponse(_ndjson(), media_type="application/x-ndjson", headers=headers)
+
+        await asyncio.sleep(state.sample_latency() + len(tokens) * state.config.token_ms / 1000.0)
+        return JSONResponse(headers=headers, content={"text": " ".join(tokens), "model": body.get("model", "default")})
+
+    @app.get("/mock/config")
+    async def get_config():
+        return {"config": asdict(state.config), "counters": state.counters}
+
+    @app.post("/mock/config")
+    async def update_config(request: Request):
+        updates = await request.json()
+        for name, value in (updates or {}).items():
+            if hasattr(state.config, name):
+                setattr(state.config, name, type(getattr(state.config, name))(value))
+        return {"config": asdict(state.config)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Anthropic/Grok/custom LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    defaults = MockConfig.from_env()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+
+    config = MockConfig(**{name: getattr(args, name) for name in asdict(defaults)})
+    import uvicorn
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,24 @@
 from fastapi import FastAPI, HTTPException, Depends, status, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.encoders import jsonable_encoder
 import uvicorn
 import uuid
-from contextlib import asynccontextmanager
+import json
+import asyncio
+import time
+import hmac
+from contextlib import asynccontextmanager, nullcontext
 from typing import Optional
 from datetime import datetime
 
-from database import get_supabase
 from models import Profile, ApiKey, Prompt, ChatQuestion
 from schemas import (
     ProfileCreate, ProfileResponse, APIKeyCreate, APIKeyResponse,
     PromptOptimizeRequest, PromptOptimizeResponse, AuthResponse,
     ChatRequest, ChatResponse,
-    LLMChatRequest, LLMChatResponse,
+    LLMChatRequest, LLMChatResponse, LLMBatchRequest,
     OutputReduceRequest, OutputReduceResponse
 )
 from services.auth_service import AuthService
@@ -23,18 +27,43 @@ from services.email_service import EmailService
 from pipelines.input.compressor import InputCompressor
 from services.docs_chat_service import DocsChatService
 from services.llm_router import LLMRouter
+from services.response_cache import ResponseCache
+from services.batching import MicroBatcher
+from services.storage import create_storage
+from services.write_behind import WriteBehindQueue
+from services.usage_aggregator import UsageAggregator
+from services.jobs import JobStore, JobConflictError, JobQueueFullError, TERMINAL
+from services.singleflight import SingleFlight, flight_key, normalize_text
 from pipelines.output.summarizer import OutputSummarizer, build_quality_summary_response
 from services.rules_engine import OpenAIRules, AnthropicRules, OutputFormat
+from services.json_repair import extract_json
 from services.token_counter import OpenAITokenCounter
-from database import get_supabase
-import hashlib
+from services import metrics
+from services.metrics import span
+from services.profiler import SamplingProfiler
+from services.inference_profiler import inference_profiler
+import os
 from services.grammar_service import get_grammar_service
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    await storage.start()
+    await llm_router.startup()
+    auth_service.auth_cache.start()
+    write_queue.start()
+    usage_aggregator.start()
+    job_store.start()
     yield
-    # Shutdown
+    # Shutdown (usage deltas drain into the write-behind queue before it flushes)
+    await job_store.aclose()
+    await compression_batcher.aclose()
+    await summarization_batcher.aclose()
+    await auth_service.auth_cache.aclose()
+    await usage_aggregator.aclose()
+    await write_queue.aclose()
+    await llm_router.aclose()
+    await storage.aclose()
 
 app = FastAPI(
     title="PromptTrim API",
@@ -56,13 +85,49 @@ app.add_middleware(
 security = HTTPBearer()
 
 # Initialize services
-auth_service = AuthService()
-prompt_service = PromptOptimizationService()
+# Persistence: STORAGE_BACKEND=supabase (pooled asyncpg on DATABASE_URL, PostgREST fallback) or sqlite
+storage = create_storage()
+auth_service = AuthService(storage=storage)
+write_queue = WriteBehindQueue(storage)
+usage_aggregator = UsageAggregator(write_queue)
 email_service = EmailService()
 tinyllama_service = InputCompressor()
 docs_chat_service = DocsChatService()
 llm_router = LLMRouter()
 qa_summarizer = OutputSummarizer(similarity_threshold=0.75)
+profiler = SamplingProfiler()
+# Background jobs for long /api/llm/chat pipelines (POST /api/llm/jobs)
+job_store = JobStore()
+
+# Micro-batchers: concurrent pipeline items share TinyLlama / BART forward passes
+compression_batcher = MicroBatcher(
+    lambda items: tinyllama_service.compress_batch([p for p, _ in items], [r for _, r in items]),
+    max_batch_size=int(os.getenv("COMPRESSION_BATCH_SIZE", 8)),
+    max_wait_ms=float(os.getenv("COMPRESSION_BATCH_WAIT_MS", 20)),
+    name="compression"
+)
+summarization_batcher = MicroBatcher(
+    lambda items: qa_summarizer.summarize_batch(
+        [t for t, _, _ in items], [m for _, m, _ in items], target_similarity=[s for _, _, s in items]
+    ),
+    max_batch_size=int(os.getenv("SUMMARIZATION_BATCH_SIZE", 8)),
+    max_wait_ms=float(os.getenv("SUMMARIZATION_BATCH_WAIT_MS", 20)),
+    name="summarization"
+)
+
+# Concurrent duplicate requests (same normalized input / level / model) share one model or provider
+# call; distinct ones still go through the micro-batchers above
+flights = SingleFlight()
+prompt_service = PromptOptimizationService(
+    writer=write_queue, usage=usage_aggregator, storage=storage, flights=flights, compressor=compression_batcher
+)
+
+# Response cache in front of provider calls (per-key / per-request opt-in).
+# Reuses the summarizer's MiniLM model for semantic lookups.
+if os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"):
+    llm_router.cache = ResponseCache(
+        embed=lambda text: qa_summarizer.similarity_model.encode(text, normalize_embeddings=True)
+    )
 
 # API key middleware: attach api_key_info for /api/llm/* routes
 @app.middleware("http")
@@ -73,17 +138,41 @@ async def api_key_middleware(request: Request, call_next):
             if not auth or not auth.startswith("Bearer "):
                 return JSONResponse(status_code=401, content={"detail": "Missing API key"})
             key = auth.split(" ")[1]
-            key_hash = hashlib.sha256(key.encode()).hexdigest()
-            supabase = get_supabase()
-            res = supabase.table("api_keys").select("optimization_level, user_id, key_type, is_active").eq("key_hash", key_hash).eq("is_active", True).execute()
-            if not res.data:
+            with span("auth"):
+                api_key_info = await auth_service.auth_cache.resolve(key)
+            if api_key_info is None:
                 return JSONResponse(status_code=403, content={"detail": "Invalid API key"})
-            request.state.api_key_info = res.data[0]
+            request.state.api_key_info = api_key_info
     except Exception:
         # Do not block non /api/llm routes
         pass
     return await call_next(request)
 
+# Endpoints that report their stage breakdown in a Server-Timing header
+SERVER_TIMING_ENDPOINTS = frozenset({"/api/optimize", "/api/llm/chat", "/api/output/reduce", "/api/grammar-check"})
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Metrics middleware (registered last = outermost): request latency, in-flight gauge and
+# per-stage timings. Stage spans recorded before routing are labelled once the route is known.
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    timings = metrics.begin_request()
+    metrics.HTTP_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status_code = 500
+    endpoint = "unmatched"
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        endpoint = getattr(request.scope.get("route"), "path", None) or endpoint
+        if SERVER_TIMING_ENABLED and endpoint in SERVER_TIMING_ENDPOINTS:
+            response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+        return response
+    finally:
+        timings.resolve(endpoint)
+        metrics.HTTP_IN_FLIGHT.dec()
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, request.method, str(status_code))
+
 @app.get("/")
 async def root():
     return {"message": "PromptTrim API - AI-powered prompt optimization"}
@@ -92,13 +181,192 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "PromptTrim API"}
 
+@app.get("/health/providers")
+async def provider_pool_stats():
+    """Connection pool usage for the pooled LLM provider clients"""
+    return llm_router.pool_stats()
+
+@app.get("/health/routing")
+async def provider_routing_stats():
+    """EWMA latency / error rates per provider+model used by latency-aware routing"""
+    return llm_router.routing_stats()
+
+@app.get("/health/rate-limits")
+async def provider_rate_limit_stats():
+    """Learned RPM/TPM limits and queue depth per provider+model"""
+    return llm_router.rate_limit_stats()
+
+@app.get("/health/breakers")
+async def provider_breaker_stats():
+    """Circuit breaker state per provider"""
+    return llm_router.breaker_stats()
+
+@app.get("/health/auth-cache")
+async def auth_cache_stats():
+    """API-key auth cache hit rates and pending last_used_at writes"""
+    return auth_service.auth_cache.stats()
+
+@app.get("/health/db")
+async def db_stats():
+    """Storage backend stats (Supabase: pool usage and Postgres vs PostgREST counts; SQLite: query timings)"""
+    return storage.stats()
+
+@app.get("/health/write-behind")
+async def write_behind_stats():
+    """Queued / written / spilled counts for write-behind persistence"""
+    return {**write_queue.stats(), "usage": usage_aggregator.stats()}
+
+@app.get("/health/jobs")
+async def job_stats():
+    """Background job counts by status, queue depth and dedup counters"""
+    return job_store.stats()
+
+@app.get("/health/singleflight")
+async def singleflight_stats():
+    """Coalesced vs. leading calls per operation"""
+    return flights.stats()
+
+@app.get("/health/cache")
+async def response_cache_stats():
+    """Hit rates and size of the LLM response cache"""
+    if llm_router.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **llm_router.cache.stats()}
+
+def _with_debug_timing(req: Request, payload):
+    """Add the stage breakdown to a response body when the client sends X-Debug-Timing: 1"""
+    if req.headers.get("x-debug-timing", "").lower() not in ("1", "true", "yes"):
+        return payload
+    timings = metrics.current_timings()
+    if timings is None:
+        return payload
+    breakdown = metrics.stage_breakdown(timings)
+    if isinstance(payload, dict):
+        payload["debug_timing"] = breakdown
+    else:
+        payload.debug_timing = breakdown
+    return payload
+
+def _register_metric_collectors():
+    """Gauges and counters read from component stats at scrape time (no hot-path cost)"""
+    def queue_depth():
+        yield {"queue": "write_behind"}, write_queue.stats()["pending"]
+        yield {"queue": "usage"}, usage_aggregator.stats()["pending_rows"]
+        for batcher in (compression_batcher, summarization_batcher):
+            yield {"queue": f"{batcher.name}_batcher"}, batcher.stats()["pending"]
+
+    def provider_in_flight():
+        for provider, entry in llm_router.pool_stats()["providers"].items():
+            yield {"provider": provider}, entry.get("in_flight", 0)
+
+    def cache_requests():
+        auth = auth_service.auth_cache.stats()
+        yield {"cache": "auth", "result": "hit"}, auth["hits"]
+        yield {"cache": "auth", "result": "negative_hit"}, auth["negative_hits"]
+        yield {"cache": "auth", "result": "miss"}, auth["misses"]
+        if llm_router.cache is not None:
+            response = llm_router.cache.stats()
+            yield {"cache": "response", "result": "exact_hit"}, response["exact_hits"]
+            yield {"cache": "response", "result": "semantic_hit"}, response["semantic_hits"]
+            yield {"cache": "response", "result": "miss"}, response["misses"]
+
+    def singleflight_calls():
+        for operation, counts in flights.stats()["operations"].items():
+            for outcome, value in counts.items():
+                yield {"operation": operation, "outcome": outcome}, value
+
+    def write_behind_ops():
+        stats = write_queue.stats()
+        for outcome in ("written", "retries", "spilled", "replayed"):
+            yield {"outcome": outcome}, stats[outcome]
+
+    metrics.registry.collector("prompttrim_queue_depth", "gauge", "Items waiting in in-process queues", queue_depth)
+    metrics.registry.collector("prompttrim_provider_requests_in_flight", "gauge", "Provider HTTP calls in flight", provider_in_flight)
+    metrics.registry.collector("prompttrim_cache_requests_total", "counter", "Cache lookups by cache and result", cache_requests)
+    metrics.registry.collector("prompttrim_singleflight_calls_total", "counter", "Calls that led vs. joined an identical in-flight call", singleflight_calls)
+    metrics.registry.collector("prompttrim_write_behind_ops_total", "counter", "Write-behind ops by outcome", write_behind_ops)
+
+_register_metric_collectors()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of request, stage, model, queue and cache metrics"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# Admin endpoints: disabled (404) unless ADMIN_TOKEN is set; callers send it as X-Admin-Token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_SAMPLE_TEXT = (
+    "Please summarize the quarterly report and highlight the main risks, the revenue trend "
+    "and any follow-up actions the team should take before the next planning meeting."
+)
+
+def _require_admin(req: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = req.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/profile")
+async def admin_profile(
+    req: Request,
+    seconds: float = 10.0,
+    rate: float = 100.0,
+    format: str = "collapsed",
+    include_idle: bool = False,
+    lines: bool = False
+):
+    """Sample every thread for `seconds` at `rate` Hz; collapsed stacks (text) or JSON with counts"""
+    _require_admin(req)
+    try:
+        result = await profiler.capture(seconds=seconds, rate_hz=rate, include_idle=include_idle, lines=lines)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "json":
+        return result
+    return PlainTextResponse(result["collapsed"])
+
+@app.post("/admin/profile/torch")
+async def admin_torch_profile(req: Request, model: str = "tinyllama", text: Optional[str] = None, row_limit: int = 30):
+    """Run one TinyLlama (`tinyllama`) or BART (`bart`) call under torch.profiler; returns the op table"""
+    _require_admin(req)
+    text = text or PROFILE_SAMPLE_TEXT
+    if model == "tinyllama":
+        call = lambda: tinyllama_service.compress_prompt(text, compression_ratio=0.5)
+    elif model == "bart":
+        call = lambda: qa_summarizer.summarize_with_quality_check(text, max_length=60, target_similarity=0.75)
+    else:
+        raise HTTPException(status_code=400, detail="model must be 'tinyllama' or 'bart'")
+    try:
+        return await profiler.torch_capture(call, row_limit=row_limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/admin/inference/recent")
+async def admin_recent_inferences(req: Request, limit: int = 50, model: Optional[str] = None):
+    """Most recent TinyLlama / BART call records (prefill/decode split, tokens/sec, memory), newest first"""
+    _require_admin(req)
+    return {"calls": inference_profiler.recent(limit=max(1, limit), model=model)}
+
+@app.get("/health/inference")
+async def inference_stats():
+    """Per-model inference totals: calls, tokens, prefill/decode seconds, tokens/sec"""
+    return inference_profiler.stats()
+
+@app.get("/health/profiler")
+async def profiler_stats():
+    """Profiler capture counts and limits"""
+    return profiler.stats()
+
 # Authentication endpoints (Supabase handles auth, this is for API key management)
 @app.post("/auth/create-profile", response_model=ProfileResponse)
 async def create_profile(user_id: str, profile_data: ProfileCreate):
     """Create a user profile after Supabase auth"""
     try:
         # Check if profile already exists
-        existing_profile = auth_service.get_profile_by_id(user_id)
+        existing_profile = await auth_service.get_profile_by_id(user_id)
         if existing_profile:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -106,7 +374,7 @@ async def create_profile(user_id: str, profile_data: ProfileCreate):
             )
         
         # Create profile
-        profile = auth_service.create_profile(user_id, profile_data)
+        profile = await auth_service.create_profile(user_id, profile_data)
         if not profile:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -137,7 +405,7 @@ async def create_profile(user_id: str, profile_data: ProfileCreate):
 @app.get("/auth/profile/{user_id}", response_model=ProfileResponse)
 async def get_profile(user_id: str):
     """Get user profile"""
-    profile = auth_service.get_profile_by_id(user_id)
+    profile = await auth_service.get_profile_by_id(user_id)
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -160,7 +428,7 @@ async def get_profile(user_id: str):
 @app.get("/api-keys/{user_id}", response_model=list[APIKeyResponse])
 async def get_api_keys(user_id: str):
     """Get all API keys for the user"""
-    api_keys = auth_service.get_user_api_keys(user_id)
+    api_keys = await auth_service.get_user_api_keys(user_id)
     return [APIKeyResponse(
         id=key.id,
         name=key.name,
@@ -175,7 +443,7 @@ async def get_api_keys(user_id: str):
 @app.post("/api-keys/{user_id}")
 async def create_api_key(user_id: str, key_data: APIKeyCreate):
     """Create a new API key and return it with full key"""
-    result = auth_service.create_api_key(user_id, key_data.name, key_data.key_type, key_data.optimization_level)
+    result = await auth_service.create_api_key(user_id, key_data.name, key_data.key_type, key_data.optimization_level)
     if not result:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -199,7 +467,7 @@ async def create_api_key(user_id: str, key_data: APIKeyCreate):
 @app.delete("/api-keys/{user_id}/{key_id}")
 async def delete_api_key(user_id: str, key_id: str):
     """Delete an API key"""
-    success = auth_service.delete_api_key(user_id, key_id)
+    success = await auth_service.delete_api_key(user_id, key_id)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -260,30 +528,26 @@ async def optimize_with_api_key(request: PromptOptimizeRequest, req: Request, au
             )
         
         # Enforce key type: input or overall only for input optimization
-        key_hash = hashlib.sha256(api_key.encode()).hexdigest()
-        sb = get_supabase()
-        key_res = sb.table("api_keys").select("key_type, is_active, user_id").eq("key_hash", key_hash).eq("is_active", True).execute()
-        if not key_res.data:
+        with span("auth"):
+            key_info = await auth_service.auth_cache.resolve(api_key)
+        if key_info is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid or inactive API key"
             )
-        key_type = key_res.data[0].get("key_type")
+        key_type = key_info.get("key_type")
         if key_type not in ("input", "overall"):
             raise HTTPException(status_code=403, detail="API key not permitted for input optimization. Use an 'input' or 'overall' key.")
 
-        # Get user from API key
-        profile = auth_service.get_profile_by_id(key_res.data[0].get("user_id"))
-        
-        # Optimize the prompt
+        # Optimize the prompt (profiles.id == api_keys.user_id, so no profile fetch is needed)
         optimized_result = await prompt_service.optimize_prompt(
-            user_id=profile.id,
+            user_id=key_info.get("user_id"),
             original_prompt=request.prompt,
             optimization_level=request.optimization_level,
             language=request.language
         )
         
-        return PromptOptimizeResponse(
+        return _with_debug_timing(req, PromptOptimizeResponse(
             id=optimized_result["id"],
             original_text=optimized_result["original_text"],
             optimized_text=optimized_result["optimized_text"],
@@ -293,7 +557,7 @@ async def optimize_with_api_key(request: PromptOptimizeRequest, req: Request, au
             optimization_level=optimized_result["optimization_level"],
             cost_saved_usd=optimized_result["cost_saved_usd"],
             created_at=optimized_result["created_at"]
-        )
+        ))
         
     except HTTPException:
         raise
@@ -305,21 +569,43 @@ async def optimize_with_api_key(request: PromptOptimizeRequest, req: Request, au
 
 # Analytics endpoints
 @app.get("/prompts/history/{user_id}")
-async def get_prompt_history(user_id: str, limit: int = 50):
-    """Get prompt history for the user"""
+async def get_prompt_history(user_id: str, limit: int = 50, cursor: Optional[str] = None, fields: Optional[str] = None):
+    """
+    Get prompt history for the user, newest first
+    - Pass `next_cursor` from the response as `cursor` to fetch the next page
+    - `fields` is a comma-separated projection; by default the prompt texts are omitted
+      (use /prompts/history/{user_id}/{prompt_id} for a single prompt in full)
+    """
     try:
-        prompts_result = prompt_service.supabase.table("prompts").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(limit).execute()
-        return {"prompts": prompts_result.data or []}
+        return await prompt_service.get_prompt_history(user_id, limit, cursor, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to fetch prompt history: {str(e)}"
         )
 
+@app.get("/prompts/history/{user_id}/{prompt_id}")
+async def get_prompt_detail(user_id: str, prompt_id: str, fields: Optional[str] = None):
+    """Get a single prompt from the user's history, including original and optimized text"""
+    try:
+        prompt = await prompt_service.get_prompt(user_id, prompt_id, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to fetch prompt: {str(e)}"
+        )
+    if prompt is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Prompt not found")
+    return prompt
+
 @app.get("/analytics/usage/{user_id}")
 async def get_usage_analytics(user_id: str):
     """Get usage analytics for the user"""
-    analytics = prompt_service.get_user_analytics(user_id)
+    analytics = await prompt_service.get_user_analytics(user_id)
     return analytics
 
 # Documentation Chat Endpoint
@@ -340,8 +626,7 @@ async def chat_with_docs(request: ChatRequest, user_id: Optional[str] = None):
         # Get answer from chat service
         result = await docs_chat_service.answer_question(question)
         
-        # Save to database
-        supabase = get_supabase()
+        # Save to database (write-behind; never blocks or fails the response)
         chat_data = {
             "id": str(uuid.uuid4()),
             "user_id": user_id,  # Can be None for anonymous users
@@ -352,11 +637,7 @@ async def chat_with_docs(request: ChatRequest, user_id: Optional[str] = None):
             "created_at": datetime.utcnow().isoformat()
         }
         
-        try:
-            supabase.table("chat_questions").insert(chat_data).execute()
-        except Exception as db_error:
-            print(f"Warning: Could not save chat question to database: {db_error}")
-            # Continue even if database save fails
+        write_queue.enqueue_insert("chat_questions", chat_data)
         
         return ChatResponse(
             answer=result["answer"],
@@ -371,7 +652,7 @@ async def chat_with_docs(request: ChatRequest, user_id: Optional[str] = None):
 
 # Grammar Check Endpoint
 @app.post("/api/grammar-check")
-async def check_grammar(request: PromptOptimizeRequest):
+async def check_grammar(request: PromptOptimizeRequest, req: Request):
     """
     Check grammar using spaCy + Grammarkit-style rules
     
@@ -393,14 +674,18 @@ async def check_grammar(request: PromptOptimizeRequest):
     
     try:
         grammar_service = get_grammar_service()
-        result = grammar_service.check_grammar(text)
+        # Keyed on the exact text: error offsets refer to it
+        with span("grammar"):
+            result = await flights.do(
+                flight_key("grammar", text), lambda: asyncio.to_thread(grammar_service.check_grammar, text)
+            )
         
-        return {
+        return _with_debug_timing(req, {
             "hasErrors": result["hasErrors"],
             "errors": result["errors"],
             "errorCount": result["errorCount"],
             "text": text
-        }
+        })
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -454,211 +739,445 @@ async def correct_grammar(request: PromptOptimizeRequest):
             detail=f"Grammar correction failed: {str(e)}"
         )
 
+# --- Shared LLM pipeline helpers (used by /api/llm/chat and /api/llm/batch) ---
+
+def _resolve_compression(request_level: str, api_level) -> tuple:
+    """Return (effective_level, compression_ratio) for a request, honoring the API key's level"""
+    # Map optimization level to compression ratio
+    compression_ratios = {
+        "minimal": 0.8,
+        "moderate": 0.5,
+        "aggressive": 0.3
+    }
+    # numeric levels 1=light, 2=moderate, 3=aggressive
+    numeric_map = {1: "minimal", 2: "moderate", 3: "aggressive"}
+    effective_level = request_level
+    if isinstance(api_level, int) and api_level in numeric_map:
+        effective_level = numeric_map[api_level]
+    return effective_level, compression_ratios.get(effective_level, 0.5)
+
+
+async def _compress_coalesced(prompt: str, compression_ratio: float) -> dict:
+    """TinyLlama compression via the micro-batcher; concurrent duplicates share one batch item"""
+    return await flights.do(
+        flight_key("compression", normalize_text(prompt), compression_ratio, "tinyllama"),
+        lambda: compression_batcher.submit((prompt, compression_ratio))
+    )
+
+
+async def _summarize_coalesced(text: str, max_length: int, target_similarity: float) -> tuple:
+    """BART reduction with quality checks via the micro-batcher; concurrent duplicates share one batch item"""
+    return await flights.do(
+        flight_key("summarization", normalize_text(text), max_length, target_similarity, "bart"),
+        lambda: summarization_batcher.submit((text, max_length, target_similarity))
+    )
+
+
+async def _route_llm(request: LLMChatRequest, optimized_prompt: str, api_key_info: Optional[dict]) -> tuple:
+    """Response cache + (fixed | fastest) provider routing. Returns (routed, cache_lookup)."""
+    api_key_id = api_key_info.get("id") if api_key_info else None
+
+    # Response cache (exact hash, then semantic) in front of the provider call
+    use_cache = request.use_cache
+    if use_cache is None and api_key_info:
+        use_cache = bool(api_key_info.get("response_cache"))
+    # Cache entries are scoped to the owning user so completions never cross tenants
+    cache_scope = (api_key_info.get("user_id") or api_key_id) if api_key_info else None
+    cache_lookup = None
+    if use_cache and cache_scope:
+        with span("cache_lookup"):
+            cache_lookup = await llm_router.cache_lookup(
+                cache_scope, request.provider, optimized_prompt, request.max_output_tokens, request.model
+            )
+
+    # Route to provider and get raw output; identical concurrent calls for the same key share one request
+    if cache_lookup is not None and cache_lookup.hit is not None:
+        routed = dict(cache_lookup.hit)
+    elif request.routing == "fastest":
+        targets = [(request.provider, request.model)] + [(t.provider, t.model) for t in request.fallback_targets]
+        key = flight_key(
+            "provider", api_key_id, "fastest", targets, request.hedge, request.max_output_tokens, normalize_text(optimized_prompt)
+        )
+        with span("provider"):
+            routed = await flights.do(key, lambda: llm_router.call_fastest(
+                targets,
+                prompt=optimized_prompt,
+                max_output_tokens=request.max_output_tokens,
+                hedge=request.hedge,
+                api_key_id=api_key_id
+            ))
+    else:
+        key = flight_key(
+            "provider", api_key_id, request.provider, request.model, request.max_output_tokens, normalize_text(optimized_prompt)
+        )
+        with span("provider"):
+            routed = await flights.do(key, lambda: llm_router.call(
+                provider=request.provider,
+                prompt=optimized_prompt,
+                max_output_tokens=request.max_output_tokens,
+                model=request.model,
+                api_key_id=api_key_id
+            ))
+    if not routed.get("error") and cache_lookup is not None and cache_lookup.hit is None:
+        llm_router.cache_store(cache_lookup, routed)
+    return routed, cache_lookup
+
+
+def _build_llm_response(
+    request: LLMChatRequest,
+    optimized_prompt: str,
+    routed: dict,
+    cache_lookup,
+    summary: tuple,
+    effective_level: str,
+    api_level
+):
+    """Token accounting + LLMChatResponse (dict with exact token breakdown for OpenAI)"""
+    final_summary, similarity_score, iterations = summary
+    raw_output = routed.get("text", "")
+    served_provider = routed.get("provider", request.provider)
+    served_model = routed.get("model", request.model)
+
+    # Token estimates
+    prompt_tokens_est = llm_router.estimate_tokens(served_provider, optimized_prompt)
+    output_tokens_est = llm_router.estimate_tokens(served_provider, raw_output)
+
+    # Build response + token breakdown
+    original_output_tokens = max(1, len(raw_output.split()))
+    compressed_output_tokens = len(final_summary.split())
+    reduction_percent = round(((original_output_tokens - compressed_output_tokens) / original_output_tokens) * 100, 2)
+
+    # Optional: detailed tokens object for OpenAI using exact counts
+    tokens_detail = None
+    if served_provider.lower() == "openai":
+        model_name = served_model or "gpt-4o-mini"
+        input_counts = OpenAITokenCounter.count_batch([request.prompt, optimized_prompt], model=model_name)
+        output_counts = OpenAITokenCounter.count_batch([raw_output, final_summary], model=model_name)
+        input_original, input_compressed = input_counts
+        output_original, output_final = output_counts
+        total_saved = max(0, (input_original + output_original) - (input_compressed + output_final))
+        efficiency = 0.0
+        denom = (input_original + output_original)
+        if denom > 0:
+            efficiency = round(1 - ((input_compressed + output_final) / denom), 3)
+        tokens_detail = {
+            "input": {"original": input_original, "compressed": input_compressed, "saved": input_original - input_compressed},
+            "output": {"original": output_original, "final": output_final, "saved": output_original - output_final},
+            "total_saved": total_saved,
+            "efficiency": efficiency,
+        }
+
+    json_output = None
+    json_errors = None
+    if (request.output_format or "").lower() == OutputFormat.JSON.value:
+        extracted = extract_json(raw_output, request.json_schema)
+        json_output = extracted.value
+        json_errors = extracted.errors
+
+    response_payload = LLMChatResponse(
+        provider=served_provider,
+        model=(served_model or ""),
+        prompt_tokens_est=prompt_tokens_est,
+        output_tokens_est=output_tokens_est,
+        raw_output=raw_output,
+        final_output=final_summary,
+        quality_similarity=similarity_score,
+        iterations_used=iterations,
+        reduction_percent=reduction_percent,
+        cache_hit=cache_lookup.kind if cache_lookup is not None else None,
+        cache_similarity=cache_lookup.similarity if cache_lookup is not None else None,
+        json_output=json_output,
+        json_errors=json_errors
+    )
+
+    # Attach non-modeled extra section when OpenAI (exact breakdown)
+    if tokens_detail is not None:
+        # FastAPI will include extra fields if we return a dict
+        base = response_payload.model_dump()
+        base["tokens"] = tokens_detail
+        base["optimization_level"] = api_level if api_level is not None else effective_level
+        return base
+
+    return response_payload
+
+
+def _log_output_reduction(user_id: Optional[str], raw_output: str, final_summary: str, effective_level: str):
+    """Queue an output reduction record for the prompts table (written by the write-behind queue)"""
+    if not user_id:
+        return
+    try:
+        original_output_tokens = max(1, len(raw_output.split()))
+        compressed_output_tokens = len(final_summary.split())
+        cost_per_token = 0.03 / 1000
+        tokens_saved = max(0, original_output_tokens - compressed_output_tokens)
+        cost_saved_usd = tokens_saved * cost_per_token
+        write_queue.enqueue_insert("prompts", {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "original_text": raw_output,
+            "original_token_count": original_output_tokens,
+            "optimized_text": final_summary,
+            "optimized_token_count": compressed_output_tokens,
+            "tokens_saved": tokens_saved,
+            "optimization_level": effective_level,
+            "language": "en",
+            "status": "completed",
+            "cost_saved_usd": cost_saved_usd,
+        })
+        usage_aggregator.record(
+            user_id,
+            tokens_saved=tokens_saved,
+            cost_saved_usd=cost_saved_usd,
+            tokens_processed=original_output_tokens
+        )
+    except Exception as _log_err:
+        print(f"Warning: failed to log output reduction: {_log_err}")
+
+
+def _require_overall_key(req: Request):
+    """Resolve (api_key_info, api_level) and enforce an 'overall' key for end-to-end pipelines"""
+    api_key_info = getattr(req.state, "api_key_info", None)
+    api_level = api_key_info.get("optimization_level") if api_key_info else None
+    api_key_type = api_key_info.get("key_type") if api_key_info else None
+    if api_key_type and api_key_type != "overall":
+        raise HTTPException(status_code=403, detail="API key not permitted for overall pipeline. Use an 'overall' key.")
+    return api_key_info, api_level
+
+
 # Overall LLM chat endpoint: input compression -> provider call -> output reduction
 @app.post("/api/llm/chat", response_model=LLMChatResponse)
 async def llm_chat(request: LLMChatRequest, req: Request):
     try:
-        # Resolve optimization level from API key (if present)
-        api_level = None
-        api_key_type = None
-        if hasattr(req.state, "api_key_info"):
-            api_level = req.state.api_key_info.get("optimization_level")
-            api_key_type = req.state.api_key_info.get("key_type")
-
-        # Enforce overall key for end-to-end pipeline
-        if api_key_type and api_key_type != "overall":
-            raise HTTPException(status_code=403, detail="API key not permitted for overall pipeline. Use an 'overall' key.")
-
-        # Map optimization level to compression ratio
-        compression_ratios = {
-            "minimal": 0.8,
-            "moderate": 0.5,
-            "aggressive": 0.3
-        }
-        # numeric levels 1=light, 2=moderate, 3=aggressive
-        numeric_map = {1: "minimal", 2: "moderate", 3: "aggressive"}
-        effective_level = request.optimization_level
-        if isinstance(api_level, int) and api_level in numeric_map:
-            effective_level = numeric_map[api_level]
-        compression_ratio = compression_ratios.get(effective_level, 0.5)
+        # Resolve optimization level from API key (if present) and enforce overall key
+        api_key_info, api_level = _require_overall_key(req)
+        effective_level, compression_ratio = _resolve_compression(request.optimization_level, api_level)
 
         # Input compression using TinyLlama
-        compressed = tinyllama_service.compress_prompt(
-            prompt=request.prompt,
-            compression_ratio=compression_ratio
-        )
+        with span("compression"):
+            compressed = await _compress_coalesced(request.prompt, compression_ratio)
         optimized_prompt = compressed.get("optimized_prompt", request.prompt)
 
-        # Route to provider and get raw output
-        routed = await llm_router.call(
-            provider=request.provider,
-            prompt=optimized_prompt,
-            max_output_tokens=request.max_output_tokens,
-            model=request.model
-        )
+        routed, cache_lookup = await _route_llm(request, optimized_prompt, api_key_info)
         if routed.get("error"):
-            raise HTTPException(status_code=400, detail=routed["error"])
+            raise HTTPException(status_code=routed.get("status_code", 400), detail=routed["error"])
         raw_output = routed.get("text", "")
 
         # Output reduction with quality checks
-        final_summary, similarity_score, iterations = qa_summarizer.summarize_with_quality_check(
-            raw_output,
-            max_length=max(60, request.max_output_tokens // 2),
-            target_similarity=0.75
-        )
+        with span("summarization"):
+            summary = await _summarize_coalesced(raw_output, max(60, request.max_output_tokens // 2), 0.75)
 
-        # Token estimates
-        prompt_tokens_est = llm_router.estimate_tokens(request.provider, optimized_prompt)
-        output_tokens_est = llm_router.estimate_tokens(request.provider, raw_output)
+        with span("persist"):
+            _log_output_reduction(api_key_info.get("user_id") if api_key_info else None, raw_output, summary[0], effective_level)
+
+        with span("token_counting"):
+            response = _build_llm_response(request, optimized_prompt, routed, cache_lookup, summary, effective_level, api_level)
+        return _with_debug_timing(req, response)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"LLM chat failed: {str(e)}")
 
-        # Build response + token breakdown
-        original_output_tokens = max(1, len(raw_output.split()))
-        compressed_output_tokens = len(final_summary.split())
-        reduction_percent = round(((original_output_tokens - compressed_output_tokens) / original_output_tokens) * 100, 2)
-
-        # Optional: detailed tokens object for OpenAI using exact counts
-        tokens_detail = None
-        if request.provider.lower() == "openai":
-            model_name = request.model or "gpt-4o-mini"
-            input_counts = OpenAITokenCounter.count_batch([request.prompt, optimized_prompt], model=model_name)
-            output_counts = OpenAITokenCounter.count_batch([raw_output, final_summary], model=model_name)
-            input_original, input_compressed = input_counts
-            output_original, output_final = output_counts
-            total_saved = max(0, (input_original + output_original) - (input_compressed + output_final))
-            efficiency = 0.0
-            denom = (input_original + output_original)
-            if denom > 0:
-                efficiency = round(1 - ((input_compressed + output_final) / denom), 3)
-            tokens_detail = {
-                "input": {"original": input_original, "compressed": input_compressed, "saved": input_original - input_compressed},
-                "output": {"original": output_original, "final": output_final, "saved": output_original - output_final},
-                "total_saved": total_saved,
-                "efficiency": efficiency,
-            }
 
-        # Log to Supabase prompts table as an output reduction record
+async def _run_llm_pipeline(
+    item: LLMChatRequest,
+    api_key_info: Optional[dict],
+    api_level: Optional[str],
+    provider_limit: Optional[asyncio.Semaphore] = None
+) -> dict:
+    """
+    /api/llm/chat pipeline through the micro-batchers, so model calls stay off the event loop.
+    Used by batch items and background jobs; provider errors raise HTTPException.
+    """
+    effective_level, compression_ratio = _resolve_compression(item.optimization_level, api_level)
+    with span("compression"):
+        compressed = await compression_batcher.submit((item.prompt, compression_ratio))
+    optimized_prompt = compressed.get("optimized_prompt", item.prompt)
+
+    async with provider_limit or nullcontext():
+        routed, cache_lookup = await _route_llm(item, optimized_prompt, api_key_info)
+    if routed.get("error"):
+        raise HTTPException(status_code=routed.get("status_code", 400), detail=routed["error"])
+
+    raw_output = routed.get("text", "")
+    with span("summarization"):
+        summary = await summarization_batcher.submit((raw_output, max(60, item.max_output_tokens // 2), 0.75))
+    with span("persist"):
+        _log_output_reduction(api_key_info.get("user_id") if api_key_info else None, raw_output, summary[0], effective_level)
+
+    with span("token_counting"):
+        result = _build_llm_response(item, optimized_prompt, routed, cache_lookup, summary, effective_level, api_level)
+    if not isinstance(result, dict):
+        result = result.model_dump()
+    return result
+
+
+# Batch LLM pipeline: batched compression -> bounded provider fan-out -> batched summarization.
+# Results stream back as NDJSON in completion order; per-item failures do not fail the batch.
+@app.post("/api/llm/batch")
+async def llm_batch(request: LLMBatchRequest, req: Request):
+    api_key_info, api_level = _require_overall_key(req)
+    max_items = int(os.getenv("LLM_BATCH_MAX_ITEMS", 500))
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one item")
+    if len(request.items) > max_items:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {max_items} items")
+
+    per_provider = max(1, min(request.max_concurrency_per_provider, int(os.getenv("LLM_BATCH_MAX_CONCURRENCY", 16))))
+    provider_limits = {}
+
+    async def _run_item(index: int, item: LLMChatRequest) -> dict:
         try:
-            supabase = get_supabase()
-            cost_per_token = 0.03 / 1000
-            tokens_saved = max(0, original_output_tokens - compressed_output_tokens)
-            cost_saved_usd = tokens_saved * cost_per_token
-            user_id = None
-            if hasattr(req.state, "api_key_info"):
-                user_id = req.state.api_key_info.get("user_id")
-            if user_id:
-                supabase.table("prompts").insert({
-                    "id": str(uuid.uuid4()),
-                    "user_id": user_id,
-                    "original_text": raw_output,
-                    "original_token_count": original_output_tokens,
-                    "optimized_text": final_summary,
-                    "optimized_token_count": compressed_output_tokens,
-                    "tokens_saved": tokens_saved,
-                    "optimization_level": effective_level,
-                    "language": "en",
-                    "status": "completed",
-                    "cost_saved_usd": cost_saved_usd,
-                }).execute()
-        except Exception as _log_err:
-            print(f"Warning: failed to log output reduction: {_log_err}")
-
-        response_payload = LLMChatResponse(
-            provider=request.provider,
-            model=(request.model or ""),
-            prompt_tokens_est=prompt_tokens_est,
-            output_tokens_est=output_tokens_est,
-            raw_output=raw_output,
-            final_output=final_summary,
-            quality_similarity=similarity_score,
-            iterations_used=iterations,
-            reduction_percent=reduction_percent
+            limit = provider_limits.setdefault((item.provider or "").lower(), asyncio.Semaphore(per_provider))
+            result = await _run_llm_pipeline(item, api_key_info, api_level, provider_limit=limit)
+            return {"index": index, "ok": True, "result": result}
+        except HTTPException as e:
+            return {"index": index, "ok": False, "status_code": e.status_code, "error": e.detail}
+        except Exception as e:
+            return {"index": index, "ok": False, "status_code": 500, "error": f"LLM chat failed: {str(e)}"}
+
+    async def _ndjson():
+        tasks = [asyncio.ensure_future(_run_item(i, item)) for i, item in enumerate(request.items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, default=str) + "\n"
+        finally:
+            # Client went away: stop outstanding work
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
+
+# Async job mode for long pipelines: submit returns a job id at once; poll, long-poll or SSE for the result.
+# Retries with the same Idempotency-Key (per API key owner) get the existing job instead of new work.
+JOB_MAX_WAIT_SECONDS = float(os.getenv("JOB_MAX_WAIT_SECONDS", 30))
+JOB_SSE_KEEPALIVE_SECONDS = 15.0
+
+def _job_owner(req: Request) -> Optional[str]:
+    api_key_info = getattr(req.state, "api_key_info", None)
+    return api_key_info.get("user_id") if api_key_info else None
+
+def _job_or_404(req: Request, job_id: str):
+    job = job_store.get(job_id, owner=_job_owner(req))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.post("/api/llm/jobs", status_code=202)
+async def submit_llm_job(request: LLMChatRequest, req: Request):
+    """Queue an /api/llm/chat pipeline run; 202 with the job (200 when an Idempotency-Key retry matched)"""
+    api_key_info, api_level = _require_overall_key(req)
+    try:
+        job, created = job_store.submit(
+            "llm_chat",
+            lambda: _run_llm_pipeline(request, api_key_info, api_level),
+            owner=_job_owner(req),
+            idempotency_key=req.headers.get("idempotency-key"),
+            payload=request.model_dump()
         )
+    except JobConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return JSONResponse(
+        status_code=202 if created else 200,
+        content=jsonable_encoder(job.to_dict()),
+        headers={"Location": f"/api/llm/jobs/{job.id}"}
+    )
 
-        # Attach non-modeled extra section when OpenAI (exact breakdown)
-        if tokens_detail is not None:
-            # FastAPI will include extra fields if we return a dict
-            base = response_payload.model_dump()
-            base["tokens"] = tokens_detail
-            base["optimization_level"] = api_level if api_level is not None else effective_level
-            return base
+@app.get("/api/llm/jobs/{job_id}")
+async def get_llm_job(job_id: str, req: Request, wait: float = 0):
+    """Job status and result; `wait` (seconds, capped by JOB_MAX_WAIT_SECONDS) long-polls until it finishes"""
+    job = _job_or_404(req, job_id)
+    if wait > 0:
+        job = await job_store.wait(job, min(wait, JOB_MAX_WAIT_SECONDS))
+    return jsonable_encoder(job.to_dict())
 
-        return response_payload
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"LLM chat failed: {str(e)}")
+@app.get("/api/llm/jobs/{job_id}/events")
+async def llm_job_events(job_id: str, req: Request):
+    """Server-sent events: one event per status change (event name = status), closed once the job finishes"""
+    job = _job_or_404(req, job_id)
+
+    def _event(name: str) -> str:
+        return f"event: {name}\ndata: {json.dumps(jsonable_encoder(job.to_dict()))}\n\n"
+
+    async def _events():
+        last = job.status
+        yield _event(last)
+        while last not in TERMINAL:
+            # Re-check first: the status may have moved while the previous event was being sent
+            if job.status == last and not await job_store.wait_changed(job, JOB_SSE_KEEPALIVE_SECONDS):
+                yield ": keep-alive\n\n"
+                continue
+            if job.status != last:
+                last = job.status
+                yield _event(last)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 # Output-only reduction endpoint
 @app.post("/api/output/reduce", response_model=OutputReduceResponse)
-async def reduce_output(request: OutputReduceRequest):
+async def reduce_output(request: OutputReduceRequest, req: Request):
     try:
         # No middleware here; optional future enforcement if we want auth
-        summary, similarity, iterations = qa_summarizer.summarize_with_quality_check(
-            request.text,
-            max_length=request.max_length,
-            target_similarity=request.target_similarity
-        )
-        original_tokens = len(request.text.split())
-        compressed_tokens = len(summary.split())
+        with span("summarization"):
+            summary, similarity, iterations = await _summarize_coalesced(
+                request.text, request.max_length, request.target_similarity
+            )
+        with span("token_counting"):
+            original_tokens = len(request.text.split())
+            compressed_tokens = len(summary.split())
         reduction_percent = 0.0
         if original_tokens > 0:
             reduction_percent = round(((original_tokens - compressed_tokens) / original_tokens) * 100, 2)
-        return OutputReduceResponse(
+        return _with_debug_timing(req, OutputReduceResponse(
             output=summary,
             similarity_to_original=similarity,
             iterations_used=iterations,
             original_tokens=original_tokens,
             compressed_tokens=compressed_tokens,
             reduction_percent=reduction_percent
-        )
+        ))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Output reduction failed: {str(e)}")
 
 
-# Optional: OpenAI streaming (text/plain). Only for provider=openai
+# Streaming (text/plain) for every provider via LLMRouter.stream
 @app.post("/api/llm/stream")
-async def stream_chat(request: LLMChatRequest):
-    if request.provider.lower() != "openai":
-        raise HTTPException(status_code=400, detail="Streaming supported only for OpenAI provider")
+async def stream_chat(request: LLMChatRequest, req: Request):
+    try:
+        model = llm_router.resolve_model(request.provider, request.model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    api_key_id = req.state.api_key_info.get("id") if hasattr(req.state, "api_key_info") else None
+    rules_cls = AnthropicRules if request.provider.lower() == "anthropic" else OpenAIRules
+    rules = rules_cls(OutputFormat.PROSE, request.max_output_tokens, safety=request.redact_pii)
 
     async def _generator():
         try:
             # Compress input first
             compression_ratios = {"minimal": 0.8, "moderate": 0.5, "aggressive": 0.3}
             compression_ratio = compression_ratios.get(request.optimization_level, 0.5)
-            compressed = tinyllama_service.compress_prompt(prompt=request.prompt, compression_ratio=compression_ratio)
+            with span("compression"):
+                compressed = await _compress_coalesced(request.prompt, compression_ratio)
             optimized_prompt = compressed.get("optimized_prompt", request.prompt)
 
-            # Use OpenAI streaming via httpx
-            import os
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                yield "[Streaming error: OPENAI_API_KEY not configured]"
-                return
-            url = "https://api.openai.com/v1/chat/completions"
-            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-            payload = {
-                "model": request.model or "gpt-4o-mini",
-                "messages": [{"role": "user", "content": optimized_prompt}],
-                "stream": True,
-                "max_tokens": request.max_output_tokens,
-            }
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream("POST", url, headers=headers, json=payload) as resp:
-                    async for line in resp.aiter_lines():
-                        if not line or not line.startswith("data:"):
-                            continue
-                        data = line[5:].strip()
-                        if data == "[DONE]":
-                            break
-                        try:
-                            obj = json.loads(data)
-                            delta = obj.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                            if delta:
-                                yield delta
-                        except Exception:
-                            continue
+            # Redact and count tokens as deltas arrive; the provider stream is closed once the budget is spent
+            enforcer = rules.stream_enforcer(model, request.provider)
+            with span("provider_stream"):
+                async for chunk in enforcer.enforce_stream(llm_router.stream(
+                    request.provider,
+                    optimized_prompt,
+                    max_output_tokens=request.max_output_tokens,
+                    model=model,
+                    api_key_id=api_key_id
+                )):
+                    yield chunk
         except Exception as e:
             yield f"[Streaming error: {str(e)}]"
 
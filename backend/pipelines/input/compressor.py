@@ -1,8 +1,8 @@
 from __future__ import annotations
 
-from typing import Dict, Any
+from typing import Dict, Any, List
 
-from ...services.tinyllama_service import TinyLlamaService
+from services.tinyllama_service import TinyLlamaService
 
 
 class InputCompressor:
@@ -17,4 +17,9 @@ class InputCompressor:
     def compress(self, prompt: str, compression_ratio: float) -> Dict[str, Any]:
         return self._svc.compress_prompt(prompt=prompt, compression_ratio=compression_ratio)
 
+    # Same signature as TinyLlamaService so callers can use either
+    def compress_prompt(self, prompt: str, compression_ratio: float = 0.5) -> Dict[str, Any]:
+        return self.compress(prompt, compression_ratio)
 
+    def compress_batch(self, prompts: List[str], compression_ratios: List[float]) -> List[Dict[str, Any]]:
+        return self._svc.compress_batch(prompts, compression_ratios)
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Dict, Any, Optional
 
-from ....services.llm_router import LLMRouter
+from services.llm_router import LLMRouter
 
 
 class AnthropicBranch:
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from ...services.enhanced_summarizer import QualityAssuredSummarizer as _QAS, build_quality_summary_response
+from services.enhanced_summarizer import QualityAssuredSummarizer as _QAS, build_quality_summary_response
 
 
 # Re-export with a clearer pipeline name
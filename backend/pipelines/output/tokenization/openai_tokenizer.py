@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from ....services.token_counter import OpenAITokenCounter
+from services.token_counter import OpenAITokenCounter
 
 
 def count_text(text: str, model: str = "gpt-4o-mini") -> int:
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional, List
 
 # Profile schemas (Supabase auth integration)
 class ProfileBase(BaseModel):
@@ -58,6 +58,7 @@ class PromptOptimizeResponse(BaseModel):
     optimization_level: str
     cost_saved_usd: float
     created_at: datetime
+    debug_timing: Optional[Dict[str, float]] = None  # per-stage ms when X-Debug-Timing is sent
 
 # Analytics schemas
 class UsageAnalytics(BaseModel):
@@ -85,12 +86,23 @@ class ChatResponse(BaseModel):
     confidence: float
 
 # LLM Router + Output reduction schemas
+class LLMTarget(BaseModel):
+    provider: str
+    model: Optional[str] = None
+
 class LLMChatRequest(BaseModel):
     provider: str  # openai | anthropic | grok | custom
     model: Optional[str] = None
     prompt: str
     optimization_level: str = "moderate"  # reuse level for input compression behavior
     max_output_tokens: int = 256
+    routing: str = "fixed"  # "fixed" | "fastest" (latency-aware across provider + fallback_targets)
+    fallback_targets: List[LLMTarget] = []  # extra allowed targets for "fastest" routing
+    hedge: bool = False  # fire a duplicate to the runner-up once the primary passes its p95
+    use_cache: Optional[bool] = None  # None = follow the API key's response_cache setting
+    redact_pii: bool = True  # streaming: redact PII from deltas as they are emitted
+    output_format: Optional[str] = None  # "json": extract/repair a JSON value from the raw output
+    json_schema: Optional[Dict[str, Any]] = None  # validate the extracted JSON against this schema
 
 class LLMChatResponse(BaseModel):
     provider: str
@@ -102,6 +114,15 @@ class LLMChatResponse(BaseModel):
     quality_similarity: float
     iterations_used: int
     reduction_percent: float
+    cache_hit: Optional[str] = None  # "exact" | "semantic" when served from the response cache
+    cache_similarity: Optional[float] = None
+    json_output: Optional[Any] = None  # parsed JSON when output_format == "json"
+    json_errors: Optional[List[str]] = None
+    debug_timing: Optional[Dict[str, float]] = None  # per-stage ms when X-Debug-Timing is sent
+
+class LLMBatchRequest(BaseModel):
+    items: List[LLMChatRequest]
+    max_concurrency_per_provider: int = 8  # bounded fan-out per provider (capped server-side)
 
 class OutputReduceRequest(BaseModel):
     text: str
@@ -114,4 +135,5 @@ class OutputReduceResponse(BaseModel):
     iterations_used: int
     original_tokens: int
     compressed_tokens: int
-    reduction_percent: float
\ No newline at end of file
+    reduction_percent: float
+    debug_timing: Optional[Dict[str, float]] = None  # per-stage ms when X-Debug-Timing is sent
\ No newline at end of file
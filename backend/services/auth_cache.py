@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from .storage import Storage
+
+# Columns every API-key consumer needs (middleware, /api/optimize, pipeline endpoints)
+API_KEY_COLUMNS = "id, optimization_level, user_id, key_type, is_active, response_cache"
+
+
+class ApiKeyAuthCache:
+    """
+    In-process cache of active API keys, keyed by key hash.
+    - Hits are a dict lookup; entries expire after AUTH_CACHE_TTL_SECONDS
+    - Unknown / inactive keys are cached as misses for AUTH_NEGATIVE_TTL_SECONDS in a separate
+      bounded map, so floods of bad keys neither reach Supabase nor evict valid keys
+    - Concurrent misses for the same key share one storage query
+    - delete/deactivate invalidate immediately (this process; other workers catch up on TTL);
+      a lookup that was in flight when an invalidation landed re-reads instead of caching its row
+    - last_used_at writes are coalesced per key and flushed every AUTH_LAST_USED_FLUSH_SECONDS
+      as one batched update
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        ttl_seconds: Optional[float] = None,
+        negative_ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        flush_interval: Optional[float] = None
+    ):
+        self.storage = storage
+        self.ttl = ttl_seconds if ttl_seconds is not None else float(os.getenv("AUTH_CACHE_TTL_SECONDS", 60))
+        self.negative_ttl = negative_ttl_seconds if negative_ttl_seconds is not None else float(os.getenv("AUTH_NEGATIVE_TTL_SECONDS", 10))
+        self.max_entries = max_entries or int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 10000))
+        self.flush_interval = flush_interval or float(os.getenv("AUTH_LAST_USED_FLUSH_SECONDS", 30))
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._negative: "OrderedDict[str, float]" = OrderedDict()
+        self._hash_by_id: Dict[str, str] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Invalidation tombstones (generation per key id / hash), kept only while lookups are in flight
+        self._generation = 0
+        self._loading = 0
+        self._invalidated_ids: Dict[str, int] = {}
+        self._invalidated_hashes: Dict[str, int] = {}
+        self._last_used: Dict[str, str] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._counters: Dict[str, int] = {
+            "hits": 0, "negative_hits": 0, "misses": 0, "invalidations": 0, "last_used_writes": 0
+        }
+
+    @staticmethod
+    def hash_key(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()
+
+    # --- Lookup ---
+
+    def get(self, key_hash: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """(found, info): found=True with info=None means a cached invalid key."""
+        now = time.monotonic()
+        entry = self._entries.get(key_hash)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key_hash)
+                self._counters["hits"] += 1
+                return True, entry[1]
+            self._drop(key_hash)
+        expires = self._negative.get(key_hash)
+        if expires is not None:
+            if expires > now:
+                self._counters["negative_hits"] += 1
+                return True, None
+            del self._negative[key_hash]
+        return False, None
+
+    def put(self, key_hash: str, info: Optional[Dict[str, Any]]) -> None:
+        now = time.monotonic()
+        if info is None:
+            self._negative[key_hash] = now + self.negative_ttl
+            self._negative.move_to_end(key_hash)
+            while len(self._negative) > self.max_entries:
+                self._negative.popitem(last=False)
+            return
+        self._negative.pop(key_hash, None)
+        self._entries[key_hash] = (now + self.ttl, info)
+        self._entries.move_to_end(key_hash)
+        if info.get("id"):
+            self._hash_by_id[info["id"]] = key_hash
+        while len(self._entries) > self.max_entries:
+            oldest, _ = next(iter(self._entries.items()))
+            self._drop(oldest)
+
+    async def resolve(self, api_key: str) -> Optional[Dict[str, Any]]:
+        """Active key info for a raw API key, or None. Records the key as used."""
+        key_hash = self.hash_key(api_key)
+        found, info = self.get(key_hash)
+        if not found:
+            task = self._inflight.get(key_hash)
+            if task is None:
+                self._counters["misses"] += 1
+                task = asyncio.ensure_future(self._load_async(key_hash))
+                self._inflight[key_hash] = task
+                task.add_done_callback(lambda t, h=key_hash: self._inflight_done(h, t))
+            info = await asyncio.shield(task)
+        if info is not None:
+            self.touch(info.get("id"))
+        return info
+
+    def _inflight_done(self, key_hash: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key_hash) is task:
+            del self._inflight[key_hash]
+
+    async def _load_async(self, key_hash: str) -> Optional[Dict[str, Any]]:
+        self._loading += 1
+        try:
+            for _ in range(2):
+                started = self._generation
+                info = await self.storage.get_active_api_key(key_hash, API_KEY_COLUMNS)
+                if not self._invalidated_since(started, key_hash, info):
+                    self.put(key_hash, info)
+                    return info
+                # A create / deactivate / delete landed mid-query; the row may predate it, so re-read
+            return info  # still racing invalidations: answer without caching
+        finally:
+            self._loading -= 1
+            if not self._loading:
+                self._invalidated_ids.clear()
+                self._invalidated_hashes.clear()
+
+    def _invalidated_since(self, generation: int, key_hash: str, info: Optional[Dict[str, Any]]) -> bool:
+        if self._invalidated_hashes.get(key_hash, 0) > generation:
+            return True
+        key_id = info.get("id") if info else None
+        return bool(key_id) and self._invalidated_ids.get(key_id, 0) > generation
+
+    # --- Invalidation ---
+
+    def invalidate_key_id(self, key_id: str) -> None:
+        if self._loading:
+            self._generation += 1
+            self._invalidated_ids[key_id] = self._generation
+        key_hash = self._hash_by_id.get(key_id)
+        if key_hash is not None:
+            self._drop(key_hash)
+            self._counters["invalidations"] += 1
+        self._last_used.pop(key_id, None)
+
+    def invalidate_hash(self, key_hash: str) -> None:
+        if self._loading:
+            self._generation += 1
+            self._invalidated_hashes[key_hash] = self._generation
+        # Later lookups start a fresh query instead of joining the stale one
+        self._inflight.pop(key_hash, None)
+        self._negative.pop(key_hash, None)
+        if key_hash in self._entries:
+            self._drop(key_hash)
+            self._counters["invalidations"] += 1
+
+    def _drop(self, key_hash: str) -> None:
+        entry = self._entries.pop(key_hash, None)
+        if entry is not None and entry[1].get("id"):
+            self._hash_by_id.pop(entry[1]["id"], None)
+
+    # --- Coalesced last_used_at ---
+
+    def touch(self, key_id: Optional[str]) -> None:
+        if key_id:
+            self._last_used[key_id] = datetime.utcnow().isoformat()
+
+    async def flush_last_used(self) -> int:
+        pending, self._last_used = self._last_used, {}
+        try:
+            written = await self.storage.touch_api_keys(pending)
+        except Exception as e:
+            print(f"Warning: failed to write last_used_at for {len(pending)} keys: {e}")
+            for key_id, used_at in pending.items():
+                self._last_used.setdefault(key_id, used_at)
+            return 0
+        self._counters["last_used_writes"] += written
+        return written
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_last_used()
+
+    def start(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def aclose(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush_last_used()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._counters["hits"] + self._counters["negative_hits"] + self._counters["misses"]
+        return {
+            **self._counters,
+            "entries": len(self._entries),
+            "negative_entries": len(self._negative),
+            "pending_last_used": len(self._last_used),
+            "hit_rate": round((self._counters["hits"] + self._counters["negative_hits"]) / lookups, 4) if lookups else 0.0,
+        }
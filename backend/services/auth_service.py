@@ -1,4 +1,3 @@
-from supabase import Client
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
@@ -8,9 +7,10 @@ import hashlib
 from typing import Optional
 import uuid
 
-from database import get_supabase
 from models import Profile, ApiKey
 from schemas import ProfileCreate
+from .auth_cache import ApiKeyAuthCache
+from .storage import Storage, create_storage
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -21,9 +21,10 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 class AuthService:
-    def __init__(self):
+    def __init__(self, storage: Optional[Storage] = None):
         self.pwd_context = pwd_context
-        self.supabase = get_supabase()
+        self.storage = storage or create_storage()
+        self.auth_cache = ApiKeyAuthCache(self.storage)
     
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """Verify a password against its hash"""
@@ -33,29 +34,29 @@ class AuthService:
         """Hash a password"""
         return self.pwd_context.hash(password)
     
-    def get_profile_by_email(self, email: str) -> Optional[Profile]:
+    async def get_profile_by_email(self, email: str) -> Optional[Profile]:
         """Get profile by email"""
         try:
-            result = self.supabase.table("profiles").select("*").eq("email", email).execute()
-            if result.data:
-                return Profile(**result.data[0])
+            row = await self.storage.get_profile_by_email(email)
+            if row:
+                return Profile(**row)
             return None
         except Exception as e:
             print(f"Error getting profile by email: {e}")
             return None
     
-    def get_profile_by_id(self, user_id: str) -> Optional[Profile]:
+    async def get_profile_by_id(self, user_id: str) -> Optional[Profile]:
         """Get profile by ID"""
         try:
-            result = self.supabase.table("profiles").select("*").eq("id", user_id).execute()
-            if result.data:
-                return Profile(**result.data[0])
+            row = await self.storage.get_profile_by_id(user_id)
+            if row:
+                return Profile(**row)
             return None
         except Exception as e:
             print(f"Error getting profile by ID: {e}")
             return None
     
-    def create_profile(self, user_id: str, profile_data: ProfileCreate) -> Optional[Profile]:
+    async def create_profile(self, user_id: str, profile_data: ProfileCreate) -> Optional[Profile]:
         """Create a new profile"""
         try:
             profile_dict = {
@@ -68,9 +69,9 @@ class AuthService:
                 "tokens_used_this_month": 0
             }
             
-            result = self.supabase.table("profiles").insert(profile_dict).execute()
-            if result.data:
-                return Profile(**result.data[0])
+            row = await self.storage.create_profile(profile_dict)
+            if row:
+                return Profile(**row)
             return None
         except Exception as e:
             print(f"Error creating profile: {e}")
@@ -89,41 +90,20 @@ class AuthService:
         """Hash an API key for storage"""
         return hashlib.sha256(api_key.encode()).hexdigest()
     
-    def get_user_from_api_key(self, api_key: str) -> Optional[Profile]:
+    async def get_user_from_api_key(self, api_key: str) -> Optional[Profile]:
         """Get user from API key"""
         try:
-            key_hash = self.hash_api_key(api_key)
-            result = self.supabase.table("api_keys").select("*, profiles(*)").eq("key_hash", key_hash).eq("is_active", True).execute()
-            
-            if result.data and len(result.data) > 0:
-                api_key_data = result.data[0]
-                
-                # Update last used timestamp
-                self.supabase.table("api_keys").update({
-                    "last_used_at": datetime.utcnow().isoformat()
-                }).eq("id", api_key_data["id"]).execute()
-                
-                # Extract profile - check if it's nested
-                profile_data = api_key_data.get("profiles")
-                if profile_data:
-                    # If profiles is a dict (single profile)
-                    if isinstance(profile_data, dict):
-                        return Profile(**profile_data)
-                    # If profiles is a list
-                    elif isinstance(profile_data, list) and len(profile_data) > 0:
-                        return Profile(**profile_data[0])
-                
-                # If profile is not found in the join, get it directly
-                user_id = api_key_data.get("user_id")
-                if user_id:
-                    return self.get_profile_by_id(user_id)
+            # Cached key lookup; last_used_at is recorded by the cache and written in batches
+            api_key_data = await self.auth_cache.resolve(api_key)
+            if api_key_data and api_key_data.get("user_id"):
+                return await self.get_profile_by_id(api_key_data["user_id"])
             
             return None
         except Exception as e:
             print(f"Error getting user from API key: {e}")
             return None
     
-    def create_api_key(self, user_id: str, name: str, key_type: str = "output", optimization_level: str = "moderate") -> Optional[tuple[ApiKey, str]]:
+    async def create_api_key(self, user_id: str, name: str, key_type: str = "output", optimization_level: str = "moderate") -> Optional[tuple[ApiKey, str]]:
         """Create a new API key for a user and return (ApiKey, full_key)"""
         try:
             full_key, key_prefix = self.generate_api_key()
@@ -141,40 +121,40 @@ class AuthService:
                 "is_active": True
             }
             
-            result = self.supabase.table("api_keys").insert(api_key_dict).execute()
-            if result.data:
-                return ApiKey(**result.data[0]), full_key
+            row = await self.storage.create_api_key(api_key_dict)
+            if row:
+                # Drop any negative entry for this hash
+                self.auth_cache.invalidate_hash(key_hash)
+                return ApiKey(**row), full_key
             return None
         except Exception as e:
             print(f"Error creating API key: {e}")
             return None
     
-    def get_user_api_keys(self, user_id: str) -> list[ApiKey]:
+    async def get_user_api_keys(self, user_id: str) -> list[ApiKey]:
         """Get all API keys for a user"""
         try:
-            result = self.supabase.table("api_keys").select("*").eq("user_id", user_id).order("created_at", desc=True).execute()
-            return [ApiKey(**key) for key in result.data] if result.data else []
+            return [ApiKey(**key) for key in await self.storage.list_api_keys(user_id)]
         except Exception as e:
             print(f"Error getting user API keys: {e}")
             return []
     
-    def deactivate_api_key(self, user_id: str, key_id: str) -> bool:
+    async def deactivate_api_key(self, user_id: str, key_id: str) -> bool:
         """Deactivate an API key"""
         try:
-            result = self.supabase.table("api_keys").update({
-                "is_active": False
-            }).eq("id", key_id).eq("user_id", user_id).execute()
-            
-            return len(result.data) > 0 if result.data else False
+            updated = await self.storage.deactivate_api_key(user_id, key_id)
+            self.auth_cache.invalidate_key_id(key_id)
+            return updated
         except Exception as e:
             print(f"Error deactivating API key: {e}")
             return False
     
-    def delete_api_key(self, user_id: str, key_id: str) -> bool:
+    async def delete_api_key(self, user_id: str, key_id: str) -> bool:
         """Permanently delete an API key"""
         try:
-            result = self.supabase.table("api_keys").delete().eq("id", key_id).eq("user_id", user_id).execute()
-            return len(result.data) > 0 if result.data else False
+            deleted = await self.storage.delete_api_key(user_id, key_id)
+            self.auth_cache.invalidate_key_id(key_id)
+            return deleted
         except Exception as e:
             print(f"Error deleting API key: {e}")
             return False
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-item requests into batches for a synchronous batch function.
+    - Flushes when `max_batch_size` items are waiting or `max_wait_ms` has passed
+    - Runs the batch function in a worker thread so model inference does not block the event loop
+    - One batch runs at a time; items arriving meanwhile form the next batch
+    - If the batch function fails, every item in that batch gets the exception
+    - Flush tasks are held until they finish; aclose() runs what is still queued and awaits them
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        name: str = "batcher"
+    ):
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._timer_sleeping = False
+        # The loop only keeps weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock: Optional[asyncio.Lock] = None
+        self._counters: Dict[str, int] = {"items": 0, "batches": 0, "max_batch": 0}
+
+    async def submit(self, item: Any) -> Any:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._spawn(self._flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = self._spawn(self._flush_later())
+        return await future
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self) -> None:
+        self._timer_sleeping = True
+        try:
+            await asyncio.sleep(self.max_wait)
+        except asyncio.CancelledError:
+            pass  # aclose() cut the wait short
+        finally:
+            self._timer_sleeping = False
+        await self._flush()
+
+    async def _flush(self) -> None:
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[: self.max_batch_size]
+                del self._pending[: self.max_batch_size]
+                batch = [(item, fut) for item, fut in batch if not fut.done()]
+                if not batch:
+                    continue
+                self._counters["items"] += len(batch)
+                self._counters["batches"] += 1
+                self._counters["max_batch"] = max(self._counters["max_batch"], len(batch))
+                try:
+                    results = await asyncio.to_thread(self.fn, [item for item, _ in batch])
+                    if len(results) != len(batch):
+                        raise RuntimeError(f"{self.name}: batch function returned {len(results)} results for {len(batch)} items")
+                except Exception as e:
+                    for _, fut in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                for (_, fut), result in zip(batch, results):
+                    if not fut.done():
+                        fut.set_result(result)
+
+    async def aclose(self) -> None:
+        """Flush queued items now (skipping the wait timer) and wait for every batch in flight."""
+        if self._timer is not None and self._timer_sleeping:
+            # Only while it sleeps: a timer already flushing must not be cancelled mid-batch
+            self._timer.cancel()
+        if self._pending and self._lock is not None:
+            self._spawn(self._flush())
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self._counters["batches"]
+        return {
+            **self._counters,
+            "pending": len(self._pending),
+            "avg_batch": round(self._counters["items"] / batches, 2) if batches else 0.0,
+        }
@@ -1,11 +1,13 @@
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, List, Union
 import logging
 
 import torch
-from transformers import pipeline
+from transformers import pipeline, LogitsProcessorList
 from sentence_transformers import SentenceTransformer, util
 import numpy as np
 
+from .inference_profiler import inference_profiler
+
 
 class QualityAssuredSummarizer:
     def __init__(self, similarity_threshold: float = 0.75):
@@ -24,6 +26,17 @@ class QualityAssuredSummarizer:
         self.max_iterations = 3
         self.logger = logging.getLogger(__name__)
 
+    def _summarize(self, inputs, **kwargs) -> List[Dict[str, Any]]:
+        """BART call with inference profiling; `inputs` is a string or a list of strings."""
+        texts = [inputs] if isinstance(inputs, str) else inputs
+        tokenizer = self.summarizer.tokenizer
+        tokens_in = sum(len(ids) for ids in tokenizer(texts, truncation=True)["input_ids"])
+        with inference_profiler.profile("bart", batch_size=len(texts), tokens_in=tokens_in) as call:
+            outputs = self.summarizer(inputs, logits_processor=LogitsProcessorList([call]), **kwargs)
+            summaries = [o["summary_text"] for o in outputs]
+            call.tokens_out = sum(len(ids) for ids in tokenizer(summaries)["input_ids"])
+        return outputs
+
     def calculate_similarity(self, original: str, compressed: str) -> float:
         """Measure semantic similarity between original and compressed text."""
         original_emb = self.similarity_model.encode(original, convert_to_tensor=True)
@@ -41,7 +54,7 @@ class QualityAssuredSummarizer:
         else:
             return self.extractive_summary(original, n_sentences=2)
 
-        result = self.summarizer(prompt, max_length=120, min_length=50, do_sample=True)[0]
+        result = self._summarize(prompt, max_length=120, min_length=50, do_sample=True)[0]
         return result["summary_text"]
 
     def extractive_summary(self, text: str, n_sentences: int = 3) -> str:
@@ -80,7 +93,7 @@ class QualityAssuredSummarizer:
             if len(original) < 50:
                 return original, 1.0, 0
 
-            summary = self.summarizer(
+            summary = self._summarize(
                 original,
                 max_length=max(30, min(max_length, max(30, len(original) // 3))),
                 min_length=30,
@@ -101,6 +114,55 @@ class QualityAssuredSummarizer:
         similarity = self.calculate_similarity(text, fallback)
         return fallback, similarity, self.max_iterations
 
+    def summarize_batch(
+        self,
+        texts: List[str],
+        max_lengths: List[int],
+        target_similarity: Union[float, List[float]] = 0.75
+    ) -> List[Tuple[str, float, int]]:
+        """
+        First-pass summarization for several texts with batched BART / MiniLM calls.
+        `target_similarity` is one value or one per text.
+        Items that miss their similarity target go through the iterative per-item path.
+        Returns one (summary, similarity, iterations_used) per text, in order.
+        """
+        targets = target_similarity if isinstance(target_similarity, list) else [target_similarity] * len(texts)
+        results: List[Any] = [None] * len(texts)
+        groups: Dict[int, List[int]] = {}
+        for i, text in enumerate(texts):
+            if not text:
+                results[i] = ("", 1.0, 0)
+            elif len(text) < 50:
+                results[i] = (text, 1.0, 0)
+            else:
+                # Same length bound as the first iteration of summarize_with_quality_check
+                length = max(30, min(max_lengths[i], max(30, len(text) // 3)))
+                groups.setdefault(length, []).append(i)
+
+        summaries: Dict[int, str] = {}
+        for length, indices in groups.items():
+            outputs = self._summarize(
+                [texts[i] for i in indices],
+                max_length=length,
+                min_length=30,
+                do_sample=False,
+                batch_size=len(indices)
+            )
+            for i, out in zip(indices, outputs):
+                summaries[i] = out["summary_text"]
+
+        if summaries:
+            order = list(summaries.keys())
+            original_embs = self.similarity_model.encode([texts[i] for i in order], convert_to_tensor=True)
+            summary_embs = self.similarity_model.encode([summaries[i] for i in order], convert_to_tensor=True)
+            scores = util.cos_sim(original_embs, summary_embs).diagonal().tolist()
+            for i, score in zip(order, scores):
+                if score >= targets[i]:
+                    results[i] = (summaries[i], score, 1)
+                else:
+                    results[i] = self.summarize_with_quality_check(texts[i], max_length=max_lengths[i], target_similarity=targets[i])
+        return results
+
 
 def build_quality_summary_response(raw_output: str, final_summary: str, similarity_score: float, iterations: int) -> Dict[str, Any]:
     original_tokens = len(raw_output.split())
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Optional
+
+from .resilience import ProviderHTTPError
+
+
+class GeminiClientCache:
+    """
+    Process-wide cache of Gemini SDK clients.
+    - Calls genai.configure() exactly once instead of on every request
+    - Keeps one GenerativeModel per model name
+    """
+
+    def __init__(self, api_key: Optional[str]):
+        self.api_key = api_key
+        self._genai = None
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self) -> bool:
+        return self._genai is not None
+
+    def configure(self):
+        if self._genai is None:
+            with self._lock:
+                if self._genai is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._genai = genai
+        return self._genai
+
+    def get(self, model: str):
+        client = self._models.get(model)
+        if client is None:
+            genai = self.configure()
+            with self._lock:
+                client = self._models.get(model)
+                if client is None:
+                    client = genai.GenerativeModel(model)
+                    self._models[model] = client
+        return client
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"configured": self.configured, "models": sorted(self._models.keys())}
+
+
+def as_provider_error(exc: Exception) -> Exception:
+    """
+    Map google.api_core errors to ProviderHTTPError (by their HTTP code) so Gemini goes through
+    the same retry / circuit-breaker decisions as the HTTP providers; other errors pass through.
+    """
+    if not type(exc).__module__.startswith("google."):
+        return exc
+    code = getattr(exc, "code", None)
+    status = code if isinstance(code, int) and 100 <= code < 600 else 503
+    return ProviderHTTPError("gemini", status, str(exc))
+
+
+def extract_text(resp: Any) -> str:
+    """Pull text out of a Gemini response or stream chunk without raising on blocked candidates."""
+    try:
+        text = getattr(resp, "text", None)
+        if text:
+            return text
+    except (ValueError, AttributeError):
+        # .text raises when the candidate has no text parts (e.g. safety block)
+        pass
+    candidates = getattr(resp, "candidates", None) or []
+    if not candidates:
+        return ""
+    content = getattr(candidates[0], "content", None)
+    parts = getattr(content, "parts", None) or []
+    return "".join(getattr(p, "text", "") for p in parts)
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class ProviderHTTPClients:
+    """
+    Long-lived httpx.AsyncClient per HTTP-based LLM provider.
+    - One connection pool per provider so TLS sessions are reused across calls
+    - Pool limits, keep-alive expiry and HTTP/2 configurable via env
+    - Per-provider request timeouts
+    - Lightweight request/pool usage stats
+    """
+
+    PROVIDERS = ("openai", "anthropic", "grok", "custom")
+
+    TIMEOUT_ENV = {
+        "openai": "OPENAI_TIMEOUT",
+        "anthropic": "ANTHROPIC_TIMEOUT",
+        "grok": "GROK_TIMEOUT",
+        "custom": "CUSTOM_LLM_TIMEOUT",
+    }
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        http2: Optional[bool] = None,
+        connect_timeout: Optional[float] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+    ):
+        self.max_connections = max_connections or _env_int("LLM_HTTP_MAX_CONNECTIONS", 100)
+        self.max_keepalive_connections = max_keepalive_connections or _env_int("LLM_HTTP_MAX_KEEPALIVE", 20)
+        self.keepalive_expiry = keepalive_expiry or _env_float("LLM_HTTP_KEEPALIVE_EXPIRY", 30.0)
+        self.http2 = _env_bool("LLM_HTTP2") if http2 is None else http2
+        self.connect_timeout = connect_timeout or _env_float("LLM_HTTP_CONNECT_TIMEOUT", 10.0)
+        self.timeouts = {p: _env_float(env, 60.0) for p, env in self.TIMEOUT_ENV.items()}
+        self.timeouts.update(timeouts or {})
+
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._counters: Dict[str, Dict[str, int]] = {
+            p: {"requests": 0, "in_flight": 0, "errors": 0} for p in self.PROVIDERS
+        }
+
+    # --- Lifecycle ---
+
+    def open(self) -> None:
+        """Eagerly create a client for every provider (called from app lifespan)."""
+        for provider in self.PROVIDERS:
+            self.client(provider)
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            try:
+                await client.aclose()
+            except Exception as e:
+                print(f"Warning: failed to close HTTP client: {e}")
+
+    def client(self, provider: str) -> httpx.AsyncClient:
+        """Return the pooled client for a provider, creating it lazily if needed."""
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            client = self._build(provider)
+            self._clients[provider] = client
+        return client
+
+    def _build(self, provider: str) -> httpx.AsyncClient:
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("Warning: LLM_HTTP2 enabled but 'h2' is not installed; falling back to HTTP/1.1")
+                http2 = False
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        timeout = httpx.Timeout(self.timeouts.get(provider, 60.0), connect=self.connect_timeout)
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+    # --- Requests ---
+
+    async def post(self, provider: str, url: str, **kwargs: Any) -> httpx.Response:
+        counters = self._counters.setdefault(provider, {"requests": 0, "in_flight": 0, "errors": 0})
+        counters["requests"] += 1
+        counters["in_flight"] += 1
+        try:
+            return await self.client(provider).post(url, **kwargs)
+        except Exception:
+            counters["errors"] += 1
+            raise
+        finally:
+            counters["in_flight"] -= 1
+
+    @asynccontextmanager
+    async def stream(self, provider: str, method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+        """Streaming request on the pooled client. Read timeout is disabled by default."""
+        counters = self._counters.setdefault(provider, {"requests": 0, "in_flight": 0, "errors": 0})
+        kwargs.setdefault("timeout", httpx.Timeout(None, connect=self.connect_timeout))
+        counters["requests"] += 1
+        counters["in_flight"] += 1
+        try:
+            async with self.client(provider).stream(method, url, **kwargs) as resp:
+                yield resp
+        except Exception:
+            counters["errors"] += 1
+            raise
+        finally:
+            counters["in_flight"] -= 1
+
+    # --- Stats ---
+
+    def stats(self) -> Dict[str, Any]:
+        providers: Dict[str, Any] = {}
+        for provider, counters in self._counters.items():
+            entry: Dict[str, Any] = dict(counters)
+            entry["timeout_s"] = self.timeouts.get(provider)
+            client = self._clients.get(provider)
+            entry["open"] = client is not None and not client.is_closed
+            if entry["open"]:
+                entry.update(self._pool_snapshot(client))
+            providers[provider] = entry
+        return {
+            "limits": {
+                "max_connections": self.max_connections,
+                "max_keepalive_connections": self.max_keepalive_connections,
+                "keepalive_expiry_s": self.keepalive_expiry,
+                "http2": self.http2,
+            },
+            "providers": providers,
+        }
+
+    @staticmethod
+    def _pool_snapshot(client: httpx.AsyncClient) -> Dict[str, int]:
+        # httpx does not expose pool state publicly; read the httpcore pool best-effort
+        try:
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+            idle = sum(1 for c in connections if c.is_idle())
+            return {"connections": len(connections), "idle_connections": idle, "active_connections": len(connections) - idle}
+        except Exception:
+            return {}
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import os
+import resource
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from .metrics import registry, record_inference
+
+try:
+    import torch
+except ImportError:  # optional: memory deltas fall back to process max RSS
+    torch = None
+
+MODEL_PREFILL_SECONDS = registry.histogram(
+    "prompttrim_model_prefill_duration_seconds", "Time to the first generated token (prompt forward pass)", ("model",)
+)
+MODEL_DECODE_SECONDS = registry.histogram(
+    "prompttrim_model_decode_duration_seconds", "Time spent generating tokens after the first", ("model",)
+)
+
+InferenceCallback = Callable[[Dict[str, Any]], None]
+
+
+class InferenceCall:
+    """
+    Measurements for one generate() call; also a logits processor so generation can time itself.
+    - Pass it to generate() inside a LogitsProcessorList: the first call marks the end of prefill
+      (prompt forward pass), every call counts one decode step
+    - Set `tokens_out` after the call (generated tokens across the batch)
+    """
+
+    def __init__(self, model: str, batch_size: int, tokens_in: int):
+        self.model = model
+        self.batch_size = batch_size
+        self.tokens_in = tokens_in
+        self.tokens_out = 0
+        self.steps = 0
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.steps += 1
+        return scores
+
+
+def _cuda_device() -> bool:
+    return torch is not None and torch.cuda.is_available()
+
+
+def _max_rss_bytes() -> int:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class InferenceProfiler:
+    """
+    Per-call TinyLlama / BART stats: tokens in/out, prefill vs decode time, tokens/sec, batch size
+    and peak memory delta.
+    - Aggregates go to /metrics (model histograms and counters) and stats()
+    - The last INFERENCE_STATS_BUFFER calls are kept in a ring buffer (recent())
+    - Callbacks registered with add_callback() get every call's record on the inference thread;
+      keep them cheap
+    - Memory delta is CUDA peak allocation on GPU; on CPU it is growth of the process max RSS,
+      so it only moves when a call sets a new high-water mark
+    - The CUDA peak counter is process-wide: it is reset only when no other profiled call is in
+      flight, so calls that overlap report the peak of the overlap (an upper bound for each)
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = capacity or int(os.getenv("INFERENCE_STATS_BUFFER", 256))
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=self.capacity)
+        self._callbacks: List[InferenceCallback] = []
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._active = 0
+
+    def add_callback(self, fn: InferenceCallback) -> None:
+        self._callbacks.append(fn)
+
+    def remove_callback(self, fn: InferenceCallback) -> None:
+        if fn in self._callbacks:
+            self._callbacks.remove(fn)
+
+    @contextmanager
+    def profile(self, model: str, batch_size: int, tokens_in: int) -> Iterator[InferenceCall]:
+        """Wrap one model call; nothing is recorded if the call raises."""
+        cuda = _cuda_device()
+        if cuda:
+            with self._lock:
+                # Resetting under a concurrent call would hide that call's peak
+                if self._active == 0:
+                    torch.cuda.reset_peak_memory_stats()
+                self._active += 1
+            memory_before = torch.cuda.memory_allocated()
+        else:
+            memory_before = _max_rss_bytes()
+        try:
+            call = InferenceCall(model, batch_size, tokens_in)
+            yield call
+            finished = time.perf_counter()
+            memory_after = torch.cuda.max_memory_allocated() if cuda else _max_rss_bytes()
+        finally:
+            if cuda:
+                with self._lock:
+                    self._active -= 1
+        self._record(call, finished, max(0, memory_after - memory_before), "cuda" if cuda else "cpu")
+
+    def _record(self, call: InferenceCall, finished: float, memory_delta: int, device: str) -> None:
+        total = finished - call.started
+        # Without step callbacks (e.g. pipelines that drop logits processors) the whole call is prefill
+        first = call.first_token_at or finished
+        prefill = first - call.started
+        decode = finished - first
+        decode_tokens = max(0, call.tokens_out - call.batch_size) if call.steps else 0
+        entry = {
+            "timestamp": time.time(),
+            "model": call.model,
+            "device": device,
+            "batch_size": call.batch_size,
+            "tokens_in": call.tokens_in,
+            "tokens_out": call.tokens_out,
+            "steps": call.steps,
+            "prefill_ms": round(prefill * 1000, 2),
+            "decode_ms": round(decode * 1000, 2),
+            "total_ms": round(total * 1000, 2),
+            "tokens_per_sec": round(call.tokens_out / total, 2) if total > 0 else 0.0,
+            "decode_tokens_per_sec": round(decode_tokens / decode, 2) if decode > 0 else 0.0,
+            "peak_memory_delta_bytes": memory_delta,
+        }
+        record_inference(call.model, total, call.batch_size, call.tokens_in, call.tokens_out)
+        MODEL_PREFILL_SECONDS.observe(prefill, call.model)
+        MODEL_DECODE_SECONDS.observe(decode, call.model)
+        with self._lock:
+            totals = self._totals.get(call.model)
+            if totals is None:
+                totals = self._totals[call.model] = {
+                    "calls": 0, "items": 0, "tokens_in": 0, "tokens_out": 0,
+                    "prefill_seconds": 0.0, "decode_seconds": 0.0, "seconds": 0.0, "peak_memory_delta_bytes": 0
+                }
+            totals["calls"] += 1
+            totals["items"] += call.batch_size
+            totals["tokens_in"] += call.tokens_in
+            totals["tokens_out"] += call.tokens_out
+            totals["prefill_seconds"] += prefill
+            totals["decode_seconds"] += decode
+            totals["seconds"] += total
+            totals["peak_memory_delta_bytes"] = max(totals["peak_memory_delta_bytes"], memory_delta)
+        self._recent.append(entry)
+        for fn in list(self._callbacks):
+            try:
+                fn(entry)
+            except Exception as e:
+                print(f"Warning: inference stats callback failed: {e}")
+
+    def recent(self, limit: Optional[int] = None, model: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Most recent call records, newest first."""
+        entries = [e for e in reversed(self._recent) if model is None or e["model"] == model]
+        return entries[:limit] if limit else entries
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {}
+            for model, totals in self._totals.items():
+                seconds = totals["seconds"]
+                models[model] = {
+                    **{k: (round(v, 3) if isinstance(v, float) else v) for k, v in totals.items()},
+                    "avg_tokens_per_sec": round(totals["tokens_out"] / seconds, 2) if seconds > 0 else 0.0,
+                }
+        return {"models": models, "buffered": len(self._recent), "capacity": self.capacity}
+
+
+inference_profiler = InferenceProfiler()
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from . import metrics
+
+JobRunner = Callable[[], Awaitable[Any]]
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+TERMINAL = (SUCCEEDED, FAILED)
+
+
+class JobConflictError(ValueError):
+    """Idempotency key reused with a different request body."""
+
+
+class JobQueueFullError(RuntimeError):
+    pass
+
+
+def fingerprint(payload: Any) -> str:
+    """Stable hash of a request body, used to detect idempotency-key reuse with a different body."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    owner: Optional[str]
+    fingerprint: str
+    runner: Optional[JobRunner] = field(default=None, repr=False)
+    idempotency_key: Optional[str] = None
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    expires_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+    changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        out = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == SUCCEEDED:
+            out["result"] = self.result
+        elif self.status == FAILED:
+            out["error"] = self.error
+            out["status_code"] = self.status_code
+        return out
+
+
+class JobStore:
+    """
+    Background jobs for long-running pipelines (submit now, fetch the result later).
+    - submit() returns immediately; JOB_WORKERS worker tasks drain a bounded queue (JOB_QUEUE_SIZE)
+    - Idempotent on (owner, idempotency key): a retry gets the existing job instead of new work;
+      reusing a key with a different body raises JobConflictError
+    - Finished jobs (and their keys) are kept for JOB_TTL_SECONDS, at most JOB_MAX_JOBS in total
+    - wait() supports long-polling; every status change sets the job's `changed` event, which
+      SSE subscribers also use
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        max_jobs: Optional[int] = None,
+    ):
+        self.workers = workers or int(os.getenv("JOB_WORKERS", 4))
+        self.queue_size = queue_size or int(os.getenv("JOB_QUEUE_SIZE", 1000))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("JOB_TTL_SECONDS", 3600))
+        self.max_jobs = max_jobs or int(os.getenv("JOB_MAX_JOBS", 10000))
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._keys: Dict[Tuple[Optional[str], str], str] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        self._counters: Dict[str, int] = {
+            "submitted": 0, "deduplicated": 0, "succeeded": 0, "failed": 0, "expired": 0, "rejected": 0
+        }
+
+    def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.ensure_future(self._worker()))
+
+    async def aclose(self) -> None:
+        """Stop the workers; queued and running jobs are marked failed so pollers are released."""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        for job in self._jobs.values():
+            if job.status not in TERMINAL:
+                self._finish(job, FAILED, error="Server shutting down", status_code=503)
+
+    def submit(
+        self,
+        kind: str,
+        runner: JobRunner,
+        owner: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+        payload: Any = None
+    ) -> Tuple[Job, bool]:
+        """Queue `runner`; returns (job, created). created is False when an idempotent retry matched."""
+        self._evict()
+        digest = fingerprint({"kind": kind, "payload": payload})
+        if idempotency_key:
+            existing = self._jobs.get(self._keys.get((owner, idempotency_key), ""))
+            if existing is not None:
+                if existing.fingerprint != digest:
+                    raise JobConflictError("Idempotency-Key was already used with a different request")
+                self._counters["deduplicated"] += 1
+                return existing, False
+        if self._queue is None:
+            self.start()
+        job = Job(id=str(uuid.uuid4()), kind=kind, owner=owner, fingerprint=digest, runner=runner, idempotency_key=idempotency_key)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._counters["rejected"] += 1
+            raise JobQueueFullError("Job queue is full, retry later")
+        self._jobs[job.id] = job
+        if idempotency_key:
+            self._keys[(owner, idempotency_key)] = job.id
+        self._counters["submitted"] += 1
+        return job, True
+
+    def get(self, job_id: str, owner: Optional[str] = None) -> Optional[Job]:
+        """Job by id; other owners' jobs are reported as missing."""
+        job = self._jobs.get(job_id)
+        if job is None or job.owner != owner:
+            return None
+        if job.expires_at is not None and job.expires_at <= time.time():
+            self._drop(job)
+            self._counters["expired"] += 1
+            return None
+        return job
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """Long-poll: return once the job finishes or `timeout` seconds pass."""
+        deadline = time.monotonic() + timeout
+        while job.status not in TERMINAL:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await self.wait_changed(job, remaining)
+        return job
+
+    async def wait_changed(self, job: Job, timeout: float) -> bool:
+        """Wait for the next status change; False on timeout."""
+        event = job.changed
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _notify(self, job: Job) -> None:
+        # Wake current waiters, then arm a fresh event for the next change
+        event, job.changed = job.changed, asyncio.Event()
+        event.set()
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None, status_code: Optional[int] = None) -> None:
+        job.status = status
+        job.result = result
+        job.error = error
+        job.status_code = status_code
+        job.runner = None
+        job.finished_at = time.time()
+        job.expires_at = job.finished_at + self.ttl_seconds
+        self._counters[status] += 1
+        self._notify(job)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        if job.status != QUEUED:
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._notify(job)
+        # Stage spans inside the pipeline are labelled with the job kind
+        timings = metrics.begin_request()
+        try:
+            result = await job.runner()
+        except asyncio.CancelledError:
+            self._finish(job, FAILED, error="Server shutting down", status_code=503)
+            raise
+        except Exception as e:
+            self._finish(job, FAILED, error=str(getattr(e, "detail", None) or e), status_code=getattr(e, "status_code", 500))
+        else:
+            self._finish(job, SUCCEEDED, result=result)
+        finally:
+            timings.resolve(f"job:{job.kind}")
+
+    def _drop(self, job: Job) -> None:
+        self._jobs.pop(job.id, None)
+        if job.idempotency_key and self._keys.get((job.owner, job.idempotency_key)) == job.id:
+            del self._keys[(job.owner, job.idempotency_key)]
+
+    def _evict(self) -> None:
+        """Drop expired finished jobs, then the oldest finished ones while over max_jobs."""
+        now = time.time()
+        for job in [j for j in self._jobs.values() if j.expires_at is not None and j.expires_at <= now]:
+            self._drop(job)
+            self._counters["expired"] += 1
+        if len(self._jobs) >= self.max_jobs:
+            for job in [j for j in self._jobs.values() if j.status in TERMINAL][: len(self._jobs) - self.max_jobs + 1]:
+                self._drop(job)
+                self._counters["expired"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            **self._counters,
+            "jobs": by_status,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "workers": len(self._tasks),
+            "ttl_seconds": self.ttl_seconds,
+        }
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import jsonschema
+except ImportError:  # optional: schema validation is skipped without it
+    jsonschema = None
+
+_OPENERS = re.compile(r"[{\[]")
+# Next character that matters while inside a JSON value / inside a string
+_STRUCTURAL = re.compile(r'["{}\[\]]')
+_STRING_END = re.compile(r'["\\]')
+_FENCE = re.compile(r"```[A-Za-z0-9_-]*[ \t]*\n?")
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(?:(")|(\\)?)|[{}\[\],:]|[^"{}\[\],:]+', re.S)
+_LITERALS = ("true", "false", "null")
+# Cheap check that an opener can start a JSON value ("{placeholder}" / "[note]" in prose cannot)
+_PLAUSIBLE = re.compile(r'\{\s*(?:["}]|\Z)|\[\s*(?:[-\d"{\[\]]|true|false|null|\Z)')
+_CLOSERS = {"{": "}", "[": "]"}
+
+# An unmatched "{" in prose swallows the rest of the text as one truncated span; rescan past it
+# at most this many times (each rescan is linear, so the total stays bounded)
+MAX_RESCANS = 8
+
+
+@dataclass
+class JSONExtraction:
+    value: Any = None
+    text: Optional[str] = None
+    found: bool = False
+    repaired: bool = False
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def valid(self) -> bool:
+        return self.found and not self.errors
+
+
+def strip_code_fences(text: str) -> str:
+    """Contents of the first ``` fenced block (to the end of text if the fence is never closed)."""
+    m = _FENCE.search(text)
+    if not m:
+        return text
+    end = text.find("```", m.end())
+    return text[m.end():] if end == -1 else text[m.end():end]
+
+
+def iter_json_spans(text: str, start: int = 0) -> Iterator[Tuple[int, int, bool]]:
+    """
+    Yield (start, end, complete) for each balanced top-level object/array, in one pass.
+    Strings and escapes are skipped with regex jumps, so braces inside strings never count.
+    A value still open at end of text (truncated output) is yielded with complete=False.
+    """
+    n = len(text)
+    pos = start
+    while True:
+        m = _OPENERS.search(text, pos)
+        if not m:
+            return
+        begin = m.start()
+        depth = 0
+        i = begin
+        while True:
+            m = _STRUCTURAL.search(text, i)
+            if not m:
+                yield begin, n, False
+                return
+            ch = m.group()
+            i = m.end()
+            if ch == '"':
+                while True:
+                    s = _STRING_END.search(text, i)
+                    if not s:
+                        yield begin, n, False
+                        return
+                    if s.group() == "\\":
+                        i = s.end() + 1
+                        continue
+                    i = s.end()
+                    break
+            elif ch in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    yield begin, i, True
+                    pos = i
+                    break
+
+
+def repair_json(fragment: str) -> str:
+    """
+    Fix common LLM JSON mistakes in one pass:
+    trailing commas, unterminated strings / literals / containers at truncation,
+    dangling keys or colons, and stray closing brackets.
+    """
+    out: List[str] = []
+    # Open containers (their closers) and, per frame, what an object expects next
+    closers: List[str] = []
+    states: List[str] = []
+
+    def drop_trailing_comma() -> None:
+        j = len(out) - 1
+        while j >= 0 and out[j].isspace():
+            j -= 1
+        if j >= 0 and out[j] == ",":
+            del out[j]
+
+    for m in _TOKEN.finditer(fragment):
+        tok = m.group()
+        first = tok[0]
+        if first == '"':
+            if not m.group(1):
+                # Unterminated at truncation: drop a dangling escape and close the string
+                tok = (tok[:-1] if m.group(2) else tok) + '"'
+            out.append(tok)
+            if closers and closers[-1] == "}":
+                states[-1] = "colon" if states[-1] == "key" else "comma"
+        elif first == "{" or first == "[":
+            out.append(tok)
+            closers.append(_CLOSERS[first])
+            states.append("key")
+        elif first == "}" or first == "]":
+            if tok not in closers:
+                continue
+            while closers:
+                closer = closers.pop()
+                states.pop()
+                drop_trailing_comma()
+                out.append(closer)
+                if closer == tok:
+                    break
+            if closers:
+                states[-1] = "comma"
+        elif first == ",":
+            out.append(tok)
+            if closers:
+                states[-1] = "key"
+        elif first == ":":
+            out.append(tok)
+            if closers:
+                states[-1] = "value"
+        else:
+            out.append(tok)
+            if closers and not tok.isspace():
+                states[-1] = "comma"
+
+    if closers:
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1][0] not in '"{}[],:':
+            # Truncated literal or number: complete the literal, drop a dangling exponent/sign/point
+            tail = out[-1].strip()
+            for literal in _LITERALS:
+                if literal.startswith(tail):
+                    out[-1] = literal
+                    break
+            else:
+                tail = tail.rstrip("eE+-.")
+                if tail:
+                    out[-1] = tail
+                else:
+                    out.pop()
+                    states[-1] = "value" if closers[-1] == "}" else "key"
+        drop_trailing_comma()
+        if closers[-1] == "}":
+            if states[-1] == "colon":
+                out.append(": null")
+            elif states[-1] == "value":
+                out.append(" null")
+        while closers:
+            drop_trailing_comma()
+            out.append(closers.pop())
+    return "".join(out)
+
+
+@lru_cache(maxsize=64)
+def _compiled_validator(schema_json: str):
+    schema = json.loads(schema_json)
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def validate(value: Any, schema: Dict[str, Any]) -> List[str]:
+    """Schema errors for `value` (empty list when valid). Validators are compiled once per schema."""
+    if jsonschema is None:
+        return ["jsonschema is not installed; schema not validated"]
+    try:
+        validator = _compiled_validator(json.dumps(schema, sort_keys=True))
+    except jsonschema.SchemaError as e:
+        return [f"invalid schema: {e.message}"]
+    errors = []
+    for err in validator.iter_errors(value):
+        where = "/".join(str(p) for p in err.absolute_path) or "$"
+        errors.append(f"{where}: {err.message}")
+    return errors
+
+
+def _parse(candidate: str) -> Tuple[bool, Any, bool, str]:
+    try:
+        return True, json.loads(candidate), False, candidate
+    except ValueError:
+        pass
+    fixed = repair_json(candidate)
+    try:
+        return True, json.loads(fixed), True, fixed
+    except ValueError:
+        return False, None, True, fixed
+
+
+def extract_json(text: str, schema: Optional[Dict[str, Any]] = None) -> JSONExtraction:
+    """
+    Find the JSON object/array in model output.
+    Order: whole text, then code-fenced block, then balanced spans from a single scan,
+    repairing each candidate if it does not parse. With a schema, the first candidate that
+    validates wins. Otherwise a whole-text / fenced value wins outright; among the spans
+    objects beat arrays and longer spans beat shorter ones, so a citation like "[1]" before the
+    answer is not picked over it. Spans nested in a repaired (truncated) value are not candidates.
+    """
+    text = text or ""
+    body = strip_code_fences(text) if "```" in text else text
+    stripped = body.strip()
+    if stripped[:1] not in ("{", "["):
+        stripped = ""
+
+    best: Optional[JSONExtraction] = None
+    best_rank: Tuple[bool, int, bool] = (False, -1, False)
+    covered: List[Tuple[int, int]] = []
+    for begin, end, candidate in _candidates(stripped, body):
+        if any(b <= begin and end <= e for b, e in covered):
+            continue
+        ok, value, repaired, fixed = _parse(candidate)
+        if not ok:
+            continue
+        if repaired:
+            covered.append((begin, end))
+        errors = validate(value, schema) if schema is not None else []
+        result = JSONExtraction(value=value, text=fixed, found=True, repaired=repaired, errors=errors)
+        if schema is not None and not errors:
+            return result
+        if schema is None and candidate is stripped:
+            return result  # every other span lies inside it
+        rank = (isinstance(value, dict), end - begin, not repaired)
+        if rank > best_rank:
+            best, best_rank = result, rank
+    if best is not None:
+        return best
+    return JSONExtraction(errors=["no JSON object or array found"])
+
+
+def _candidates(head: str, body: str) -> Iterator[Tuple[int, int, str]]:
+    """(start, end, text) of each candidate; the whole-text head spans all of `body`."""
+    if head:
+        yield 0, len(body), head
+    start = 0
+    for _ in range(MAX_RESCANS + 1):
+        rescan = None
+        for begin, end, complete in iter_json_spans(body, start):
+            if not complete:
+                rescan = begin + 1
+            if _PLAUSIBLE.match(body, begin):
+                yield begin, end, body[begin:end]
+        if rescan is None:
+            return
+        start = rescan
+
+
+def benchmark(size_mb: float = 4.0, iterations: int = 3) -> Dict[str, Dict[str, float]]:
+    """extract_json throughput (MB/s) on multi-MB prose with a trailing object, and on a large JSON document."""
+    prose = "The answer follows after some discussion of {placeholders} and [notes]. " * 64
+    record = {"id": 1, "name": "widget", "tags": ["a", "b"], "note": 'braces } and "quotes" inside strings'}
+    target = int(size_mb * 1024 * 1024)
+    samples = {
+        "prose_then_object": (prose * max(1, target // len(prose))) + json.dumps({"items": [record] * 100}) + ",\n",
+        "large_document": json.dumps({"items": [record] * max(1, target // len(json.dumps(record)))})[:-2] + ",",
+    }
+    report: Dict[str, Dict[str, float]] = {}
+    for name, sample in samples.items():
+        size = len(sample.encode("utf-8")) / (1024 * 1024)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            result = extract_json(sample)
+        elapsed = time.perf_counter() - started
+        report[name] = {
+            "size_mb": round(size, 2),
+            "mb_per_s": round(size * iterations / elapsed, 2) if elapsed > 0 else 0.0,
+            "found": result.found,
+            "repaired": result.repaired,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    print(json.dumps(benchmark(), indent=2))
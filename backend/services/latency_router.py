@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+Target = Tuple[str, str]  # (provider, model)
+
+
+class TargetStats:
+    """EWMA latency / error rate plus a window of recent latencies for one (provider, model)."""
+
+    def __init__(self, alpha: float, window: int):
+        self.alpha = alpha
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error = 0.0
+        self.samples = 0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.samples += 1
+        if ok:
+            # Only successful calls say anything meaningful about latency
+            self.recent.append(latency)
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+        self.ewma_error = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.ewma_error
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        idx = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def to_dict(self) -> Dict[str, Any]:
+        p95 = self.percentile(0.95)
+        return {
+            "samples": self.samples,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "ewma_error_rate": round(self.ewma_error, 3),
+            "p95_latency_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class LatencyAwareRouter:
+    """
+    Picks the fastest healthy (provider, model) from an allowed set and optionally
+    hedges: if the primary has not answered by its p95 latency, a duplicate request
+    goes to the next-best target and whichever finishes first wins.
+    """
+
+    def __init__(
+        self,
+        alpha: Optional[float] = None,
+        window: int = 200,
+        max_error_rate: Optional[float] = None,
+        min_samples_for_p95: int = 20,
+        default_hedge_delay: Optional[float] = None,
+    ):
+        self.alpha = alpha or float(os.getenv("LLM_ROUTING_EWMA_ALPHA", 0.2))
+        self.window = window
+        self.max_error_rate = max_error_rate or float(os.getenv("LLM_ROUTING_MAX_ERROR_RATE", 0.5))
+        self.min_samples_for_p95 = min_samples_for_p95
+        # Used until a target has enough samples for a meaningful p95
+        self.default_hedge_delay = default_hedge_delay or float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_MS", 2000)) / 1000
+        self._stats: Dict[Target, TargetStats] = {}
+
+    def _get(self, target: Target) -> TargetStats:
+        stats = self._stats.get(target)
+        if stats is None:
+            stats = self._stats[target] = TargetStats(self.alpha, self.window)
+        return stats
+
+    def record(self, provider: str, model: str, latency: float, ok: bool) -> None:
+        self._get((provider, model)).record(latency, ok)
+
+    def is_healthy(self, target: Target) -> bool:
+        return self._get(target).ewma_error < self.max_error_rate
+
+    def rank(self, targets: List[Target]) -> List[Target]:
+        """
+        Order targets fastest-first. Targets with no latency data keep their
+        requested order ahead of measured ones so they get explored.
+        Unhealthy targets go last (they are still tried if nothing else is left).
+        """
+        def key(item):
+            position, target = item
+            stats = self._get(target)
+            unhealthy = not self.is_healthy(target)
+            latency = stats.ewma_latency if stats.ewma_latency is not None else -1.0
+            return (unhealthy, latency, position)
+
+        unique = list(dict.fromkeys(targets))
+        return [t for _, t in sorted(enumerate(unique), key=key)]
+
+    def hedge_delay(self, target: Target) -> float:
+        stats = self._get(target)
+        if len(stats.recent) >= self.min_samples_for_p95:
+            return stats.percentile(0.95) or self.default_hedge_delay
+        return self.default_hedge_delay
+
+    async def run(
+        self,
+        targets: List[Target],
+        call: Callable[[str, str], Awaitable[Dict[str, Any]]],
+        hedge: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Execute `call(provider, model)` against the best target, hedging to the
+        runner-up if requested. The winning result is annotated with the
+        provider/model that served it and whether a hedge was fired.
+        """
+        ranked = self.rank(targets)
+        if not ranked:
+            return {"error": "No routing targets supplied"}
+
+        primary = ranked[0]
+        secondary = ranked[1] if hedge and len(ranked) > 1 else None
+
+        def _annotate(result: Dict[str, Any], target: Target, hedged: bool) -> Dict[str, Any]:
+            result = dict(result)
+            result["provider"], result["model"] = target
+            result["hedged"] = hedged
+            return result
+
+        primary_task = asyncio.ensure_future(call(*primary))
+        if secondary is None:
+            result = await primary_task
+            if result.get("error") and len(ranked) > 1:
+                # Primary failed outright: fall back to the next target
+                fallback = ranked[1]
+                return _annotate(await call(*fallback), fallback, False)
+            return _annotate(result, primary, False)
+
+        done, _ = await asyncio.wait({primary_task}, timeout=self.hedge_delay(primary))
+        if done:
+            result = primary_task.result()
+            if not result.get("error"):
+                return _annotate(result, primary, False)
+            return _annotate(await call(*secondary), secondary, False)
+
+        secondary_task = asyncio.ensure_future(call(*secondary))
+        tasks = {primary_task: primary, secondary_task: secondary}
+        pending = set(tasks)
+        last_result: Dict[str, Any] = {"error": "All routing targets failed"}
+        last_target = primary
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    last_result, last_target = result, tasks[task]
+                    if not result.get("error"):
+                        return _annotate(result, tasks[task], True)
+            return _annotate(last_result, last_target, True)
+        finally:
+            # Cancel the loser so we stop waiting on (and paying for) it
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {f"{provider}:{model}": s.to_dict() for (provider, model), s in self._stats.items()}
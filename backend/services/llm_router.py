@@ -1,13 +1,59 @@
+import asyncio
+import json
 import os
-from typing import Any, Dict, Optional
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import httpx
+from .gemini_clients import GeminiClientCache, as_provider_error, extract_text as gemini_extract_text
+from .http_clients import ProviderHTTPClients
+from .latency_router import LatencyAwareRouter
+from .rate_limiter import RateLimitScheduler
+from .resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    ProviderHTTPError,
+    ResiliencePolicy,
+)
+from .response_cache import CacheLookup, ResponseCache
 from .token_counter import OpenAITokenCounter
-from ..pipelines.output.tokenization.openai_tokenizer import count_text as openai_count
-from ..pipelines.output.tokenization.anthropic_tokenizer import estimate_tokens as anthropic_estimate
-from ..pipelines.output.tokenization.grok_tokenizer import estimate_tokens as grok_estimate
-from ..pipelines.output.tokenization.custom_tokenizer import estimate_tokens as custom_estimate
-from ..pipelines.output.tokenization.gemini_tokenizer import estimate_tokens as gemini_estimate
+from pipelines.output.tokenization.openai_tokenizer import count_text as openai_count
+from pipelines.output.tokenization.anthropic_tokenizer import estimate_tokens as anthropic_estimate
+from pipelines.output.tokenization.grok_tokenizer import estimate_tokens as grok_estimate
+from pipelines.output.tokenization.custom_tokenizer import estimate_tokens as custom_estimate
+from pipelines.output.tokenization.gemini_tokenizer import estimate_tokens as gemini_estimate
+
+RequestSpec = Tuple[str, Dict[str, str], Dict[str, Any]]
+
+
+def _sse_data(line: str) -> Optional[str]:
+    """Return the payload of an SSE `data:` line (or a bare NDJSON line); None for everything else."""
+    line = (line or "").strip()
+    if not line or line.startswith(":") or line.startswith("event:") or line.startswith("id:") or line.startswith("retry:"):
+        return None
+    if line.startswith("data:"):
+        return line[5:].strip()
+    return line
+
+
+def _openai_delta(obj: Dict[str, Any]) -> str:
+    # OpenAI / Grok chat.completion.chunk
+    return ((obj.get("choices") or [{}])[0].get("delta") or {}).get("content") or ""
+
+
+def _anthropic_delta(obj: Dict[str, Any]) -> str:
+    # Messages API: content_block_delta events carry text_delta payloads
+    if obj.get("type") != "content_block_delta":
+        return ""
+    delta = obj.get("delta") or {}
+    return delta.get("text", "") if delta.get("type") == "text_delta" else ""
+
+
+def _custom_delta(obj: Dict[str, Any]) -> str:
+    if obj.get("choices"):
+        return _openai_delta(obj)
+    return obj.get("text") or obj.get("output") or obj.get("delta") or ""
 
 
 class LLMRouter:
@@ -33,26 +79,180 @@ class LLMRouter:
             "gemini": os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
         }
 
-    async def call(self, provider: str, prompt: str, max_output_tokens: int = 256, model: Optional[str] = None) -> Dict[str, Any]:
+        # Long-lived pooled HTTP clients (one per provider)
+        self.http = ProviderHTTPClients()
+        # Gemini goes through the SDK; configure once and cache models
+        self.gemini = GeminiClientCache(self.gemini_api_key)
+        # EWMA latency/error tracking for latency-aware routing
+        self.latency = LatencyAwareRouter()
+        # Per-(provider, model) RPM/TPM buckets with fair per-key queueing
+        self.scheduler = RateLimitScheduler()
+        # Async retries with jittered backoff + a circuit breaker per provider
+        self.resilience = ResiliencePolicy()
+        self.breakers = {provider: CircuitBreaker(provider) for provider in self.default_models}
+        # Optional response cache (attached by the app once an embedder is available)
+        self.cache: Optional[ResponseCache] = None
+
+    # --- Lifecycle ---
+
+    async def startup(self) -> None:
+        """Open pooled provider clients. Called from the app lifespan."""
+        self.http.open()
+        if self.gemini_api_key:
+            try:
+                self.gemini.configure()
+                self.gemini.get(self.default_models["gemini"])
+            except Exception as e:
+                print(f"Warning: Gemini client setup failed: {e}")
+
+    async def aclose(self) -> None:
+        """Close pooled provider clients. Called at app shutdown."""
+        await self.http.aclose()
+        self.gemini.clear()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        stats = self.http.stats()
+        stats["gemini"] = self.gemini.stats()
+        return stats
+
+    def routing_stats(self) -> Dict[str, Any]:
+        return self.latency.stats()
+
+    def rate_limit_stats(self) -> Dict[str, Any]:
+        return self.scheduler.stats()
+
+    def breaker_stats(self) -> Dict[str, Any]:
+        return {provider: breaker.to_dict() for provider, breaker in self.breakers.items()}
+
+    def resolve_model(self, provider: str, model: Optional[str] = None) -> str:
         provider = (provider or "").lower()
+        if provider not in self.default_models:
+            raise ValueError(f"Unsupported provider: {provider}")
+        return model or self.default_models[provider]
+
+    # --- Response cache ---
+
+    async def cache_lookup(
+        self,
+        scope: str,
+        provider: str,
+        prompt: str,
+        max_output_tokens: int,
+        model: Optional[str] = None
+    ) -> Optional[CacheLookup]:
+        """Exact, then semantic lookup within the tenant `scope`. Returns None when no cache is attached."""
+        if self.cache is None:
+            return None
+        provider = (provider or "").lower()
+        return await self.cache.lookup(scope, provider, self.resolve_model(provider, model), prompt, max_output_tokens)
+
+    def cache_store(self, lookup: Optional[CacheLookup], result: Dict[str, Any]) -> None:
+        """Results from call_fastest are stored under the provider/model that actually served them."""
+        if self.cache is not None and lookup is not None:
+            self.cache.store(lookup, result, provider=result.get("provider"), model=result.get("model"))
+
+    async def call(
+        self,
+        provider: str,
+        prompt: str,
+        max_output_tokens: int = 256,
+        model: Optional[str] = None,
+        api_key_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        provider = (provider or "").lower()
+        model = self.resolve_model(provider, model)
+        if not await self._admit(provider, model, prompt, max_output_tokens, api_key_id):
+            return {"error": f"Rate limit queue timeout for {provider}:{model}"}
+        started = time.perf_counter()
+        ok = False
+        cancelled = False
+        try:
+            result = await self.resilience.execute(
+                self._dispatch, provider, prompt, max_output_tokens, model,
+                breaker=self.breakers[provider]
+            )
+            ok = not result.get("error")
+            return result
+        except CircuitOpenError as e:
+            return {"error": str(e), "status_code": 503}
+        except (DeadlineExceededError, asyncio.TimeoutError):
+            return {"error": f"{provider} call timed out", "status_code": 504}
+        except (ProviderHTTPError, httpx.TransportError) as e:
+            return {"error": f"{provider} call failed: {e}", "status_code": 502}
+        except Exception as e:
+            # SDK / parsing errors that the policy does not classify
+            return {"error": f"{provider} call failed: {e}", "status_code": 502}
+        except asyncio.CancelledError:
+            # Hedge loser / client gone: neither a latency sample nor an error for routing
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                self.latency.record(provider, model, time.perf_counter() - started, ok)
+
+    async def call_fastest(
+        self,
+        targets: List[Tuple[str, Optional[str]]],
+        prompt: str,
+        max_output_tokens: int = 256,
+        hedge: bool = False,
+        api_key_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Latency-aware call: route to the fastest healthy (provider, model) among
+        `targets`, optionally hedging to the runner-up once the primary passes
+        its p95 latency. The result carries the serving provider/model.
+        """
+        try:
+            resolved = [((provider or "").lower(), self.resolve_model(provider, model)) for provider, model in targets]
+        except ValueError as e:
+            return {"error": str(e), "status_code": 400}
+
+        async def _attempt(provider: str, model: str) -> Dict[str, Any]:
+            try:
+                return await self.call(provider, prompt, max_output_tokens, model, api_key_id=api_key_id)
+            except Exception as e:
+                return {"error": f"{provider} call failed: {e}"}
+
+        return await self.latency.run(resolved, _attempt, hedge=hedge)
+
+    async def _admit(self, provider: str, model: str, prompt: str, max_output_tokens: int, api_key_id: Optional[str]) -> bool:
+        """Wait for RPM/TPM capacity. Providers count max_tokens against TPM, so include it."""
+        tokens = self.estimate_tokens(provider, prompt) + max_output_tokens
+        try:
+            await self.scheduler.acquire(provider, model, tokens, key_id=api_key_id)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _post(self, provider: str, model: str, url: str, headers: Dict[str, str], payload: Dict[str, Any]):
+        resp = await self.http.post(provider, url, headers=headers, json=payload)
+        self.scheduler.observe(provider, model, resp.headers, resp.status_code)
+        if resp.status_code >= 400:
+            # Let the resilience layer decide whether this status is worth retrying
+            raise ProviderHTTPError.from_response(provider, resp)
+        return resp
+
+    async def _dispatch(self, provider: str, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
         if provider == "openai":
-            return await self._call_openai(prompt, max_output_tokens, model or self.default_models["openai"])
+            return await self._call_openai(prompt, max_output_tokens, model)
         if provider == "anthropic":
-            return await self._call_anthropic(prompt, max_output_tokens, model or self.default_models["anthropic"])
+            return await self._call_anthropic(prompt, max_output_tokens, model)
         if provider == "grok":
-            return await self._call_grok(prompt, max_output_tokens, model or self.default_models["grok"])
+            return await self._call_grok(prompt, max_output_tokens, model)
         if provider == "custom":
-            return await self._call_custom(prompt, max_output_tokens, model or self.default_models["custom"])
-        if provider == "gemini":
-            return await self._call_gemini(prompt, max_output_tokens, model or self.default_models["gemini"])
-        raise ValueError(f"Unsupported provider: {provider}")
+            return await self._call_custom(prompt, max_output_tokens, model)
+        return await self._call_gemini(prompt, max_output_tokens, model)
 
     # --- Provider branches ---
 
-    async def _call_openai(self, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
+    # Request builders return (url, headers, payload), or None when the provider is not configured.
+    # They are shared by the blocking calls and the streaming branches.
+
+    def _openai_request(self, prompt: str, max_output_tokens: int, model: str) -> Optional[RequestSpec]:
         if not self.openai_api_key:
-            return {"error": "OPENAI_API_KEY not configured"}
-        url = "https://api.openai.com/v1/chat/completions"
+            return None
+        url = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1/chat/completions")
         headers = {
             "Authorization": f"Bearer {self.openai_api_key}",
             "Content-Type": "application/json"
@@ -65,16 +265,12 @@ class LLMRouter:
             "max_tokens": max_output_tokens,
             "temperature": 0.3
         }
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(url, headers=headers, json=payload)
-            data = resp.json()
-        text = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
-        return {"text": text, "raw": data}
+        return url, headers, payload
 
-    async def _call_anthropic(self, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
+    def _anthropic_request(self, prompt: str, max_output_tokens: int, model: str) -> Optional[RequestSpec]:
         if not self.anthropic_api_key:
-            return {"error": "ANTHROPIC_API_KEY not configured"}
-        url = "https://api.anthropic.com/v1/messages"
+            return None
+        url = os.getenv("ANTHROPIC_API_BASE", "https://api.anthropic.com/v1/messages")
         headers = {
             "x-api-key": self.anthropic_api_key,
             "anthropic-version": "2023-06-01",
@@ -87,16 +283,11 @@ class LLMRouter:
                 {"role": "user", "content": prompt}
             ]
         }
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(url, headers=headers, json=payload)
-            data = resp.json()
-        content = data.get("content") or []
-        text = "".join([c.get("text", "") for c in content if c.get("type") == "text"]) if isinstance(content, list) else ""
-        return {"text": text, "raw": data}
+        return url, headers, payload
 
-    async def _call_grok(self, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
+    def _grok_request(self, prompt: str, max_output_tokens: int, model: str) -> Optional[RequestSpec]:
         if not self.grok_api_key:
-            return {"error": "GROK_API_KEY not configured"}
+            return None
         # xAI Grok (OpenAI-compatible in some SDKs); fallback to placeholder endpoint
         url = os.getenv("GROK_API_BASE", "https://api.x.ai/v1/chat/completions")
         headers = {
@@ -111,15 +302,11 @@ class LLMRouter:
             "max_tokens": max_output_tokens,
             "temperature": 0.3
         }
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(url, headers=headers, json=payload)
-            data = resp.json()
-        text = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
-        return {"text": text, "raw": data}
+        return url, headers, payload
 
-    async def _call_custom(self, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
+    def _custom_request(self, prompt: str, max_output_tokens: int, model: str) -> Optional[RequestSpec]:
         if not self.custom_llm_endpoint:
-            return {"error": "CUSTOM_LLM_ENDPOINT not configured"}
+            return None
         headers = {"Content-Type": "application/json"}
         if self.custom_llm_api_key:
             headers["Authorization"] = f"Bearer {self.custom_llm_api_key}"
@@ -128,30 +315,175 @@ class LLMRouter:
             "prompt": prompt,
             "max_tokens": max_output_tokens
         }
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(self.custom_llm_endpoint, headers=headers, json=payload)
-            data = resp.json()
+        return self.custom_llm_endpoint, headers, payload
+
+    async def _call_openai(self, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
+        spec = self._openai_request(prompt, max_output_tokens, model)
+        if spec is None:
+            return {"error": "OPENAI_API_KEY not configured"}
+        url, headers, payload = spec
+        resp = await self._post("openai", model, url, headers, payload)
+        data = resp.json()
+        text = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
+        return {"text": text, "raw": data}
+
+    async def _call_anthropic(self, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
+        spec = self._anthropic_request(prompt, max_output_tokens, model)
+        if spec is None:
+            return {"error": "ANTHROPIC_API_KEY not configured"}
+        url, headers, payload = spec
+        resp = await self._post("anthropic", model, url, headers, payload)
+        data = resp.json()
+        content = data.get("content") or []
+        text = "".join([c.get("text", "") for c in content if c.get("type") == "text"]) if isinstance(content, list) else ""
+        return {"text": text, "raw": data}
+
+    async def _call_grok(self, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
+        spec = self._grok_request(prompt, max_output_tokens, model)
+        if spec is None:
+            return {"error": "GROK_API_KEY not configured"}
+        url, headers, payload = spec
+        resp = await self._post("grok", model, url, headers, payload)
+        data = resp.json()
+        text = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
+        return {"text": text, "raw": data}
+
+    async def _call_custom(self, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
+        spec = self._custom_request(prompt, max_output_tokens, model)
+        if spec is None:
+            return {"error": "CUSTOM_LLM_ENDPOINT not configured"}
+        url, headers, payload = spec
+        resp = await self._post("custom", model, url, headers, payload)
+        data = resp.json()
         text = data.get("text") or data.get("output") or ""
         return {"text": text, "raw": data}
 
     async def _call_gemini(self, prompt: str, max_output_tokens: int, model: str) -> Dict[str, Any]:
         if not self.gemini_api_key:
             return {"error": "GEMINI_API_KEY not configured"}
+        # Errors propagate (as ProviderHTTPError where classifiable) so retries and the breaker see them
+        client = self.gemini.get(model)
         try:
-            import google.generativeai as genai
-            genai.configure(api_key=self.gemini_api_key)
-            # Use the SDK with a text-only request
-            client = genai.GenerativeModel(model)
             resp = await client.generate_content_async(prompt, generation_config={"max_output_tokens": max_output_tokens})
-            text = ""
-            if hasattr(resp, "text"):
-                text = resp.text or ""
-            elif hasattr(resp, "candidates") and resp.candidates:
-                parts = getattr(resp.candidates[0], "content", {}).get("parts", [])
-                text = "".join([getattr(p, "text", "") for p in parts])
-            return {"text": text, "raw": getattr(resp, "to_dict", lambda: {} )() if hasattr(resp, "to_dict") else {}}
         except Exception as e:
-            return {"error": f"Gemini call failed: {e}"}
+            raise as_provider_error(e) from e
+        text = gemini_extract_text(resp)
+        return {"text": text, "raw": resp.to_dict() if hasattr(resp, "to_dict") else {}}
+
+    async def _open_gemini_stream(self, prompt: str, max_output_tokens: int, model: str):
+        client = self.gemini.get(model)
+        try:
+            return await client.generate_content_async(
+                prompt,
+                generation_config={"max_output_tokens": max_output_tokens},
+                stream=True
+            )
+        except Exception as e:
+            raise as_provider_error(e) from e
+
+    # --- Streaming ---
+
+    async def stream(
+        self,
+        provider: str,
+        prompt: str,
+        max_output_tokens: int = 256,
+        model: Optional[str] = None,
+        api_key_id: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Unified streaming: yields text deltas as the provider produces them.
+        HTTP providers stream over the pooled long-lived clients; Gemini uses the cached SDK client.
+        Raises ValueError for unknown/unconfigured providers, CircuitOpenError while the
+        provider's breaker is open, and ProviderHTTPError on non-2xx responses.
+        """
+        provider = (provider or "").lower()
+        model = self.resolve_model(provider, model)
+        if not await self._admit(provider, model, prompt, max_output_tokens, api_key_id):
+            raise ValueError(f"Rate limit queue timeout for {provider}:{model}")
+        if provider == "gemini":
+            if not self.gemini_api_key:
+                raise ValueError("GEMINI_API_KEY not configured")
+            breaker = self.breakers[provider]
+            breaker.before_call()
+            opened = False
+            try:
+                resp = await self._open_gemini_stream(prompt, max_output_tokens, model)
+                opened = True
+                breaker.record_success()
+                async for chunk in resp:
+                    delta = gemini_extract_text(chunk)
+                    if delta:
+                        yield delta
+            except Exception as e:
+                if not opened:
+                    if self.resilience.counts_as_failure(e):
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                raise
+            except BaseException:
+                if not opened:
+                    breaker.release_trial()
+                raise
+            return
+
+        builders = {
+            "openai": (self._openai_request, "OPENAI_API_KEY"),
+            "anthropic": (self._anthropic_request, "ANTHROPIC_API_KEY"),
+            "grok": (self._grok_request, "GROK_API_KEY"),
+            "custom": (self._custom_request, "CUSTOM_LLM_ENDPOINT"),
+        }
+        build, setting = builders[provider]
+        spec = build(prompt, max_output_tokens, model)
+        if spec is None:
+            raise ValueError(f"{setting} not configured")
+        url, headers, payload = spec
+        payload["stream"] = True
+        extract = _anthropic_delta if provider == "anthropic" else (_custom_delta if provider == "custom" else _openai_delta)
+
+        breaker = self.breakers[provider]
+        breaker.before_call()
+        opened = False
+        try:
+            async with self.http.stream(provider, "POST", url, headers=headers, json=payload) as resp:
+                self.scheduler.observe(provider, model, resp.headers, resp.status_code)
+                if resp.status_code >= 400:
+                    await resp.aread()
+                    raise ProviderHTTPError.from_response(provider, resp)
+                opened = True
+                breaker.record_success()
+                async for line in resp.aiter_lines():
+                    data = _sse_data(line)
+                    if data is None:
+                        continue
+                    if data == "[DONE]":
+                        break
+                    try:
+                        obj = json.loads(data)
+                    except ValueError:
+                        # Custom endpoints may stream plain text lines
+                        if provider == "custom":
+                            yield data
+                        continue
+                    delta = extract(obj)
+                    if delta:
+                        yield delta
+                    if provider == "anthropic" and obj.get("type") == "message_stop":
+                        break
+        except Exception as e:
+            # Only failures to open the stream say anything about provider health
+            if not opened:
+                if self.resilience.counts_as_failure(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            raise
+        except BaseException:
+            # Cancelled or closed before the stream opened: free a half-open trial without a verdict
+            if not opened:
+                breaker.release_trial()
+            raise
 
     # --- Tokenization helpers (approximate) ---
 
@@ -159,7 +491,11 @@ class LLMRouter:
         provider = (provider or "").lower()
         if provider == "openai":
             model = self.default_models.get("openai", "gpt-4o-mini")
-            return openai_count(text or "", model=model)
+            try:
+                return openai_count(text or "", model=model)
+            except Exception:
+                # tiktoken encodings unavailable (e.g. offline); fall back to the char-based estimate
+                return custom_estimate(text)
         if provider == "anthropic":
             return anthropic_estimate(text)
         if provider == "grok":
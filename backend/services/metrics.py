@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; covers sub-millisecond cache/DB hits up to slow provider calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# (labels, value) pairs yielded by scrape-time collectors
+Samples = Iterable[Tuple[Dict[str, str], float]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}" for labels, v in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, *labels: str) -> None:
+        self.inc(-amount, *labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}" for labels, v in items
+        ]
+
+
+class Histogram(_Metric):
+    """Cumulative buckets are only built at render time; observe() bumps one bucket."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = self._header()
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics in Prometheus text format (0.0.4).
+    - Counters / histograms are updated inline and cost a dict update under a lock
+    - Gauges and counters that mirror existing component stats are registered as collectors
+      and only evaluated when /metrics is scraped
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[str, str, str, Callable[[], Samples]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, name: str, kind: str, help_text: str, fn: Callable[[], Samples]) -> None:
+        """Register a scrape-time metric; `fn` returns (labels, value) pairs."""
+        self._collectors.append((name, kind, help_text, fn))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, kind, help_text, fn in self._collectors:
+            try:
+                samples = list(fn())
+            except Exception as e:
+                print(f"Warning: metrics collector {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "prompttrim_http_request_duration_seconds", "HTTP request latency by route template", ("endpoint", "method", "status")
+)
+HTTP_IN_FLIGHT = registry.gauge("prompttrim_http_requests_in_flight", "HTTP requests currently being served")
+STAGE_SECONDS = registry.histogram(
+    "prompttrim_stage_duration_seconds", "Pipeline stage latency by endpoint", ("endpoint", "stage")
+)
+STORAGE_SECONDS = registry.histogram(
+    "prompttrim_storage_query_duration_seconds", "Storage call latency", ("backend", "op")
+)
+MODEL_INFERENCES = registry.counter("prompttrim_model_inferences_total", "Model forward / generate calls", ("model",))
+MODEL_TOKENS = registry.counter(
+    "prompttrim_model_tokens_total", "Tokens through local models (tokenizer tokens)", ("model", "direction")
+)
+MODEL_BATCH_SIZE = registry.histogram(
+    "prompttrim_model_batch_size", "Items per model call", ("model",), buckets=BATCH_SIZE_BUCKETS
+)
+MODEL_SECONDS = registry.histogram("prompttrim_model_inference_duration_seconds", "Model call latency", ("model",))
+
+
+# --- Request-scoped stage timing ---
+
+class RequestTimings:
+    """Stage durations for one request; the endpoint label is known only after routing."""
+
+    __slots__ = ("endpoint", "pending", "spans", "started")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.endpoint: Optional[str] = None
+        self.pending: List[Tuple[str, float]] = []
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.spans.append((stage, seconds))
+        if self.endpoint is None:
+            self.pending.append((stage, seconds))
+        else:
+            STAGE_SECONDS.observe(seconds, self.endpoint, stage)
+
+    def resolve(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        pending, self.pending = self.pending, []
+        for stage, seconds in pending:
+            STAGE_SECONDS.observe(seconds, endpoint, stage)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("prompttrim_request_timings", default=None)
+
+
+def begin_request() -> RequestTimings:
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+    else:
+        STAGE_SECONDS.observe(seconds, "background", stage)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a pipeline stage for the current request (or as `background` outside one)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+# Short stage names for Server-Timing / debug breakdowns
+TIMING_NAMES = {
+    "cache_lookup": "cache",
+    "compression": "compress",
+    "summarization": "summarize",
+    "token_counting": "count",
+}
+
+
+def stage_breakdown(timings: RequestTimings) -> Dict[str, float]:
+    """Milliseconds per stage (repeated stages summed) plus `total` since the request started."""
+    out: Dict[str, float] = {}
+    for stage, seconds in timings.spans:
+        name = TIMING_NAMES.get(stage, stage)
+        out[name] = out.get(name, 0.0) + seconds * 1000
+    out = {name: round(ms, 2) for name, ms in out.items()}
+    out["total"] = round((time.perf_counter() - timings.started) * 1000, 2)
+    return out
+
+
+def server_timing_header(timings: RequestTimings) -> str:
+    return ", ".join(f"{name};dur={ms}" for name, ms in stage_breakdown(timings).items())
+
+
+def record_inference(model: str, seconds: float, batch_size: int, tokens_in: int, tokens_out: int) -> None:
+    MODEL_INFERENCES.inc(1, model)
+    MODEL_SECONDS.observe(seconds, model)
+    MODEL_BATCH_SIZE.observe(batch_size, model)
+    MODEL_TOKENS.inc(tokens_in, model, "in")
+    MODEL_TOKENS.inc(tokens_out, model, "out")
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+# Leaf frames of threads that are parked, not working (executor idle, queue waits, selector poll)
+_IDLE_LEAVES = frozenset({
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+})
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(frame, lines: bool) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    if lines:
+        return f"{code.co_name} ({filename}:{frame.f_lineno})"
+    return f"{code.co_name} ({filename})"
+
+
+class SamplingProfiler:
+    """
+    On-demand wall-clock sampler over sys._current_frames() (no py-spy / ptrace needed).
+    - Zero overhead while idle: no sys.setprofile / settrace hooks; the sampling thread only
+      exists for the duration of a capture
+    - Samples every thread (event loop, micro-batcher workers, inference executors) at `rate_hz`
+    - Returns collapsed stacks (`thread;outer;...;inner count`) for flamegraph.pl / speedscope
+    - One capture at a time (sampler or torch.profiler)
+    """
+
+    def __init__(self, max_seconds: Optional[float] = None, max_rate_hz: Optional[float] = None):
+        self.max_seconds = max_seconds or float(os.getenv("PROFILER_MAX_SECONDS", 60))
+        self.max_rate_hz = max_rate_hz or float(os.getenv("PROFILER_MAX_RATE_HZ", 1000))
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"captures": 0, "torch_captures": 0, "rejected": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def _acquire(self) -> None:
+        if not self._lock.acquire(blocking=False):
+            self._counters["rejected"] += 1
+            raise RuntimeError("A profile capture is already running")
+
+    def _sample(self, stacks: Counter, own_ident: int, include_idle: bool, lines: bool) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            code = frame.f_code
+            if not include_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(_frame_label(frame, lines))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            stacks[";".join(reversed(labels))] += 1
+
+    def _capture(self, seconds: float, rate_hz: float, include_idle: bool, lines: bool) -> Dict[str, Any]:
+        stacks: Counter = Counter()
+        own_ident = threading.get_ident()
+        interval = 1.0 / rate_hz
+        started = time.perf_counter()
+        deadline = started + seconds
+        next_tick = started
+        samples = 0
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now < next_tick:
+                time.sleep(next_tick - now)
+            self._sample(stacks, own_ident, include_idle, lines)
+            samples += 1
+            # Skip ticks we overslept instead of bursting to catch up
+            next_tick = max(next_tick + interval, time.perf_counter())
+        collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        return {
+            "seconds": round(time.perf_counter() - started, 3),
+            "rate_hz": rate_hz,
+            "samples": samples,
+            "distinct_stacks": len(stacks),
+            "collapsed": collapsed + "\n" if collapsed else "",
+        }
+
+    async def capture(
+        self,
+        seconds: float = 10.0,
+        rate_hz: float = 100.0,
+        include_idle: bool = False,
+        lines: bool = False
+    ) -> Dict[str, Any]:
+        """Sample all threads for `seconds`; raises ValueError on bad limits, RuntimeError if busy."""
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"seconds must be in (0, {self.max_seconds:g}]")
+        if not 0 < rate_hz <= self.max_rate_hz:
+            raise ValueError(f"rate must be in (0, {self.max_rate_hz:g}] Hz")
+        self._acquire()
+        try:
+            # Own thread so the event loop keeps serving (and gets sampled) meanwhile
+            result = await asyncio.to_thread(self._capture, seconds, rate_hz, include_idle, lines)
+            self._counters["captures"] += 1
+            return result
+        finally:
+            self._lock.release()
+
+    def _torch_capture(self, fn: Callable[[], Any], row_limit: int) -> Dict[str, Any]:
+        try:
+            import torch
+            from torch.profiler import ProfilerActivity, profile
+        except ImportError:
+            raise RuntimeError("torch is not installed")
+        activities = [ProfilerActivity.CPU]
+        use_cuda = torch.cuda.is_available()
+        if use_cuda:
+            activities.append(ProfilerActivity.CUDA)
+        started = time.perf_counter()
+        with profile(activities=activities, record_shapes=True) as prof:
+            fn()
+        sort_by = "cuda_time_total" if use_cuda else "cpu_time_total"
+        return {
+            "seconds": round(time.perf_counter() - started, 3),
+            "device": "cuda" if use_cuda else "cpu",
+            "table": prof.key_averages().table(sort_by=sort_by, row_limit=row_limit),
+        }
+
+    async def torch_capture(self, fn: Callable[[], Any], row_limit: int = 30) -> Dict[str, Any]:
+        """Run one model call under torch.profiler (on the calling worker thread) and return the op table."""
+        self._acquire()
+        try:
+            result = await asyncio.to_thread(self._torch_capture, fn, row_limit)
+            self._counters["torch_captures"] += 1
+            return result
+        finally:
+            self._lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, "running": self.running, "max_seconds": self.max_seconds, "max_rate_hz": self.max_rate_hz}
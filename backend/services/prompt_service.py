@@ -1,16 +1,89 @@
-from supabase import Client
-from typing import Dict, Any
-from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+import asyncio
+from datetime import datetime, timedelta, timezone
+import base64
+import json
 import uuid
+from .batching import MicroBatcher
+from .metrics import span
+from .singleflight import SingleFlight, flight_key, normalize_text
 from .tinyllama_service import TinyLlamaService
-from database import get_supabase
+from .storage import Storage, create_storage
+from .usage_aggregator import UsageAggregator
+from .write_behind import WriteBehindQueue
 from models import Prompt
 
+# Columns the history endpoints may return; original_text / optimized_text are only in the
+# default projection of the detail endpoint
+PROMPT_FIELDS = frozenset({
+    "id", "user_id", "original_text", "original_token_count", "optimized_text", "optimized_token_count",
+    "tokens_saved", "optimization_level", "ai_model", "language", "status", "cost_saved_usd",
+    "optimization_cost_usd", "processing_time_ms", "error_message", "tags", "created_at",
+    "updated_at", "completed_at"
+})
+HISTORY_LIST_FIELDS = (
+    "id", "created_at", "original_token_count", "optimized_token_count", "tokens_saved",
+    "optimization_level", "language", "status", "cost_saved_usd"
+)
+HISTORY_MAX_LIMIT = 200
+
+
+def encode_history_cursor(created_at: str, prompt_id: str) -> str:
+    """Opaque keyset cursor for the (created_at, id) of the last row on a page"""
+    raw = json.dumps([created_at, prompt_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, prompt_id = json.loads(raw)
+        datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+        uuid.UUID(prompt_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    return created_at, prompt_id
+
+
+def parse_history_fields(fields: Optional[str], default: tuple) -> List[str]:
+    """Validate a comma-separated projection; id and created_at are always included for the cursor"""
+    if not fields:
+        selected = list(default)
+    else:
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in selected if f not in PROMPT_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    for required in ("created_at", "id"):
+        if required not in selected:
+            selected.insert(0, required)
+    return selected
+
+
 class PromptOptimizationService:
-    def __init__(self):
+    def __init__(
+        self,
+        writer: Optional[WriteBehindQueue] = None,
+        usage: Optional[UsageAggregator] = None,
+        storage: Optional[Storage] = None,
+        flights: Optional[SingleFlight] = None,
+        compressor: Optional[MicroBatcher] = None
+    ):
         self.tinyllama_service = TinyLlamaService()
-        self.supabase = get_supabase()
+        # Identical concurrent prompts share one TinyLlama generation; distinct ones are batched
+        # by `compressor` (a MicroBatcher over (prompt, ratio)) when one is given
+        self.flights = flights or SingleFlight()
+        self.compressor = compressor
+        self.storage = storage or (writer.storage if writer else create_storage())
+        # Prompt rows and usage counters are persisted off the request path
+        self.writer = writer or WriteBehindQueue(self.storage)
+        self.usage = usage or UsageAggregator(self.writer)
     
+    async def _compress(self, prompt: str, compression_ratio: float) -> Dict[str, Any]:
+        if self.compressor is not None:
+            return await self.compressor.submit((prompt, compression_ratio))
+        return await asyncio.to_thread(self.tinyllama_service.compress_prompt, prompt, compression_ratio)
+
     async def optimize_prompt(
         self, 
         user_id: str,
@@ -19,7 +92,7 @@ class PromptOptimizationService:
         language: str = "en"
     ) -> Dict[str, Any]:
         """
-        Optimize a prompt using TinyLlama compression and save to Supabase
+        Optimize a prompt using TinyLlama compression and save it to storage
         
         Args:
             user_id: User ID
@@ -40,17 +113,18 @@ class PromptOptimizationService:
             compression_ratio = compression_ratios.get(optimization_level, 0.5)
             
             # Use TinyLlama to compress the prompt
-            result = self.tinyllama_service.compress_prompt(
-                prompt=original_prompt,
-                compression_ratio=compression_ratio
-            )
+            with span("compression"):
+                result = await self.flights.do(
+                    flight_key("compression", normalize_text(original_prompt), compression_ratio, "tinyllama"),
+                    lambda: self._compress(original_prompt, compression_ratio)
+                )
             
             # Calculate cost savings (assuming $0.03 per 1K tokens)
             cost_per_token = 0.03 / 1000
             tokens_saved = result["original_tokens"] - result["optimized_tokens"]
             cost_saved_usd = tokens_saved * cost_per_token
             
-            # Create prompt record in Supabase
+            # Create prompt record
             prompt_id = str(uuid.uuid4())
             prompt_data = {
                 "id": prompt_id,
@@ -66,14 +140,15 @@ class PromptOptimizationService:
                 "cost_saved_usd": cost_saved_usd
             }
             
-            # Insert into Supabase
-            self.supabase.table("prompts").insert(prompt_data).execute()
-            
-            # Update user's token usage
-            self._update_user_token_usage(user_id, tokens_saved)
-            
-            # Update daily analytics
-            self._update_daily_analytics(user_id, tokens_saved, cost_saved_usd)
+            # Queue the insert; usage is aggregated in memory and applied as atomic increments
+            with span("persist"):
+                self.writer.enqueue_insert("prompts", prompt_data)
+                self.usage.record(
+                    user_id,
+                    tokens_saved=tokens_saved,
+                    cost_saved_usd=cost_saved_usd,
+                    tokens_processed=result["original_tokens"]
+                )
             
             return {
                 "id": prompt_id,
@@ -102,58 +177,14 @@ class PromptOptimizationService:
                 "created_at": datetime.utcnow().isoformat()
             }
     
-    def _update_user_token_usage(self, user_id: str, tokens_saved: int):
-        """Update user's monthly token usage"""
-        try:
-            # Get current profile
-            result = self.supabase.table("profiles").select("tokens_used_this_month").eq("id", user_id).execute()
-            if result.data:
-                current_usage = result.data[0]["tokens_used_this_month"]
-                new_usage = current_usage + tokens_saved
-                
-                # Update the profile
-                self.supabase.table("profiles").update({
-                    "tokens_used_this_month": new_usage
-                }).eq("id", user_id).execute()
-        except Exception as e:
-            print(f"Error updating user token usage: {e}")
-    
-    def _update_daily_analytics(self, user_id: str, tokens_saved: int, cost_saved_usd: float):
-        """Update daily analytics"""
-        try:
-            today = datetime.now().strftime("%Y-%m-%d")
-            
-            # Check if analytics record exists for today
-            result = self.supabase.table("analytics_daily").select("*").eq("user_id", user_id).eq("date", today).execute()
-            
-            if result.data:
-                # Update existing record
-                current = result.data[0]
-                self.supabase.table("analytics_daily").update({
-                    "total_prompts": current["total_prompts"] + 1,
-                    "total_tokens_saved": current["total_tokens_saved"] + tokens_saved,
-                    "total_cost_saved_usd": current["total_cost_saved_usd"] + cost_saved_usd,
-                    "avg_compression_rate": (current["avg_compression_rate"] + (tokens_saved / max(current["total_tokens_saved"] + tokens_saved, 1))) / 2
-                }).eq("id", current["id"]).execute()
-            else:
-                # Create new record
-                analytics_data = {
-                    "id": str(uuid.uuid4()),
-                    "user_id": user_id,
-                    "date": today,
-                    "total_prompts": 1,
-                    "total_tokens_saved": tokens_saved,
-                    "total_cost_saved_usd": cost_saved_usd,
-                    "avg_compression_rate": 0.5  # Default compression rate
-                }
-                self.supabase.table("analytics_daily").insert(analytics_data).execute()
-        except Exception as e:
-            print(f"Error updating daily analytics: {e}")
-    
-    def get_user_analytics(self, user_id: str) -> Dict[str, Any]:
+    async def get_user_analytics(self, user_id: str) -> Dict[str, Any]:
         """
         Get usage analytics for a user
         
+        Served from the analytics_monthly / analytics_daily rollups (get_usage_summary RPC),
+        plus usage recorded in this process that has not been flushed yet, so the cost does
+        not grow with the user's prompt history.
+        
         Args:
             user_id: User ID to get analytics for
         
@@ -161,32 +192,37 @@ class PromptOptimizationService:
             Dictionary with analytics data
         """
         try:
-            # Get total prompts
-            prompts_result = self.supabase.table("prompts").select("*").eq("user_id", user_id).execute()
-            total_prompts = len(prompts_result.data) if prompts_result.data else 0
+            try:
+                summary = await self.storage.usage_summary(user_id)
+            except Exception as rpc_error:
+                # Migration not applied yet: sum the monthly rollup rows directly
+                print(f"Warning: get_usage_summary RPC failed, reading analytics_monthly: {rpc_error}")
+                summary = await self._summarize_monthly_rollups(user_id)
             
-            # Calculate totals
-            total_tokens_saved = sum(prompt["tokens_saved"] for prompt in prompts_result.data) if prompts_result.data else 0
-            total_cost_saved = sum(prompt["cost_saved_usd"] for prompt in prompts_result.data) if prompts_result.data else 0
+            pending = self.usage.pending(user_id)
+            total_prompts = int(summary.get("total_prompts", 0)) + pending["prompts"]
+            total_tokens_saved = int(summary.get("total_tokens_saved", 0)) + pending["tokens_saved"]
+            total_tokens_processed = int(summary.get("total_tokens_processed", 0)) + pending["tokens_processed"]
+            total_cost_saved = float(summary.get("total_cost_saved_usd", 0)) + pending["cost_saved_usd"]
+            prompts_this_month = int(summary.get("prompts_this_month", 0)) + pending["prompts_this_month"]
             
-            # Calculate average compression rate
-            if prompts_result.data and total_tokens_saved > 0:
-                total_original_tokens = sum(prompt["original_token_count"] for prompt in prompts_result.data)
-                avg_compression_rate = total_tokens_saved / total_original_tokens if total_original_tokens > 0 else 0
-            else:
-                avg_compression_rate = 0.0
+            avg_compression_rate = total_tokens_saved / total_tokens_processed if total_tokens_processed > 0 else 0.0
             
-            # Get prompts this month
-            month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            month_prompts = [p for p in (prompts_result.data or []) if datetime.fromisoformat(p["created_at"].replace('Z', '+00:00')) >= month_start]
-            prompts_this_month = len(month_prompts)
+            # Current partial day: today's rollup row plus unflushed usage
+            today = summary.get("today") or {}
+            today_pending = pending["today"]
             
             return {
                 "total_prompts": total_prompts,
                 "total_tokens_saved": total_tokens_saved,
                 "total_cost_saved_usd": total_cost_saved,
                 "avg_compression_rate": round(avg_compression_rate, 3),
-                "prompts_this_month": prompts_this_month
+                "prompts_this_month": prompts_this_month,
+                "today": {
+                    "prompts": int(today.get("prompts", 0)) + today_pending["prompts"],
+                    "tokens_saved": int(today.get("tokens_saved", 0)) + today_pending["tokens_saved"],
+                    "cost_saved_usd": float(today.get("cost_saved_usd", 0)) + today_pending["cost_saved_usd"]
+                }
             }
             
         except Exception as e:
@@ -198,3 +234,57 @@ class PromptOptimizationService:
                 "avg_compression_rate": 0.0,
                 "prompts_this_month": 0
             }
+    
+    async def _summarize_monthly_rollups(self, user_id: str) -> Dict[str, Any]:
+        """Fallback for get_usage_summary: one row per month of history"""
+        rows = await self.storage.monthly_rollups(user_id)
+        now = datetime.now(timezone.utc)
+        return {
+            "total_prompts": sum(r["total_prompts"] or 0 for r in rows),
+            "total_tokens_saved": sum(r["total_tokens_saved"] or 0 for r in rows),
+            "total_tokens_processed": sum(r["total_tokens_processed"] or 0 for r in rows),
+            "total_cost_saved_usd": sum(float(r["total_cost_saved_usd"] or 0) for r in rows),
+            "prompts_this_month": sum(r["total_prompts"] or 0 for r in rows if r["year"] == now.year and r["month"] == now.month),
+        }
+    
+    async def get_prompt_history(
+        self,
+        user_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        One page of a user's prompts, newest first
+        
+        Keyset pagination on (created_at DESC, id), served by idx_prompts_user_created_id, so a
+        page costs the same at any depth. The list projection skips the prompt texts unless
+        they are requested in `fields`.
+        
+        Args:
+            user_id: User ID
+            limit: Page size (1..HISTORY_MAX_LIMIT)
+            cursor: next_cursor from the previous page
+            fields: Comma-separated columns to return
+        
+        Returns:
+            {"prompts": [...], "next_cursor": str | None}
+        
+        Raises:
+            ValueError: Invalid cursor or unknown field
+        """
+        limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+        columns = parse_history_fields(fields, HISTORY_LIST_FIELDS)
+        after = decode_history_cursor(cursor) if cursor else None
+        # Fetch one extra row to know whether another page exists
+        rows = await self.storage.prompt_page(user_id, columns, limit + 1, after)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_history_cursor(rows[-1]["created_at"], rows[-1]["id"])
+        return {"prompts": rows, "next_cursor": next_cursor}
+    
+    async def get_prompt(self, user_id: str, prompt_id: str, fields: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Single prompt with its full texts, or None if it does not belong to the user"""
+        columns = parse_history_fields(fields, tuple(sorted(PROMPT_FIELDS)))
+        return await self.storage.get_prompt(user_id, prompt_id, columns)
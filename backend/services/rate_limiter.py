@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Mapping, Optional, Tuple
+
+Target = Tuple[str, str]  # (provider, model)
+
+
+class TokenBucket:
+    """Continuous-refill token bucket. capacity=inf means unlimited."""
+
+    def __init__(self, per_minute: Optional[float]):
+        self.capacity = float(per_minute) if per_minute else math.inf
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60.0
+
+    def _refill(self, now: float) -> None:
+        if self.capacity == math.inf:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= amount or self.capacity == math.inf:
+            return 0.0
+        # Requests larger than the whole bucket only need to wait for a full bucket
+        needed = min(amount, self.capacity) - self.tokens
+        return max(0.0, needed / self.rate) if needed > 0 else 0.0
+
+    def consume(self, amount: float, now: float) -> None:
+        self._refill(now)
+        if self.capacity != math.inf:
+            self.tokens -= min(amount, self.capacity)
+
+    def set_limit(self, per_minute: float, remaining: Optional[float] = None, now: Optional[float] = None) -> None:
+        now = now or time.monotonic()
+        self._refill(now)
+        was_unlimited = self.capacity == math.inf
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity if was_unlimited else min(self.tokens, self.capacity)
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+        self.updated = now
+
+    def drain(self, now: float) -> None:
+        self._refill(now)
+        if self.capacity != math.inf:
+            self.tokens = min(self.tokens, 0.0)
+
+
+class _TargetQueue:
+    """Buckets plus per-API-key FIFO queues for one (provider, model)."""
+
+    def __init__(self, rpm: Optional[float], tpm: Optional[float]):
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self.waiters: "OrderedDict[str, Deque[Tuple[int, asyncio.Future]]]" = OrderedDict()
+        self.pump: Optional[asyncio.Task] = None
+        self.granted = 0
+        self.queued = 0
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        return max(self.paused_until - now, self.rpm.wait_time(1, now), self.tpm.wait_time(tokens, now), 0.0)
+
+    def consume(self, tokens: int, now: float) -> None:
+        self.rpm.consume(1, now)
+        self.tpm.consume(tokens, now)
+        self.granted += 1
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self.waiters.values())
+
+
+class RateLimitScheduler:
+    """
+    Per-(provider, model) RPM/TPM token buckets in front of provider calls.
+    - Requests that fit go straight through; the rest queue
+    - Queued requests are released round-robin across API keys (fair ordering)
+    - Limits start from env (or unlimited) and adapt from provider rate-limit headers
+    """
+
+    def __init__(self, max_wait: Optional[float] = None):
+        self.max_wait = max_wait or float(os.getenv("LLM_SCHEDULER_MAX_WAIT", 30))
+        self._queues: Dict[Target, _TargetQueue] = {}
+
+    def _defaults(self, provider: str) -> Tuple[Optional[float], Optional[float]]:
+        prefix = "CUSTOM_LLM" if provider == "custom" else provider.upper()
+        rpm = os.getenv(f"{prefix}_RPM")
+        tpm = os.getenv(f"{prefix}_TPM")
+        return (float(rpm) if rpm else None, float(tpm) if tpm else None)
+
+    def _queue(self, provider: str, model: str) -> _TargetQueue:
+        queue = self._queues.get((provider, model))
+        if queue is None:
+            queue = self._queues[(provider, model)] = _TargetQueue(*self._defaults(provider))
+        return queue
+
+    async def acquire(self, provider: str, model: str, tokens: int, key_id: Optional[str] = None) -> None:
+        """
+        Wait until the (provider, model) buckets admit a request of `tokens` tokens.
+        Raises asyncio.TimeoutError if the wait exceeds max_wait.
+        """
+        queue = self._queue(provider, model)
+        now = time.monotonic()
+        if not queue.waiters and queue.wait_time(tokens, now) == 0.0:
+            queue.consume(tokens, now)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        queue.waiters.setdefault(key_id or "anonymous", deque()).append((tokens, future))
+        queue.queued += 1
+        if queue.pump is None or queue.pump.done():
+            queue.pump = asyncio.ensure_future(self._pump(queue))
+        await asyncio.wait_for(future, timeout=self.max_wait)
+
+    async def _pump(self, queue: _TargetQueue) -> None:
+        while queue.waiters:
+            key, waiters = next(iter(queue.waiters.items()))
+            tokens, future = waiters[0]
+            if future.done():
+                # Caller timed out or was cancelled
+                waiters.popleft()
+                self._rotate(queue, key)
+                continue
+            delay = queue.wait_time(tokens, time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            waiters.popleft()
+            queue.consume(tokens, time.monotonic())
+            future.set_result(None)
+            self._rotate(queue, key)
+
+    @staticmethod
+    def _rotate(queue: _TargetQueue, key: str) -> None:
+        waiters = queue.waiters.get(key)
+        if waiters:
+            queue.waiters.move_to_end(key)
+        else:
+            queue.waiters.pop(key, None)
+
+    # --- Adaptation from provider responses ---
+
+    def observe(self, provider: str, model: str, headers: Mapping[str, str], status_code: int = 200) -> None:
+        """Adapt bucket limits from x-ratelimit-* / anthropic-ratelimit-* headers; back off on 429."""
+        queue = self._queue(provider, model)
+        now = time.monotonic()
+        h = {k.lower(): v for k, v in (headers or {}).items()}
+
+        req_limit = _num(h.get("x-ratelimit-limit-requests") or h.get("anthropic-ratelimit-requests-limit"))
+        req_remaining = _num(h.get("x-ratelimit-remaining-requests") or h.get("anthropic-ratelimit-requests-remaining"))
+        tok_limit = _num(h.get("x-ratelimit-limit-tokens") or h.get("anthropic-ratelimit-tokens-limit"))
+        tok_remaining = _num(h.get("x-ratelimit-remaining-tokens") or h.get("anthropic-ratelimit-tokens-remaining"))
+        if req_limit:
+            queue.rpm.set_limit(req_limit, req_remaining, now)
+        if tok_limit:
+            queue.tpm.set_limit(tok_limit, tok_remaining, now)
+
+        if status_code == 429:
+            queue.rpm.drain(now)
+            queue.tpm.drain(now)
+            retry_after = parse_retry_after(h)
+            if retry_after:
+                queue.paused_until = max(queue.paused_until, now + retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for (provider, model), q in self._queues.items():
+            out[f"{provider}:{model}"] = {
+                "rpm_limit": None if q.rpm.capacity == math.inf else q.rpm.capacity,
+                "tpm_limit": None if q.tpm.capacity == math.inf else q.tpm.capacity,
+                "pending": q.pending(),
+                "granted": q.granted,
+                "queued": q.queued,
+            }
+        return out
+
+
+def _num(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Seconds to wait according to Retry-After (seconds or HTTP date), retry-after-ms,
+    or OpenAI-style x-ratelimit-reset-* durations such as "1s" / "6m0s".
+    """
+    h = {k.lower(): v for k, v in (headers or {}).items()}
+    if h.get("retry-after-ms"):
+        ms = _num(h["retry-after-ms"])
+        if ms is not None:
+            return ms / 1000.0
+    value = h.get("retry-after")
+    if value:
+        seconds = _num(value)
+        if seconds is not None:
+            return max(0.0, seconds)
+        try:
+            from email.utils import parsedate_to_datetime
+            when = parsedate_to_datetime(value)
+            return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+    resets = [_parse_duration(h.get(k)) for k in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return _num(value)
+    return sum(float(n) * units[u] for n, u in parts)
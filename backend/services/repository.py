@@ -0,0 +1,381 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .metrics import STORAGE_SECONDS, observe_stage
+from .storage import Storage
+
+try:
+    import asyncpg
+except ImportError:  # optional: without it every call goes through PostgREST
+    asyncpg = None
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _columns(columns: Sequence[str]) -> str:
+    return ", ".join(_ident(c) for c in columns)
+
+
+def _jsonable(value: Any) -> Any:
+    # Match the shapes PostgREST returns so callers don't care which path served them
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _row(record) -> Dict[str, Any]:
+    return {k: _jsonable(v) for k, v in record.items()}
+
+
+class Repository(Storage):
+    """
+    Supabase implementation of Storage.
+    - Uses an asyncpg pool on DATABASE_URL when configured; statements are prepared once per
+      connection and cached (DB_STATEMENT_CACHE_SIZE; set 0 behind pgbouncer transaction pooling)
+    - Falls back to the Supabase (PostgREST) client, run off the event loop, when the pool is
+      not configured, failed to start, or no connection could be acquired
+    - Reads also fall back when the query itself errors; non-idempotent writes (inserts,
+      increment_usage) never do once the statement may have been sent, since it may have committed
+    - Pool size via DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE, per-query timeout via DB_COMMAND_TIMEOUT;
+      waiting for a connection from an exhausted pool is capped by DB_ACQUIRE_TIMEOUT
+    """
+
+    name = "supabase"
+
+    def __init__(
+        self,
+        supabase,
+        dsn: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        statement_cache_size: Optional[int] = None,
+        command_timeout: Optional[float] = None,
+        acquire_timeout: Optional[float] = None
+    ):
+        self.supabase = supabase
+        self.dsn = dsn or os.getenv("DATABASE_URL")
+        self.min_size = min_size or int(os.getenv("DB_POOL_MIN_SIZE", 2))
+        self.max_size = max_size or int(os.getenv("DB_POOL_MAX_SIZE", 10))
+        self.statement_cache_size = (
+            int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100)) if statement_cache_size is None else statement_cache_size
+        )
+        self.command_timeout = command_timeout or float(os.getenv("DB_COMMAND_TIMEOUT", 10))
+        self.acquire_timeout = acquire_timeout or float(os.getenv("DB_ACQUIRE_TIMEOUT", 2))
+        self._pool = None
+        self._counters: Dict[str, int] = {"postgres": 0, "postgrest": 0, "fallbacks": 0, "acquire_timeouts": 0}
+
+    # --- Lifecycle ---
+
+    async def start(self) -> None:
+        if self._pool is not None or not self.dsn:
+            return
+        if asyncpg is None:
+            print("Warning: DATABASE_URL is set but asyncpg is not installed; using PostgREST")
+            return
+        try:
+            self._pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                statement_cache_size=self.statement_cache_size,
+                command_timeout=self.command_timeout
+            )
+        except Exception as e:
+            print(f"Warning: could not open Postgres pool, using PostgREST: {e}")
+            self._pool = None
+
+    async def aclose(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            await pool.close()
+
+    @property
+    def pooled(self) -> bool:
+        return self._pool is not None
+
+    async def _run(
+        self,
+        op: str,
+        pg: Callable[[Any], Awaitable[Any]],
+        rest: Callable[[], Any],
+        idempotent: bool = True
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            pool = self._pool
+            if pool is not None:
+                try:
+                    conn = await pool.acquire(timeout=self.acquire_timeout)
+                except asyncio.TimeoutError:
+                    conn = None
+                    self._counters["fallbacks"] += 1
+                    self._counters["acquire_timeouts"] += 1
+                    print(f"Warning: Postgres pool exhausted for {op} ({self.acquire_timeout:g}s), falling back to PostgREST")
+                except Exception as e:
+                    conn = None
+                    self._counters["fallbacks"] += 1
+                    print(f"Warning: no Postgres connection for {op}, falling back to PostgREST: {e}")
+                if conn is not None:
+                    try:
+                        result = await pg(conn)
+                        self._counters["postgres"] += 1
+                        return result
+                    except Exception as e:
+                        if not idempotent:
+                            raise
+                        self._counters["fallbacks"] += 1
+                        print(f"Warning: Postgres {op} failed, falling back to PostgREST: {e}")
+                    finally:
+                        await pool.release(conn)
+            self._counters["postgrest"] += 1
+            return await asyncio.to_thread(rest)
+        finally:
+            elapsed = time.perf_counter() - started
+            STORAGE_SECONDS.observe(elapsed, self.name, op)
+            observe_stage("db", elapsed)
+
+    # --- Profiles ---
+
+    async def get_profile_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self._get_profile("id", user_id)
+
+    async def get_profile_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return await self._get_profile("email", email)
+
+    async def _get_profile(self, column: str, value: str) -> Optional[Dict[str, Any]]:
+        cast = "::uuid" if column == "id" else ""
+
+        async def pg(conn):
+            record = await conn.fetchrow(f"SELECT * FROM profiles WHERE {_ident(column)} = $1{cast}", value)
+            return _row(record) if record is not None else None
+
+        def rest():
+            res = self.supabase.table("profiles").select("*").eq(column, value).execute()
+            return res.data[0] if res.data else None
+
+        return await self._run("profile lookup", pg, rest)
+
+    async def create_profile(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await self._insert_returning("profiles", row)
+
+    async def _insert_returning(self, table: str, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        columns = sorted(row)
+        sql = (
+            f"INSERT INTO {_ident(table)} ({_columns(columns)}) "
+            f"SELECT {_columns(columns)} FROM jsonb_populate_record(NULL::{_ident(table)}, $1::jsonb) RETURNING *"
+        )
+
+        async def pg(conn):
+            record = await conn.fetchrow(sql, json.dumps(row, default=str))
+            return _row(record) if record is not None else None
+
+        def rest():
+            res = self.supabase.table(table).insert(row).execute()
+            return res.data[0] if res.data else None
+
+        return await self._run(f"insert into {table}", pg, rest, idempotent=False)
+
+    # --- API keys ---
+
+    async def get_active_api_key(self, key_hash: str, columns: str) -> Optional[Dict[str, Any]]:
+        names = [c.strip() for c in columns.split(",")]
+        sql = f"SELECT {_columns(names)} FROM api_keys WHERE key_hash = $1 AND is_active LIMIT 1"
+
+        async def pg(conn):
+            record = await conn.fetchrow(sql, key_hash)
+            return _row(record) if record is not None else None
+
+        def rest():
+            res = self.supabase.table("api_keys").select(columns).eq("key_hash", key_hash).eq("is_active", True).execute()
+            return res.data[0] if res.data else None
+
+        return await self._run("api key lookup", pg, rest)
+
+    async def create_api_key(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await self._insert_returning("api_keys", row)
+
+    async def list_api_keys(self, user_id: str) -> List[Dict[str, Any]]:
+        async def pg(conn):
+            records = await conn.fetch("SELECT * FROM api_keys WHERE user_id = $1::uuid ORDER BY created_at DESC", user_id)
+            return [_row(r) for r in records]
+
+        def rest():
+            return self.supabase.table("api_keys").select("*").eq("user_id", user_id).order("created_at", desc=True).execute().data or []
+
+        return await self._run("api key list", pg, rest)
+
+    async def deactivate_api_key(self, user_id: str, key_id: str) -> bool:
+        async def pg(conn):
+            status = await conn.execute(
+                "UPDATE api_keys SET is_active = false WHERE id = $1::uuid AND user_id = $2::uuid", key_id, user_id
+            )
+            return not status.endswith(" 0")
+
+        def rest():
+            res = self.supabase.table("api_keys").update({"is_active": False}).eq("id", key_id).eq("user_id", user_id).execute()
+            return bool(res.data)
+
+        return await self._run("api key deactivate", pg, rest)
+
+    async def delete_api_key(self, user_id: str, key_id: str) -> bool:
+        async def pg(conn):
+            status = await conn.execute("DELETE FROM api_keys WHERE id = $1::uuid AND user_id = $2::uuid", key_id, user_id)
+            return not status.endswith(" 0")
+
+        def rest():
+            res = self.supabase.table("api_keys").delete().eq("id", key_id).eq("user_id", user_id).execute()
+            return bool(res.data)
+
+        return await self._run("api key delete", pg, rest)
+
+    async def touch_api_keys(self, used_at: Dict[str, str]) -> int:
+        """Set last_used_at for many keys (key id -> ISO timestamp, naive = UTC) in one statement."""
+        if not used_at:
+            return 0
+        ids = list(used_at)
+
+        async def pg(conn):
+            stamps = []
+            for key_id in ids:
+                ts = datetime.fromisoformat(used_at[key_id])
+                stamps.append(ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc))
+            await conn.execute(
+                "UPDATE api_keys AS k SET last_used_at = v.ts "
+                "FROM unnest($1::uuid[], $2::timestamptz[]) AS v(id, ts) WHERE k.id = v.id",
+                ids, stamps
+            )
+            return len(ids)
+
+        def rest():
+            for key_id in ids:
+                self.supabase.table("api_keys").update({"last_used_at": used_at[key_id]}).eq("id", key_id).execute()
+            return len(ids)
+
+        return await self._run("last_used_at update", pg, rest)
+
+    # --- Writes ---
+
+    async def insert_rows(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Multi-row insert; every row must carry the same columns."""
+        if not rows:
+            return
+        columns = sorted(rows[0])
+        # One round trip: the rows travel as a JSON array and are typed by the table's row type
+        sql = (
+            f"INSERT INTO {_ident(table)} ({_columns(columns)}) "
+            f"SELECT {_columns(columns)} FROM jsonb_populate_recordset(NULL::{_ident(table)}, $1::jsonb)"
+        )
+
+        async def pg(conn):
+            await conn.execute(sql, json.dumps(rows, default=str))
+
+        def rest():
+            self.supabase.table(table).insert(rows).execute()
+
+        await self._run(f"insert into {table}", pg, rest, idempotent=False)
+
+    async def increment_usage(self, deltas: List[Dict[str, Any]]) -> None:
+        async def pg(conn):
+            await conn.execute("SELECT increment_usage($1::jsonb)", json.dumps(deltas))
+
+        def rest():
+            self.supabase.rpc("increment_usage", {"p_deltas": deltas}).execute()
+
+        await self._run("increment_usage", pg, rest, idempotent=False)
+
+    # --- Analytics ---
+
+    async def usage_summary(self, user_id: str) -> Dict[str, Any]:
+        async def pg(conn):
+            value = await conn.fetchval("SELECT get_usage_summary($1::uuid)", user_id)
+            return json.loads(value) if isinstance(value, str) else (value or {})
+
+        def rest():
+            return self.supabase.rpc("get_usage_summary", {"p_user_id": user_id}).execute().data or {}
+
+        return await self._run("get_usage_summary", pg, rest)
+
+    async def monthly_rollups(self, user_id: str) -> List[Dict[str, Any]]:
+        columns = ["year", "month", "total_prompts", "total_tokens_saved", "total_tokens_processed", "total_cost_saved_usd"]
+
+        async def pg(conn):
+            records = await conn.fetch(f"SELECT {_columns(columns)} FROM analytics_monthly WHERE user_id = $1::uuid", user_id)
+            return [_row(r) for r in records]
+
+        def rest():
+            return self.supabase.table("analytics_monthly").select(",".join(columns)).eq("user_id", user_id).execute().data or []
+
+        return await self._run("analytics_monthly read", pg, rest)
+
+    # --- Prompt history ---
+
+    async def prompt_page(
+        self,
+        user_id: str,
+        columns: List[str],
+        limit: int,
+        after: Optional[Tuple[str, str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Prompts ordered by (created_at DESC, id), strictly after the `after` (created_at, id) key."""
+        if after is None:
+            sql = (
+                f"SELECT {_columns(columns)} FROM prompts WHERE user_id = $1::uuid "
+                f"ORDER BY created_at DESC, id LIMIT $2"
+            )
+            args: Tuple[Any, ...] = (user_id, limit)
+        else:
+            sql = (
+                f"SELECT {_columns(columns)} FROM prompts WHERE user_id = $1::uuid "
+                f"AND (created_at < $3::text::timestamptz OR (created_at = $3::text::timestamptz AND id > $4::uuid)) "
+                f"ORDER BY created_at DESC, id LIMIT $2"
+            )
+            args = (user_id, limit, after[0], after[1])
+
+        async def pg(conn):
+            return [_row(r) for r in await conn.fetch(sql, *args)]
+
+        def rest():
+            query = self.supabase.table("prompts").select(",".join(columns)).eq("user_id", user_id)
+            if after is not None:
+                created_at, prompt_id = after
+                query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.gt.{prompt_id})')
+            return query.order("created_at", desc=True).order("id").limit(limit).execute().data or []
+
+        return await self._run("prompt history", pg, rest)
+
+    async def get_prompt(self, user_id: str, prompt_id: str, columns: List[str]) -> Optional[Dict[str, Any]]:
+        sql = f"SELECT {_columns(columns)} FROM prompts WHERE id = $1::uuid AND user_id = $2::uuid"
+
+        async def pg(conn):
+            record = await conn.fetchrow(sql, prompt_id, user_id)
+            return _row(record) if record is not None else None
+
+        def rest():
+            res = self.supabase.table("prompts").select(",".join(columns)).eq("id", prompt_id).eq("user_id", user_id).limit(1).execute()
+            return res.data[0] if res.data else None
+
+        return await self._run("prompt lookup", pg, rest)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {**super().stats(), **self._counters, "pooled": self.pooled}
+        if self._pool is not None:
+            out["pool_size"] = self._pool.get_size()
+            out["pool_idle"] = self._pool.get_idle_size()
+            out["pool_max_size"] = self._pool.get_max_size()
+        return out
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+import httpx
+
+from .rate_limiter import parse_retry_after
+
+# Statuses worth retrying: timeouts, rate limits and transient server errors
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+class ProviderHTTPError(Exception):
+    """Non-2xx response from a provider."""
+
+    def __init__(self, provider: str, status_code: int, body: str = "", retry_after: Optional[float] = None):
+        super().__init__(f"{provider} returned HTTP {status_code}: {body[:300]}")
+        self.provider = provider
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_response(cls, provider: str, resp: httpx.Response) -> "ProviderHTTPError":
+        try:
+            body = resp.text
+        except Exception:
+            body = ""
+        return cls(provider, resp.status_code, body, parse_retry_after(resp.headers))
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuit open for {name}; retry in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    closed -> open after `failure_threshold` failures; open -> half_open after `reset_timeout`;
+    one trial call in half_open closes it again on success or re-opens it on failure.
+    """
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("LLM_BREAKER_FAILURES", 5))
+        self.reset_timeout = reset_timeout or float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30))
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def before_call(self) -> None:
+        if self.state == "open":
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.name, self.reset_timeout - elapsed)
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                raise CircuitOpenError(self.name, 0.0)
+            self._trial_in_flight = True
+
+    def release_trial(self) -> None:
+        """Give up a half-open trial that never got a verdict (cancelled), without counting a failure."""
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+class ResiliencePolicy:
+    """
+    Non-blocking retry policy for async provider calls.
+    - asyncio.sleep with full-jitter exponential backoff (never blocks the event loop)
+    - Honors Retry-After from ProviderHTTPError
+    - Retries only transport errors, timeouts and RETRYABLE_STATUSES
+    - Per-attempt timeout and an overall deadline
+    - Optional CircuitBreaker that fails fast while a provider is down
+    """
+
+    def __init__(
+        self,
+        max_retries: Optional[int] = None,
+        backoff_factor: Optional[float] = None,
+        backoff_max: Optional[float] = None,
+        attempt_timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+        retry_statuses: Iterable[int] = RETRYABLE_STATUSES,
+    ):
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", 2)) if max_retries is None else max_retries
+        self.backoff_factor = backoff_factor or float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+        self.backoff_max = backoff_max or float(os.getenv("LLM_BACKOFF_MAX", 8))
+        self.attempt_timeout = attempt_timeout or float(os.getenv("LLM_ATTEMPT_TIMEOUT", 60))
+        self.deadline = deadline or float(os.getenv("LLM_CALL_DEADLINE", 90))
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        if isinstance(exc, ProviderHTTPError):
+            return exc.status_code in self.retry_statuses
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code in self.retry_statuses
+        return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+    @staticmethod
+    def counts_as_failure(exc: BaseException) -> bool:
+        """Whether an error says the provider is unhealthy (429 is throttling, not an outage)."""
+        if isinstance(exc, ProviderHTTPError):
+            return exc.status_code >= 500
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code >= 500
+        return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        wait = random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+        if retry_after is not None:
+            wait = max(wait, retry_after)
+        return wait
+
+    async def execute(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        breaker: Optional[CircuitBreaker] = None,
+        **kwargs: Any
+    ) -> Any:
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            remaining = self.deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                raise DeadlineExceededError(f"Deadline of {self.deadline:.1f}s exceeded after {attempt} attempts")
+            if breaker is not None:
+                breaker.before_call()
+            try:
+                result = await asyncio.wait_for(func(*args, **kwargs), timeout=min(self.attempt_timeout, remaining))
+            except Exception as e:
+                if breaker is not None:
+                    if self.counts_as_failure(e):
+                        breaker.record_failure()
+                    else:
+                        # A definitive answer (e.g. 4xx) still proves the provider is reachable
+                        breaker.record_success()
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                wait = self.backoff(attempt, getattr(e, "retry_after", None))
+                if time.monotonic() - started + wait >= self.deadline:
+                    raise
+                attempt += 1
+                await asyncio.sleep(wait)
+                continue
+            except BaseException:
+                # Cancelled (client disconnect, hedge loser): says nothing about provider health
+                if breaker is not None:
+                    breaker.release_trial()
+                raise
+            if breaker is not None:
+                breaker.record_success()
+            return result
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+Namespace = Tuple[str, str, str, int]  # (tenant scope, provider, model, max_output_tokens)
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    namespace: Namespace
+    prompt: str
+    result: Dict[str, Any]
+    expires_at: float
+    embedding: Optional[np.ndarray] = None
+
+
+@dataclass
+class CacheLookup:
+    key: str
+    namespace: Namespace
+    prompt: str
+    hit: Optional[Dict[str, Any]] = None
+    kind: Optional[str] = None  # "exact" | "semantic"
+    similarity: Optional[float] = None
+    embedding: Optional[np.ndarray] = field(default=None, repr=False)
+
+
+class ResponseCache:
+    """
+    In-memory response cache for provider calls.
+    - Namespaces are per tenant: (scope, provider, model, max_output_tokens), so one user's
+      completions are never served to another
+    - Exact lookup by hash of (namespace, prompt)
+    - Semantic lookup over normalized sentence embeddings (cosine >= threshold)
+      within the same namespace; the embedding runs in a worker thread
+    - TTL expiry and LRU eviction bounded by max_entries
+    """
+
+    def __init__(
+        self,
+        embed: Optional[Callable[[str], Any]] = None,
+        similarity_threshold: Optional[float] = None,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold or float(os.getenv("LLM_CACHE_SIMILARITY", 0.95))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("LLM_CACHE_TTL_SECONDS", 600))
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", 2000))
+
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # Per-namespace vector index: (keys, stacked embeddings); rebuilt lazily when dirty
+        self._index: Dict[Namespace, Tuple[List[str], Optional[np.ndarray]]] = {}
+        self._dirty: set = set()
+        self._counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def _key(namespace: Namespace, prompt: str) -> str:
+        scope, provider, model, max_tokens = namespace
+        raw = f"{scope}\x00{provider}\x00{model}\x00{max_tokens}\x00{prompt}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        if self.embed is None:
+            return None
+        try:
+            vec = np.asarray(self.embed(text), dtype=np.float32).reshape(-1)
+        except Exception as e:
+            print(f"Warning: response cache embedding failed: {e}")
+            return None
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else None
+
+    # --- Public API ---
+
+    async def lookup(self, scope: str, provider: str, model: str, prompt: str, max_output_tokens: int) -> CacheLookup:
+        namespace = (str(scope), provider, model, int(max_output_tokens))
+        key = self._key(namespace, prompt)
+        lookup = CacheLookup(key=key, namespace=namespace, prompt=prompt)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self._counters["exact_hits"] += 1
+                lookup.hit, lookup.kind, lookup.similarity = entry.result, "exact", 1.0
+                return lookup
+            self._remove(key)
+
+        # MiniLM encode is CPU-bound; keep it off the event loop
+        lookup.embedding = await asyncio.to_thread(self._embed, prompt)
+        now = time.time()
+        if lookup.embedding is not None:
+            match = self._nearest(namespace, lookup.embedding, now)
+            if match is not None:
+                entry, score = match
+                self._entries.move_to_end(entry.key)
+                self._counters["semantic_hits"] += 1
+                lookup.hit, lookup.kind, lookup.similarity = entry.result, "semantic", round(score, 4)
+                return lookup
+
+        self._counters["misses"] += 1
+        return lookup
+
+    def store(
+        self,
+        lookup: CacheLookup,
+        result: Dict[str, Any],
+        provider: Optional[str] = None,
+        model: Optional[str] = None
+    ) -> None:
+        """Store under the lookup's namespace, or under (provider, model) when another target served it."""
+        if result.get("error"):
+            return
+        namespace, key = lookup.namespace, lookup.key
+        if provider and model and (provider, model) != namespace[1:3]:
+            namespace = (namespace[0], provider, model, namespace[3])
+            key = self._key(namespace, lookup.prompt)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CacheEntry(
+            key=key,
+            namespace=namespace,
+            prompt=lookup.prompt,
+            result=result,
+            expires_at=time.time() + self.ttl_seconds,
+            embedding=lookup.embedding,
+        )
+        if lookup.embedding is not None:
+            self._dirty.add(namespace)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._counters["evictions"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._index.clear()
+        self._dirty.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._counters["exact_hits"] + self._counters["semantic_hits"] + self._counters["misses"]
+        hits = self._counters["exact_hits"] + self._counters["semantic_hits"]
+        return {
+            **self._counters,
+            "entries": len(self._entries),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "similarity_threshold": self.similarity_threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "max_entries": self.max_entries,
+        }
+
+    # --- Internals ---
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.embedding is not None:
+            self._dirty.add(entry.namespace)
+
+    def _nearest(self, namespace: Namespace, query: np.ndarray, now: float) -> Optional[Tuple[CacheEntry, float]]:
+        if namespace in self._dirty:
+            keys = [k for k, e in self._entries.items() if e.namespace == namespace and e.embedding is not None]
+            matrix = np.stack([self._entries[k].embedding for k in keys]) if keys else None
+            self._index[namespace] = (keys, matrix)
+            self._dirty.discard(namespace)
+
+        keys, matrix = self._index.get(namespace, ([], None))
+        if matrix is None or matrix.shape[1] != query.shape[0]:
+            return None
+        scores = matrix @ query
+        for idx in np.argsort(-scores):
+            score = float(scores[idx])
+            if score < self.similarity_threshold:
+                break
+            entry = self._entries.get(keys[idx])
+            if entry is None:
+                continue
+            if entry.expires_at <= now:
+                self._remove(entry.key)
+                continue
+            return entry, score
+        return None
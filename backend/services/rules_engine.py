@@ -1,13 +1,11 @@
 from __future__ import annotations
 
-import json
-import re
-import time
 from enum import Enum
-from typing import Any, Dict, List, Optional
-
-import httpx
+from typing import Any, AsyncIterator, Dict, List, Optional
 
+from .json_repair import extract_json
+from .pii_redactor import PIIMatch, PIIRedactor, default_redactor
+from .resilience import ResiliencePolicy
 from .token_counter import OpenAITokenCounter
 
 
@@ -17,31 +15,29 @@ class OutputFormat(str, Enum):
     PROSE = "prose"
 
 
-class RetryPolicy:
-    def __init__(self, max_retries: int = 3, backoff_factor: float = 0.5):
-        self.max_retries = max_retries
-        self.backoff_factor = backoff_factor
-
-    async def execute(self, func, *args, **kwargs):
-        last_exc = None
-        for attempt in range(self.max_retries + 1):
-            try:
-                return await func(*args, **kwargs)
-            except (httpx.HTTPError, Exception) as e:  # broadened for now
-                last_exc = e
-                if attempt == self.max_retries:
-                    raise
-                wait = self.backoff_factor * (2 ** attempt)
-                time.sleep(wait)
-        raise last_exc
+# Kept for backwards compatibility: retries are now async, jittered and status-aware
+RetryPolicy = ResiliencePolicy
 
 
 class BaseRulesEngine:
-    def __init__(self, format: OutputFormat, max_tokens: int, safety: bool = True):
+    def __init__(
+        self,
+        format: OutputFormat,
+        max_tokens: int,
+        safety: bool = True,
+        redactor: Optional[PIIRedactor] = None,
+        json_schema: Optional[Dict[str, Any]] = None
+    ):
         self.format = format
         self.max_tokens = max_tokens
         self.safety = safety
-        self.retry = RetryPolicy()
+        self.redactor = redactor or default_redactor
+        self.json_schema = json_schema
+        # Parse / schema errors from the last JSON enforcement (empty when the output is valid)
+        self.json_errors: List[str] = []
+        # Spans (in the raw output) redacted by the last enforce() call
+        self.pii_matches: List[PIIMatch] = []
+        self.retry = ResiliencePolicy()
 
     async def enforce(self, raw: str, model: str, provider: str = "openai") -> str:
         output = raw or ""
@@ -57,31 +53,19 @@ class BaseRulesEngine:
         output = self._truncate(output, model=model, provider=provider)
         return output
 
+    def stream_enforcer(self, model: str, provider: str = "openai") -> "StreamingEnforcer":
+        """Incremental enforcer for streamed output (PII redaction + token budget)."""
+        return StreamingEnforcer(self, model=model, provider=provider)
+
     def _filter_pii(self, text: str) -> str:
-        patterns = {
-            r"\b\d{3}-\d{2}-\d{4}\b": "[SSN]",
-            r"\b\d{4}[\s-]?\d{4}[\s-]?\d{4}[\s-]?\d{4}\b": "[CARD]",
-            r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b": "[EMAIL]",
-        }
-        for pattern, repl in patterns.items():
-            text = re.sub(pattern, repl, text)
-        return text
+        result = self.redactor.redact(text)
+        self.pii_matches = result.matches
+        return result.text
 
     def _force_json(self, text: str) -> str:
-        try:
-            json.loads(text)
-            return text
-        except Exception:
-            # Fallback: try to extract JSON block
-            match = re.search(r"\{[\s\S]*\}", text)
-            if match:
-                candidate = match.group(0)
-                try:
-                    json.loads(candidate)
-                    return candidate
-                except Exception:
-                    return candidate  # best effort
-            return text
+        result = extract_json(text, self.json_schema)
+        self.json_errors = result.errors
+        return result.text if result.found else text
 
     def _force_bullet(self, text: str) -> str:
         lines = [ln.strip() for ln in (text or "").split("\n") if ln.strip()]
@@ -108,6 +92,133 @@ class BaseRulesEngine:
         return text
 
 
+# Characters that can continue a PII match (emails, keys, IPs, phone punctuation)
+_TAIL_CHARS = frozenset("_@.+-%:()")
+# A space only continues a match between digit / upper-case groups ("4111 1111", "GB82 WEST")
+_SPACE_JOINED = frozenset("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ)(+")
+
+
+def _holdback_start(text: str, max_holdback: int) -> int:
+    """Start of the trailing run of `text` that could still grow into a PII match."""
+    i = len(text)
+    floor = max(0, len(text) - max_holdback)
+    while i > floor:
+        ch = text[i - 1]
+        if ch.isalnum() or ch in _TAIL_CHARS:
+            i -= 1
+        elif ch == " " and i >= 2 and text[i - 2] in _SPACE_JOINED and (i == len(text) or text[i] in _SPACE_JOINED):
+            i -= 1
+        else:
+            break
+    return i
+
+
+class StreamingEnforcer:
+    """
+    Rules enforcement over streamed text deltas.
+    - Redacts PII as the stream flows, holding back only the trailing run that could still
+      turn into a match (capped at `max_holdback` chars)
+    - Counts output tokens per delta (tiktoken for OpenAI, chars/4 otherwise) against max_tokens
+    - Once the budget is exceeded, `done` is set and enforce_stream() closes the upstream stream,
+      so the provider stops generating (and billing) instead of truncating afterwards
+    Output format rules (JSON/bullet) need the full text and are not applied here.
+    """
+
+    def __init__(self, engine: BaseRulesEngine, model: str, provider: str = "openai", max_holdback: int = 256):
+        self.engine = engine
+        self.model = model
+        self.provider = (provider or "").lower()
+        self.max_holdback = max_holdback
+        self.tokens_used = 0
+        self.done = False
+        self.truncated = False
+        # Spans are offsets in the raw (unredacted) stream
+        self.pii_matches: List[PIIMatch] = []
+        self._buf = ""
+        self._offset = 0
+        self._chars = 0
+        self._enc = None
+        if self.provider == "openai":
+            try:
+                self._enc = OpenAITokenCounter.get_encoding(model)
+            except Exception:
+                self._enc = None
+
+    def feed(self, delta: str) -> str:
+        """Add a delta; return the text that is now safe to emit."""
+        if self.done or not delta:
+            return ""
+        self._buf += self._take_budget(delta)
+        if self.done:
+            return self._drain(final=True) + ("\n\n[TRUNCATED]" if self.truncated else "")
+        return self._drain(final=False)
+
+    def finish(self) -> str:
+        """Flush whatever is still held back once the upstream stream has ended."""
+        return self._drain(final=True)
+
+    async def enforce_stream(self, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        try:
+            async for delta in deltas:
+                out = self.feed(delta)
+                if out:
+                    yield out
+                if self.done:
+                    break
+            tail = self.finish()
+            if tail:
+                yield tail
+        finally:
+            # Closing the provider generator ends the HTTP stream
+            aclose = getattr(deltas, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _take_budget(self, delta: str) -> str:
+        budget = self.engine.max_tokens
+        if self._enc is not None:
+            ids = self._enc.encode(delta, disallowed_special=())
+            if self.tokens_used + len(ids) > budget:
+                keep = max(0, budget - self.tokens_used)
+                delta = self._enc.decode(ids[:keep])
+                self.tokens_used = budget
+                self.done = self.truncated = True
+            else:
+                self.tokens_used += len(ids)
+            return delta
+        # Same char-based fallback as _truncate
+        limit = budget * 4
+        if self._chars + len(delta) > limit:
+            delta = delta[: max(0, limit - self._chars)]
+            self.done = self.truncated = True
+        self._chars += len(delta)
+        self.tokens_used = (self._chars + 3) // 4
+        return delta
+
+    def _drain(self, final: bool) -> str:
+        buf = self._buf
+        cut = len(buf) if final else _holdback_start(buf, self.max_holdback)
+        parts: List[str] = []
+        last = 0
+        if self.engine.safety:
+            redactor = self.engine.redactor
+            for m in redactor.find(buf):
+                if m.end > cut:
+                    # Match reaches into the held-back tail; it may still grow
+                    cut = min(cut, m.start)
+                    break
+                if m.start < last:
+                    continue
+                parts.append(buf[last:m.start])
+                parts.append(redactor.replacements[m.kind])
+                self.pii_matches.append(PIIMatch(m.kind, m.start + self._offset, m.end + self._offset))
+                last = m.end
+        parts.append(buf[last:cut])
+        self._buf = buf[cut:]
+        self._offset += cut
+        return "".join(parts)
+
+
 class OpenAIRules(BaseRulesEngine):
     pass
 
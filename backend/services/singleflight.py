@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace-insensitive form of an input, so retyped / re-sent duplicates share a key."""
+    return " ".join((text or "").split())
+
+
+def flight_key(operation: str, *parts: Any) -> Tuple[str, str]:
+    """(operation, digest of the remaining parts); long inputs are hashed to keep keys small."""
+    raw = json.dumps(parts, separators=(",", ":"), default=str)
+    return operation, hashlib.sha256(raw.encode()).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key starts the work, callers
+    arriving while it is in flight await the same task and share its result (or exception).
+    - The work runs as its own task, so a caller that disconnects / is cancelled does not cancel
+      it for the others
+    - Followers get a deep copy of the result, so callers can decorate their response freely
+    - Nothing is kept after completion (the response cache handles reuse over time)
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, operation: str, outcome: str) -> None:
+        counters = self._counters.setdefault(operation, {"leaders": 0, "coalesced": 0})
+        counters[outcome] += 1
+
+    async def do(self, key: Tuple[str, str], fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count(key[0], "coalesced")
+            return copy.deepcopy(await asyncio.shield(task))
+        self._count(key[0], "leaders")
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Tuple[str, str], task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an error nobody waited for is not logged as unhandled
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "operations": {op: dict(c) for op, c in self._counters.items()},
+        }
@@ -0,0 +1,427 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import STORAGE_SECONDS, observe_stage
+from .storage import Storage
+
+# Timestamps are stored as fixed-width UTC ISO strings so they sort lexically
+_NOW = "(strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    first_name TEXT,
+    last_name TEXT,
+    subscription_tier TEXT DEFAULT 'free',
+    monthly_token_limit INTEGER DEFAULT 10000,
+    tokens_used_this_month INTEGER DEFAULT 0,
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS api_keys (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    key_hash TEXT NOT NULL UNIQUE,
+    key_prefix TEXT NOT NULL,
+    name TEXT NOT NULL,
+    key_type TEXT DEFAULT 'output',
+    optimization_level TEXT DEFAULT 'moderate',
+    response_cache INTEGER DEFAULT 0,
+    is_active INTEGER DEFAULT 1,
+    last_used_at TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW}
+);
+CREATE INDEX IF NOT EXISTS idx_api_keys_user_created ON api_keys(user_id, created_at DESC);
+
+CREATE TABLE IF NOT EXISTS prompts (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    original_text TEXT NOT NULL,
+    original_token_count INTEGER NOT NULL,
+    optimized_text TEXT,
+    optimized_token_count INTEGER,
+    tokens_saved INTEGER DEFAULT 0,
+    optimization_level TEXT DEFAULT 'moderate',
+    ai_model TEXT,
+    language TEXT DEFAULT 'en',
+    status TEXT DEFAULT 'pending',
+    cost_saved_usd REAL DEFAULT 0,
+    optimization_cost_usd REAL DEFAULT 0,
+    processing_time_ms INTEGER,
+    error_message TEXT,
+    tags TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW},
+    completed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_prompts_user_created_id ON prompts(user_id, created_at DESC, id);
+
+CREATE TABLE IF NOT EXISTS analytics_daily (
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    total_prompts INTEGER DEFAULT 0,
+    successful_prompts INTEGER DEFAULT 0,
+    total_tokens_processed INTEGER DEFAULT 0,
+    total_tokens_saved INTEGER DEFAULT 0,
+    total_cost_saved_usd REAL DEFAULT 0,
+    avg_compression_rate REAL DEFAULT 0,
+    updated_at TEXT DEFAULT {_NOW},
+    PRIMARY KEY (user_id, date)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_monthly (
+    user_id TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    total_prompts INTEGER DEFAULT 0,
+    successful_prompts INTEGER DEFAULT 0,
+    total_tokens_processed INTEGER DEFAULT 0,
+    total_tokens_saved INTEGER DEFAULT 0,
+    total_cost_saved_usd REAL DEFAULT 0,
+    avg_compression_rate REAL DEFAULT 0,
+    updated_at TEXT DEFAULT {_NOW},
+    PRIMARY KEY (user_id, year, month)
+);
+
+CREATE TABLE IF NOT EXISTS chat_questions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    sources TEXT DEFAULT '[]',
+    confidence REAL DEFAULT 0,
+    created_at TEXT DEFAULT {_NOW}
+);
+CREATE INDEX IF NOT EXISTS idx_chat_questions_user_created ON chat_questions(user_id, created_at DESC);
+"""
+
+# Columns stored as INTEGER 0/1 or JSON text that callers expect as bool / list
+_BOOL_COLUMNS = frozenset({"is_active", "response_cache"})
+_JSON_COLUMNS = frozenset({"tags", "sources"})
+
+_ROLLUP_UPDATE = """
+    total_prompts = total_prompts + excluded.total_prompts,
+    successful_prompts = successful_prompts + excluded.successful_prompts,
+    total_tokens_processed = total_tokens_processed + excluded.total_tokens_processed,
+    total_tokens_saved = total_tokens_saved + excluded.total_tokens_saved,
+    total_cost_saved_usd = total_cost_saved_usd + excluded.total_cost_saved_usd,
+    avg_compression_rate = COALESCE(MIN(100, ROUND(
+        100.0 * (total_tokens_saved + excluded.total_tokens_saved)
+        / NULLIF(total_tokens_processed + excluded.total_tokens_processed, 0), 2)), 0),
+    updated_at = excluded.updated_at
+"""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _encode(column: str, value: Any) -> Any:
+    if column in _JSON_COLUMNS and value is not None and not isinstance(value, str):
+        return json.dumps(value)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (datetime, uuid.UUID)):
+        return str(value)
+    return value
+
+
+def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+    out = {}
+    for key in row.keys():
+        value = row[key]
+        if value is not None:
+            if key in _BOOL_COLUMNS:
+                value = bool(value)
+            elif key in _JSON_COLUMNS:
+                value = json.loads(value)
+        out[key] = value
+    return out
+
+
+class SQLiteStorage(Storage):
+    """
+    Local single-file implementation of Storage for dev, load tests and single-node deployments.
+    - WAL journal with synchronous=NORMAL: readers never block the writer, commits skip fsync
+      per transaction (durable on checkpoint; a power loss can drop the last few commits)
+    - Same indexes as the Postgres schema for the hot paths (key hash, history keyset, rollups)
+    - One connection guarded by a lock; every call runs in a worker thread (asyncio.to_thread),
+      so a locked database (busy_timeout up to 5s) stalls that call, not the event loop
+    - Days and months are bucketed in UTC, like the aggregator and the Postgres functions
+    - increment_usage / usage_summary mirror the SQL functions of the Supabase migrations
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "prompttrim.db"):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._columns: Dict[str, frozenset] = {}
+        self._counters: Dict[str, Any] = {"queries": 0, "query_ms": 0.0}
+
+    # --- Lifecycle ---
+
+    def connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript(SCHEMA)
+            self._columns = {
+                table: frozenset(r["name"] for r in conn.execute(f"PRAGMA table_info({table})"))
+                for table in ("profiles", "api_keys", "prompts", "analytics_daily", "analytics_monthly", "chat_questions")
+            }
+            self._conn = conn
+        return self._conn
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.connect)
+
+    async def aclose(self) -> None:
+        await asyncio.to_thread(self._close)
+
+    def _close(self) -> None:
+        with self._lock:
+            conn, self._conn = self._conn, None
+            if conn is not None:
+                conn.close()
+
+    async def _execute(self, sql: str, params: Any = (), fetch: Optional[str] = None) -> Any:
+        return await asyncio.to_thread(self._execute_sync, sql, params, fetch)
+
+    async def _transaction(self, statements: List[Tuple[str, List[Any]]]) -> None:
+        await asyncio.to_thread(self._transaction_sync, statements)
+
+    def _execute_sync(self, sql: str, params: Any = (), fetch: Optional[str] = None) -> Any:
+        """Run one statement; returns fetchone()/fetchall() rows for fetch="one"/"all", else rowcount."""
+        conn = self.connect()
+        started = time.perf_counter()
+        with self._lock:
+            cur = conn.execute(sql, params)
+            if fetch == "one":
+                result = cur.fetchone()
+            elif fetch == "all":
+                result = cur.fetchall()
+            else:
+                result = cur.rowcount
+        self._record(started, sql.split(None, 1)[0].lower())
+        return result
+
+    def _transaction_sync(self, statements: List[Tuple[str, List[Any]]]) -> None:
+        """executemany() each (sql, rows) pair inside one transaction."""
+        conn = self.connect()
+        started = time.perf_counter()
+        with self._lock:
+            conn.execute("BEGIN")
+            try:
+                for sql, rows in statements:
+                    if rows:
+                        conn.executemany(sql, rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._record(started, "transaction")
+
+    def _record(self, started: float, op: str) -> None:
+        elapsed = time.perf_counter() - started
+        self._counters["queries"] += 1
+        self._counters["query_ms"] += elapsed * 1000
+        STORAGE_SECONDS.observe(elapsed, self.name, op)
+        observe_stage("db", elapsed)
+
+    async def _fetchone(self, sql: str, params: Any = ()) -> Optional[Dict[str, Any]]:
+        row = await self._execute(sql, params, fetch="one")
+        return _decode(row) if row is not None else None
+
+    async def _fetchall(self, sql: str, params: Any = ()) -> List[Dict[str, Any]]:
+        return [_decode(r) for r in await self._execute(sql, params, fetch="all")]
+
+    def _checked_columns(self, table: str, columns) -> List[str]:
+        self.connect()
+        known = self._columns.get(table)
+        if known is None:
+            raise ValueError(f"Unknown table '{table}'")
+        unknown = [c for c in columns if c not in known]
+        if unknown:
+            raise ValueError(f"Unknown columns for {table}: {', '.join(unknown)}")
+        return list(columns)
+
+    # --- Profiles ---
+
+    async def get_profile_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self._fetchone("SELECT * FROM profiles WHERE id = ?", (user_id,))
+
+    async def get_profile_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return await self._fetchone("SELECT * FROM profiles WHERE email = ?", (email,))
+
+    async def create_profile(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await self._insert_returning("profiles", row)
+
+    async def _insert_returning(self, table: str, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        columns = self._checked_columns(table, sorted(row))
+        placeholders = ", ".join("?" for _ in columns)
+        return await self._fetchone(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) RETURNING *",
+            [_encode(c, row[c]) for c in columns]
+        )
+
+    # --- API keys ---
+
+    async def get_active_api_key(self, key_hash: str, columns: str) -> Optional[Dict[str, Any]]:
+        names = self._checked_columns("api_keys", [c.strip() for c in columns.split(",")])
+        return await self._fetchone(
+            f"SELECT {', '.join(names)} FROM api_keys WHERE key_hash = ? AND is_active = 1 LIMIT 1", (key_hash,)
+        )
+
+    async def create_api_key(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await self._insert_returning("api_keys", row)
+
+    async def list_api_keys(self, user_id: str) -> List[Dict[str, Any]]:
+        return await self._fetchall("SELECT * FROM api_keys WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
+
+    async def deactivate_api_key(self, user_id: str, key_id: str) -> bool:
+        updated = await self._execute(
+            "UPDATE api_keys SET is_active = 0, updated_at = ? WHERE id = ? AND user_id = ?", (_now(), key_id, user_id)
+        )
+        return updated > 0
+
+    async def delete_api_key(self, user_id: str, key_id: str) -> bool:
+        return await self._execute("DELETE FROM api_keys WHERE id = ? AND user_id = ?", (key_id, user_id)) > 0
+
+    async def touch_api_keys(self, used_at: Dict[str, str]) -> int:
+        if not used_at:
+            return 0
+        await self._transaction([
+            ("UPDATE api_keys SET last_used_at = ? WHERE id = ?", [(ts, key_id) for key_id, ts in used_at.items()])
+        ])
+        return len(used_at)
+
+    # --- Writes ---
+
+    async def insert_rows(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        columns = self._checked_columns(table, sorted(rows[0]))
+        placeholders = ", ".join("?" for _ in columns)
+        await self._transaction([(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+            [[_encode(c, row.get(c)) for c in columns] for row in rows]
+        )])
+
+    async def increment_usage(self, deltas: List[Dict[str, Any]]) -> None:
+        now = _now()
+        daily, monthly, profiles = [], {}, {}
+        month_start = datetime.now(timezone.utc).strftime("%Y-%m")
+        for d in deltas:
+            prompts = max(0, int(d.get("prompts", 1)))
+            saved = max(0, int(d.get("tokens_saved", 0)))
+            processed = max(0, int(d.get("tokens_processed", 0)))
+            cost = max(0.0, float(d.get("cost_saved_usd", 0.0)))
+            rate = min(100.0, round(100.0 * saved / processed, 2)) if processed else 0.0
+            daily.append((d["user_id"], d["date"], prompts, prompts, processed, saved, cost, rate, now))
+            key = (d["user_id"], int(d["date"][:4]), int(d["date"][5:7]))
+            m = monthly.setdefault(key, [0, 0, 0, 0.0])
+            m[0] += prompts
+            m[1] += processed
+            m[2] += saved
+            m[3] += cost
+            if d["date"][:7] >= month_start:
+                profiles[d["user_id"]] = profiles.get(d["user_id"], 0) + saved
+        monthly_rows = [
+            (uid, year, month, p, p, processed, saved, cost,
+             min(100.0, round(100.0 * saved / processed, 2)) if processed else 0.0, now)
+            for (uid, year, month), (p, processed, saved, cost) in monthly.items()
+        ]
+        await self._transaction([
+            (
+                "INSERT INTO analytics_daily (user_id, date, total_prompts, successful_prompts, total_tokens_processed, "
+                "total_tokens_saved, total_cost_saved_usd, avg_compression_rate, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, date) DO UPDATE SET" + _ROLLUP_UPDATE,
+                daily
+            ),
+            (
+                "INSERT INTO analytics_monthly (user_id, year, month, total_prompts, successful_prompts, total_tokens_processed, "
+                "total_tokens_saved, total_cost_saved_usd, avg_compression_rate, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, year, month) DO UPDATE SET" + _ROLLUP_UPDATE,
+                monthly_rows
+            ),
+            (
+                "UPDATE profiles SET tokens_used_this_month = tokens_used_this_month + ? WHERE id = ?",
+                [(saved, uid) for uid, saved in profiles.items()]
+            ),
+        ])
+
+    # --- Analytics and history ---
+
+    async def usage_summary(self, user_id: str) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        totals = await self._fetchone(
+            "SELECT COALESCE(SUM(total_prompts), 0) AS total_prompts, "
+            "COALESCE(SUM(total_tokens_saved), 0) AS total_tokens_saved, "
+            "COALESCE(SUM(total_tokens_processed), 0) AS total_tokens_processed, "
+            "COALESCE(SUM(total_cost_saved_usd), 0) AS total_cost_saved_usd, "
+            "COALESCE(SUM(CASE WHEN year = ? AND month = ? THEN total_prompts END), 0) AS prompts_this_month "
+            "FROM analytics_monthly WHERE user_id = ?",
+            (now.year, now.month, user_id)
+        )
+        today = await self._fetchone(
+            "SELECT total_prompts AS prompts, total_tokens_saved AS tokens_saved, total_cost_saved_usd AS cost_saved_usd "
+            "FROM analytics_daily WHERE user_id = ? AND date = ?",
+            (user_id, now.strftime("%Y-%m-%d"))
+        )
+        return {**totals, "today": today or {"prompts": 0, "tokens_saved": 0, "cost_saved_usd": 0.0}}
+
+    async def monthly_rollups(self, user_id: str) -> List[Dict[str, Any]]:
+        return await self._fetchall(
+            "SELECT year, month, total_prompts, total_tokens_saved, total_tokens_processed, total_cost_saved_usd "
+            "FROM analytics_monthly WHERE user_id = ?",
+            (user_id,)
+        )
+
+    async def prompt_page(
+        self,
+        user_id: str,
+        columns: List[str],
+        limit: int,
+        after: Optional[Tuple[str, str]] = None
+    ) -> List[Dict[str, Any]]:
+        names = ", ".join(self._checked_columns("prompts", columns))
+        if after is None:
+            return await self._fetchall(
+                f"SELECT {names} FROM prompts WHERE user_id = ? ORDER BY created_at DESC, id LIMIT ?", (user_id, limit)
+            )
+        created_at, prompt_id = after
+        return await self._fetchall(
+            f"SELECT {names} FROM prompts WHERE user_id = ? AND (created_at < ? OR (created_at = ? AND id > ?)) "
+            f"ORDER BY created_at DESC, id LIMIT ?",
+            (user_id, created_at, created_at, prompt_id, limit)
+        )
+
+    async def get_prompt(self, user_id: str, prompt_id: str, columns: List[str]) -> Optional[Dict[str, Any]]:
+        names = ", ".join(self._checked_columns("prompts", columns))
+        return await self._fetchone(f"SELECT {names} FROM prompts WHERE id = ? AND user_id = ?", (prompt_id, user_id))
+
+    def stats(self) -> Dict[str, Any]:
+        queries = self._counters["queries"]
+        return {
+            **super().stats(),
+            "path": self.path,
+            "queries": queries,
+            "avg_query_ms": round(self._counters["query_ms"] / queries, 4) if queries else 0.0,
+        }
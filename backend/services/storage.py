@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Storage(ABC):
+    """
+    Persistence used by the backend, over the tables profiles, api_keys, prompts,
+    analytics_daily / analytics_monthly and chat_questions.
+    - Rows go in and come out as plain dicts shaped like the Supabase (PostgREST) JSON:
+      ids as strings, timestamps as ISO strings, numerics as floats
+    - Implementations: Repository (Supabase / pooled Postgres) and SQLiteStorage (local file);
+      create_storage() picks one from STORAGE_BACKEND
+    """
+
+    name = "base"
+
+    async def start(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+    # --- Profiles ---
+
+    @abstractmethod
+    async def get_profile_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_profile_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_profile(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    # --- API keys ---
+
+    @abstractmethod
+    async def get_active_api_key(self, key_hash: str, columns: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_api_key(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def list_api_keys(self, user_id: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def deactivate_api_key(self, user_id: str, key_id: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_api_key(self, user_id: str, key_id: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def touch_api_keys(self, used_at: Dict[str, str]) -> int:
+        raise NotImplementedError
+
+    # --- Writes ---
+
+    @abstractmethod
+    async def insert_rows(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def increment_usage(self, deltas: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    # --- Analytics and history ---
+
+    @abstractmethod
+    async def usage_summary(self, user_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def monthly_rollups(self, user_id: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def prompt_page(
+        self,
+        user_id: str,
+        columns: List[str],
+        limit: int,
+        after: Optional[Tuple[str, str]] = None
+    ) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_prompt(self, user_id: str, prompt_id: str, columns: List[str]) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+# SQLSTATE classes that retrying cannot fix: data exceptions, integrity violations, syntax / undefined objects
+_PERMANENT_SQLSTATE_CLASSES = ("22", "23", "42")
+
+
+def is_permanent_error(exc: BaseException) -> bool:
+    """
+    Whether a storage error will fail the same way on retry (bad row / column, constraint violation,
+    HTTP 4xx) as opposed to a transient outage. Checks asyncpg `sqlstate`, PostgREST `code`,
+    sqlite3 error types and HTTP status codes without importing any of those clients.
+    """
+    if isinstance(exc, (ValueError, TypeError, KeyError)) and type(exc).__module__ == "builtins":
+        return True
+    if type(exc).__module__ == "sqlite3":
+        return type(exc).__name__ in ("IntegrityError", "DataError", "ProgrammingError")
+    code = getattr(exc, "sqlstate", None) or getattr(exc, "code", None)
+    if isinstance(code, str):
+        if code.startswith(_PERMANENT_SQLSTATE_CLASSES):
+            return True
+        if code.startswith("PGRST") and code[5:6] in ("1", "2"):  # PostgREST request / schema errors
+            return True
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None) or getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return 400 <= status < 500 and status not in (408, 425, 429)
+    return False
+
+
+def create_storage(backend: Optional[str] = None) -> Storage:
+    """STORAGE_BACKEND=supabase (default) or sqlite (SQLITE_PATH, default prompttrim.db)."""
+    backend = (backend or os.getenv("STORAGE_BACKEND", "supabase")).strip().lower()
+    if backend == "sqlite":
+        from .sqlite_storage import SQLiteStorage
+        return SQLiteStorage(os.getenv("SQLITE_PATH", "prompttrim.db"))
+    if backend == "supabase":
+        from database import get_supabase
+        from .repository import Repository
+        return Repository(get_supabase())
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected 'supabase' or 'sqlite')")
@@ -1,8 +1,10 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, LogitsProcessorList
 import torch
-from typing import Dict, Any
+from typing import Dict, Any, List
 import re
 
+from .inference_profiler import inference_profiler
+
 class TinyLlamaService:
     def __init__(self):
         self.model_name = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
@@ -45,33 +47,24 @@ class TinyLlamaService:
             target_tokens = max(1, int(original_token_count * compression_ratio))
             
             # Create compression prompt
-            compression_prompt = f"""<|system|>
-You are an expert at compressing text while preserving all essential information and meaning. 
-Compress the following text to approximately {target_tokens} tokens while maintaining:
-- All key concepts and requirements
-- Technical accuracy
-- Complete instructions
-- Important details
-
-<|user|>
-Compress this text: {prompt}
-
-<|assistant|>
-Compressed version:"""
+            compression_prompt = self._build_compression_prompt(prompt, target_tokens)
             
             # Generate compressed version
             inputs = self.tokenizer.encode(compression_prompt, return_tensors="pt")
             
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs,
-                    max_new_tokens=target_tokens * 2,  # Allow some flexibility
-                    temperature=0.3,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    repetition_penalty=1.1
-                )
+            with inference_profiler.profile("tinyllama", batch_size=1, tokens_in=inputs.shape[1]) as call:
+                with torch.no_grad():
+                    outputs = self.model.generate(
+                        inputs,
+                        max_new_tokens=target_tokens * 2,  # Allow some flexibility
+                        temperature=0.3,
+                        do_sample=True,
+                        pad_token_id=self.tokenizer.eos_token_id,
+                        eos_token_id=self.tokenizer.eos_token_id,
+                        repetition_penalty=1.1,
+                        logits_processor=LogitsProcessorList([call])
+                    )
+                call.tokens_out = outputs.shape[1] - inputs.shape[1]
             
             # Decode the generated text
             generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
@@ -79,27 +72,99 @@ Compressed version:"""
             # Extract the compressed prompt
             compressed_prompt = self._extract_compressed_text(generated_text, prompt)
             
-            # Count tokens in compressed version
-            compressed_tokens = self.tokenizer.encode(compressed_prompt, return_tensors="pt")
-            compressed_token_count = len(compressed_tokens[0])
-            
-            # Calculate actual compression ratio
-            actual_compression_ratio = compressed_token_count / original_token_count
-            savings_percentage = (1 - actual_compression_ratio) * 100
-            
-            return {
-                "optimized_prompt": compressed_prompt,
-                "original_tokens": original_token_count,
-                "optimized_tokens": compressed_token_count,
-                "compression_ratio": actual_compression_ratio,
-                "savings_percentage": savings_percentage
-            }
+            return self._build_result(compressed_prompt, original_token_count)
             
         except Exception as e:
             print(f"Error compressing prompt: {e}")
             # Fallback: return original prompt with basic compression
             return self._fallback_compression(prompt, compression_ratio)
     
+    def compress_batch(self, prompts: List[str], compression_ratios: List[float]) -> List[Dict[str, Any]]:
+        """
+        Compress several prompts with a single batched generate() call
+        
+        Args:
+            prompts: Original prompt texts
+            compression_ratios: Target compression ratio per prompt
+        
+        Returns:
+            List of result dictionaries, in the same order as `prompts`
+        """
+        if len(prompts) <= 1:
+            return [self.compress_prompt(p, r) for p, r in zip(prompts, compression_ratios)]
+        try:
+            original_counts = [len(self.tokenizer.encode(p)) for p in prompts]
+            targets = [max(1, int(count * ratio)) for count, ratio in zip(original_counts, compression_ratios)]
+            compression_prompts = [self._build_compression_prompt(p, t) for p, t in zip(prompts, targets)]
+            
+            # Decoder-only models need left padding so generation continues from real tokens
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.tokenizer.padding_side = "left"
+            inputs = self.tokenizer(compression_prompts, return_tensors="pt", padding=True)
+            
+            tokens_in = int(inputs["attention_mask"].sum())
+            with inference_profiler.profile("tinyllama", batch_size=len(prompts), tokens_in=tokens_in) as call:
+                with torch.no_grad():
+                    outputs = self.model.generate(
+                        **inputs,
+                        max_new_tokens=max(targets) * 2,
+                        temperature=0.3,
+                        do_sample=True,
+                        pad_token_id=self.tokenizer.pad_token_id,
+                        eos_token_id=self.tokenizer.eos_token_id,
+                        repetition_penalty=1.1,
+                        logits_processor=LogitsProcessorList([call])
+                    )
+                # Finished rows are padded to the longest one; pad tokens are not output
+                generated = outputs[:, inputs["input_ids"].shape[1]:]
+                call.tokens_out = int((generated != self.tokenizer.pad_token_id).sum())
+            
+            results = []
+            for i, prompt in enumerate(prompts):
+                generated_text = self.tokenizer.decode(outputs[i], skip_special_tokens=True)
+                compressed_prompt = self._extract_compressed_text(generated_text, prompt)
+                results.append(self._build_result(compressed_prompt, original_counts[i]))
+            return results
+            
+        except Exception as e:
+            print(f"Error in batched compression, falling back to per-prompt: {e}")
+            return [self.compress_prompt(p, r) for p, r in zip(prompts, compression_ratios)]
+    
+    def _build_compression_prompt(self, prompt: str, target_tokens: int) -> str:
+        """Chat-formatted instruction asking TinyLlama for a ~target_tokens compression"""
+        return f"""<|system|>
+You are an expert at compressing text while preserving all essential information and meaning. 
+Compress the following text to approximately {target_tokens} tokens while maintaining:
+- All key concepts and requirements
+- Technical accuracy
+- Complete instructions
+- Important details
+
+<|user|>
+Compress this text: {prompt}
+
+<|assistant|>
+Compressed version:"""
+    
+    def _build_result(self, compressed_prompt: str, original_token_count: int) -> Dict[str, Any]:
+        """Token counts and savings for a compressed prompt"""
+        # Count tokens in compressed version
+        compressed_tokens = self.tokenizer.encode(compressed_prompt, return_tensors="pt")
+        compressed_token_count = len(compressed_tokens[0])
+        
+        # Calculate actual compression ratio
+        actual_compression_ratio = compressed_token_count / original_token_count
+        savings_percentage = (1 - actual_compression_ratio) * 100
+        
+        return {
+            "optimized_prompt": compressed_prompt,
+            "original_tokens": original_token_count,
+            "optimized_tokens": compressed_token_count,
+            "compression_ratio": actual_compression_ratio,
+            "savings_percentage": savings_percentage
+        }
+    
     def _extract_compressed_text(self, generated_text: str, original_prompt: str) -> str:
         """Extract the compressed text from the generated response"""
         # Look for the compressed version after "Compressed version:"
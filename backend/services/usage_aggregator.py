@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from .write_behind import WriteBehindQueue
+
+USAGE = "usage"
+
+
+def _empty_delta(user_id: str, date: str) -> Dict[str, Any]:
+    return {"user_id": user_id, "date": date, "prompts": 0, "tokens_saved": 0, "tokens_processed": 0, "cost_saved_usd": 0.0}
+
+
+def merge_deltas(deltas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sum deltas per (user_id, date)."""
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for d in deltas:
+        key = (d["user_id"], d["date"])
+        agg = merged.get(key)
+        if agg is None:
+            agg = merged[key] = _empty_delta(*key)
+        agg["prompts"] += d.get("prompts", 1)
+        agg["tokens_saved"] += max(0, d.get("tokens_saved", 0))
+        agg["tokens_processed"] += max(0, d.get("tokens_processed", 0))
+        agg["cost_saved_usd"] += max(0.0, d.get("cost_saved_usd", 0.0))
+    return list(merged.values())
+
+
+class UsageAggregator:
+    """
+    In-process usage counters per (user, day).
+    - record() is a dict update; nothing touches the DB in the request
+    - Every USAGE_FLUSH_SECONDS the accumulated deltas are handed to the write-behind queue,
+      which applies them with one `increment_usage` call (atomic increments of analytics_daily,
+      analytics_monthly and profiles.tokens_used_this_month) and spills them if the DB is down
+    - Delivery is at-least-once: an RPC that commits but times out client-side is retried
+    """
+
+    def __init__(self, writer: WriteBehindQueue, flush_interval: Optional[float] = None):
+        self.writer = writer
+        self.storage = writer.storage
+        self.flush_interval = flush_interval or float(os.getenv("USAGE_FLUSH_SECONDS", 5))
+        self._deltas: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._counters: Dict[str, int] = {"recorded": 0, "flushed_rows": 0, "rpc_calls": 0}
+        writer.register(USAGE, self._apply)
+
+    def record(
+        self,
+        user_id: Optional[str],
+        tokens_saved: int,
+        cost_saved_usd: float,
+        tokens_processed: int = 0,
+        prompts: int = 1,
+        date: Optional[str] = None
+    ) -> None:
+        if not user_id:
+            return
+        day = date or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        agg = self._deltas.get((user_id, day))
+        if agg is None:
+            agg = self._deltas[(user_id, day)] = _empty_delta(user_id, day)
+        agg["prompts"] += prompts
+        agg["tokens_saved"] += max(0, tokens_saved)
+        agg["tokens_processed"] += max(0, tokens_processed)
+        agg["cost_saved_usd"] += max(0.0, cost_saved_usd)
+        self._counters["recorded"] += 1
+
+    def pending(self, user_id: str) -> Dict[str, Any]:
+        """Usage recorded for `user_id` that has not been handed to the write-behind queue yet."""
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        out = {"prompts": 0, "tokens_saved": 0, "tokens_processed": 0, "cost_saved_usd": 0.0, "prompts_this_month": 0}
+        out["today"] = {"prompts": 0, "tokens_saved": 0, "cost_saved_usd": 0.0}
+        for (uid, day), delta in self._deltas.items():
+            if uid != user_id:
+                continue
+            for field in ("prompts", "tokens_saved", "tokens_processed", "cost_saved_usd"):
+                out[field] += delta[field]
+            if day[:7] == today[:7]:
+                out["prompts_this_month"] += delta["prompts"]
+            if day == today:
+                for field in out["today"]:
+                    out["today"][field] += delta[field]
+        return out
+
+    def flush(self) -> int:
+        """Hand accumulated deltas to the write-behind queue; returns the number of (user, day) rows."""
+        deltas, self._deltas = self._deltas, {}
+        for delta in deltas.values():
+            self.writer.enqueue(USAGE, delta)
+        self._counters["flushed_rows"] += len(deltas)
+        return len(deltas)
+
+    async def _apply(self, payloads: List[Dict[str, Any]]) -> None:
+        """Write-behind handler: one increment_usage call for every queued delta."""
+        rows = merge_deltas(payloads)
+        for row in rows:
+            row["cost_saved_usd"] = round(row["cost_saved_usd"], 6)
+        if rows:
+            await self.storage.increment_usage(rows)
+            self._counters["rpc_calls"] += 1
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def aclose(self) -> None:
+        """Stop the timer and move what is left into the write-behind queue (flush it afterwards)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, "pending_rows": len(self._deltas)}
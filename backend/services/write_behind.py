@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from .metrics import observe_stage
+from .storage import Storage, is_permanent_error
+
+# A handler receives every queued payload of its kind from one flush. Coroutine handlers are
+# awaited; plain functions run in a worker thread.
+BatchHandler = Callable[[List[Dict[str, Any]]], Union[None, Awaitable[None]]]
+
+INSERT = "insert"
+
+
+class WriteBehindQueue:
+    """
+    Write-behind persistence for request-path writes.
+    - enqueue_insert() / enqueue() return immediately; nothing touches the DB in the request
+    - A background task flushes on WRITE_BEHIND_BATCH_SIZE queued ops or every WRITE_BEHIND_FLUSH_MS
+    - Inserts are grouped per table into one multi-row insert; other kinds go to registered batch handlers
+    - Failed groups are retried with jittered backoff, then appended to a JSONL spill file that is
+      replayed after the next successful write (or every WRITE_BEHIND_REPLAY_SECONDS, and on the
+      first flush after a restart)
+    - Permanent errors (constraint violations, bad columns, 4xx) are not retried: the group is
+      bisected down to the offending ops, which go to a dead-letter file and are never replayed
+    - aclose() lets an in-progress flush finish, then flushes whatever is pending (spilling it if
+      the DB is unreachable); a flush cancelled mid-write spills the groups it had not written
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        batch_size: Optional[int] = None,
+        flush_ms: Optional[float] = None,
+        max_pending: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        spill_path: Optional[str] = None,
+        dead_letter_path: Optional[str] = None
+    ):
+        self.storage = storage
+        self.batch_size = batch_size or int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 100))
+        self.flush_interval = (flush_ms or float(os.getenv("WRITE_BEHIND_FLUSH_MS", 500))) / 1000.0
+        self.max_pending = max_pending or int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))
+        self.max_retries = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", 3)) if max_retries is None else max_retries
+        self.spill_path = spill_path or os.getenv("WRITE_BEHIND_SPILL_PATH", "write_behind_spill.jsonl")
+        self.dead_letter_path = dead_letter_path or os.getenv("WRITE_BEHIND_DEAD_LETTER_PATH", "write_behind_dead_letter.jsonl")
+        self.replay_interval = float(os.getenv("WRITE_BEHIND_REPLAY_SECONDS", 30))
+        self._last_replay = 0.0
+        self._handlers: Dict[str, BatchHandler] = {INSERT: self._insert_rows}
+        self._pending: List[Dict[str, Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closing: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._counters: Dict[str, int] = {
+            "enqueued": 0, "written": 0, "batches": 0, "retries": 0, "spilled": 0, "replayed": 0, "dead_lettered": 0
+        }
+
+    def register(self, kind: str, handler: BatchHandler) -> None:
+        self._handlers[kind] = handler
+
+    # --- Request path ---
+
+    def enqueue_insert(self, table: str, row: Dict[str, Any]) -> None:
+        self.enqueue(INSERT, {"table": table, "row": row})
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]) -> None:
+        if kind not in self._handlers:
+            raise ValueError(f"No write-behind handler registered for '{kind}'")
+        op = {"kind": kind, "payload": payload}
+        self._counters["enqueued"] += 1
+        if len(self._pending) >= self.max_pending:
+            # Backpressure without blocking the request: overflow goes straight to disk
+            self._spill([op])
+            return
+        self._pending.append(op)
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    # --- Background flushing ---
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._closing = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._closing.is_set():
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Warning: write-behind flush failed: {e}")
+
+    async def flush(self, replay: bool = True) -> int:
+        """Write everything queued so far (then any spilled ops); returns the number of ops written."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            written = 0
+            failed = False
+            while self._pending:
+                batch = self._pending[: self.batch_size * 10]
+                del self._pending[: len(batch)]
+                ok, count = await self._write(batch)
+                written += count
+                failed = failed or not ok
+            # Replay when the DB just proved reachable, or periodically while idle
+            due = time.monotonic() - self._last_replay >= self.replay_interval
+            if replay and not failed and (written or due):
+                written += await self._replay_spill()
+            return written
+
+    @staticmethod
+    def _group_key(op: Dict[str, Any]) -> Tuple:
+        # One handler call per insert statement (table + column set), so a failed group was not
+        # partially written and can be bisected safely
+        if op["kind"] == INSERT:
+            payload = op["payload"]
+            return (INSERT, payload["table"], tuple(sorted(payload["row"])))
+        return (op["kind"],)
+
+    async def _write(self, batch: List[Dict[str, Any]], spill_on_cancel: bool = True) -> Tuple[bool, int]:
+        groups: Dict[Tuple, List[Dict[str, Any]]] = defaultdict(list)
+        for op in batch:
+            groups[self._group_key(op)].append(op)
+        all_ok = True
+        written = 0
+        items = list(groups.items())
+        for i, (group, ops) in enumerate(items):
+            kind = group[0]
+            handler = self._handlers.get(kind)
+            if handler is None:
+                print(f"Warning: dropping {len(ops)} write-behind ops with unknown kind '{kind}'")
+                continue
+            try:
+                ok, count = await self._write_group(kind, handler, ops)
+            except asyncio.CancelledError:
+                # The batch already left _pending: spill this group and the unwritten ones before
+                # unwinding (at-least-once, like a failed retry; part of this group may be in)
+                if spill_on_cancel:
+                    self._spill([op for _, rest in items[i:] for op in rest])
+                raise
+            all_ok = all_ok and ok
+            written += count
+        return all_ok, written
+
+    async def _write_group(self, kind: str, handler: BatchHandler, ops: List[Dict[str, Any]]) -> Tuple[bool, int]:
+        """Retry transient errors then spill; bisect on permanent errors and dead-letter single bad ops."""
+        payloads = [op["payload"] for op in ops]
+        started = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            try:
+                if asyncio.iscoroutinefunction(handler):
+                    await handler(payloads)
+                else:
+                    await asyncio.to_thread(handler, payloads)
+            except Exception as e:
+                if is_permanent_error(e):
+                    if len(ops) == 1:
+                        print(f"Warning: write-behind '{kind}' op rejected, dead-lettering it: {e}")
+                        self._dead_letter(ops, e)
+                        return True, 0
+                    mid = len(ops) // 2
+                    ok_left, left = await self._write_group(kind, handler, ops[:mid])
+                    ok_right, right = await self._write_group(kind, handler, ops[mid:])
+                    return ok_left and ok_right, left + right
+                if attempt >= self.max_retries:
+                    print(f"Warning: write-behind '{kind}' batch failed, spilling {len(ops)} ops: {e}")
+                    self._spill(ops)
+                    return False, 0
+                self._counters["retries"] += 1
+                await asyncio.sleep(random.uniform(0, min(5.0, 0.2 * (2 ** attempt))))
+                continue
+            observe_stage(f"write_behind_{kind}", time.monotonic() - started)
+            self._counters["written"] += len(ops)
+            self._counters["batches"] += 1
+            return True, len(ops)
+        return False, 0
+
+    async def _insert_rows(self, payloads: List[Dict[str, Any]]) -> None:
+        # _write groups inserts per (table, columns): bulk inserts need every row to carry the same columns
+        await self.storage.insert_rows(payloads[0]["table"], [p["row"] for p in payloads])
+
+    # --- Spill file ---
+
+    def _spill(self, ops: List[Dict[str, Any]]) -> None:
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for op in ops:
+                    f.write(json.dumps(op, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._counters["spilled"] += len(ops)
+        except OSError as e:
+            print(f"Error: could not spill {len(ops)} write-behind ops to {self.spill_path}: {e}")
+
+    def _dead_letter(self, ops: List[Dict[str, Any]], error: Exception) -> None:
+        """Ops the database rejected outright; kept for inspection, never replayed."""
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for op in ops:
+                    f.write(json.dumps({**op, "error": str(error)[:500], "failed_at": time.time()}, default=str) + "\n")
+            self._counters["dead_lettered"] += len(ops)
+        except OSError as e:
+            print(f"Error: could not dead-letter {len(ops)} write-behind ops to {self.dead_letter_path}: {e}")
+
+    async def _replay_spill(self) -> int:
+        """
+        Re-write spilled ops. The spill file is renamed first so new spills don't race, and the
+        renamed file is only removed after the write (at-least-once: a crash replays it again).
+        """
+        replay_path = self.spill_path + ".replay"
+        self._last_replay = time.monotonic()
+        try:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return 0
+                os.replace(self.spill_path, replay_path)
+            ops = []
+            with open(replay_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        ops.append(json.loads(line))
+                    except ValueError:
+                        continue  # torn write from a crash
+        except OSError as e:
+            print(f"Warning: could not replay write-behind spill file: {e}")
+            return 0
+        # Ops that fail again are re-spilled by _write; if cancelled, the replay file stays for next time
+        _, written = await self._write(ops, spill_on_cancel=False)
+        self._counters["replayed"] += len(ops)
+        os.remove(replay_path)
+        return written
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            # Stop the loop between flushes rather than cancelling it mid-write
+            self._closing.set()
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush(replay=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, "pending": len(self._pending), "spill_file": os.path.exists(self.spill_path)}
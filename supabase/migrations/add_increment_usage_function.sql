@@ -0,0 +1,97 @@
+-- Atomic, batched usage counters.
+-- The backend aggregates usage per (user, day) in memory and calls this once per flush with
+-- a JSON array of deltas:
+--   [{"user_id": "...", "date": "2025-01-23", "prompts": 3, "tokens_saved": 120,
+--     "tokens_processed": 400, "cost_saved_usd": 0.0036}, ...]
+-- Every counter is incremented in place (no read-modify-write), so concurrent workers never
+-- lose updates. avg_compression_rate is recomputed from the running totals as a percentage.
+-- Dates are UTC days (the backend buckets with datetime.now(timezone.utc)).
+
+CREATE OR REPLACE FUNCTION increment_usage(p_deltas jsonb)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  CREATE TEMP TABLE IF NOT EXISTS _usage_deltas (
+    user_id uuid,
+    date date,
+    prompts integer,
+    tokens_saved integer,
+    tokens_processed integer,
+    cost_saved_usd numeric(10, 6)
+  ) ON COMMIT DROP;
+
+  INSERT INTO _usage_deltas
+  SELECT
+    (d->>'user_id')::uuid,
+    (d->>'date')::date,
+    SUM(GREATEST(COALESCE((d->>'prompts')::integer, 1), 0)),
+    SUM(GREATEST(COALESCE((d->>'tokens_saved')::integer, 0), 0)),
+    SUM(GREATEST(COALESCE((d->>'tokens_processed')::integer, 0), 0)),
+    SUM(GREATEST(COALESCE((d->>'cost_saved_usd')::numeric, 0), 0))
+  FROM jsonb_array_elements(p_deltas) AS d
+  WHERE d->>'user_id' IS NOT NULL
+  GROUP BY 1, 2;
+
+  INSERT INTO analytics_daily AS a (
+    user_id, date, total_prompts, successful_prompts,
+    total_tokens_processed, total_tokens_saved, total_cost_saved_usd, avg_compression_rate
+  )
+  SELECT
+    user_id, date, prompts, prompts, tokens_processed, tokens_saved, cost_saved_usd,
+    COALESCE(LEAST(100, ROUND(100.0 * tokens_saved / NULLIF(tokens_processed, 0), 2)), 0)
+  FROM _usage_deltas
+  ON CONFLICT (user_id, date) DO UPDATE SET
+    total_prompts = a.total_prompts + EXCLUDED.total_prompts,
+    successful_prompts = a.successful_prompts + EXCLUDED.successful_prompts,
+    total_tokens_processed = a.total_tokens_processed + EXCLUDED.total_tokens_processed,
+    total_tokens_saved = a.total_tokens_saved + EXCLUDED.total_tokens_saved,
+    total_cost_saved_usd = a.total_cost_saved_usd + EXCLUDED.total_cost_saved_usd,
+    avg_compression_rate = COALESCE(LEAST(100, ROUND(
+      100.0 * (a.total_tokens_saved + EXCLUDED.total_tokens_saved)
+      / NULLIF(a.total_tokens_processed + EXCLUDED.total_tokens_processed, 0), 2)), 0),
+    updated_at = now();
+
+  INSERT INTO analytics_monthly AS m (
+    user_id, year, month, total_prompts, successful_prompts,
+    total_tokens_processed, total_tokens_saved, total_cost_saved_usd, avg_compression_rate
+  )
+  SELECT
+    user_id,
+    EXTRACT(YEAR FROM date)::integer,
+    EXTRACT(MONTH FROM date)::integer,
+    SUM(prompts), SUM(prompts), SUM(tokens_processed), SUM(tokens_saved), SUM(cost_saved_usd),
+    COALESCE(LEAST(100, ROUND(100.0 * SUM(tokens_saved) / NULLIF(SUM(tokens_processed), 0), 2)), 0)
+  FROM _usage_deltas
+  GROUP BY 1, 2, 3
+  ON CONFLICT (user_id, year, month) DO UPDATE SET
+    total_prompts = m.total_prompts + EXCLUDED.total_prompts,
+    successful_prompts = m.successful_prompts + EXCLUDED.successful_prompts,
+    total_tokens_processed = m.total_tokens_processed + EXCLUDED.total_tokens_processed,
+    total_tokens_saved = m.total_tokens_saved + EXCLUDED.total_tokens_saved,
+    total_cost_saved_usd = m.total_cost_saved_usd + EXCLUDED.total_cost_saved_usd,
+    avg_compression_rate = COALESCE(LEAST(100, ROUND(
+      100.0 * (m.total_tokens_saved + EXCLUDED.total_tokens_saved)
+      / NULLIF(m.total_tokens_processed + EXCLUDED.total_tokens_processed, 0), 2)), 0),
+    updated_at = now();
+
+  UPDATE profiles AS p
+  SET tokens_used_this_month = p.tokens_used_this_month + s.tokens_saved
+  FROM (
+    SELECT user_id, SUM(tokens_saved) AS tokens_saved
+    FROM _usage_deltas
+    WHERE date >= date_trunc('month', now() AT TIME ZONE 'UTC')::date
+    GROUP BY user_id
+  ) AS s
+  WHERE p.id = s.user_id;
+
+  DROP TABLE IF EXISTS _usage_deltas;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION increment_usage(jsonb) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION increment_usage(jsonb) TO service_role;
+
+COMMENT ON FUNCTION increment_usage(jsonb) IS 'Batched atomic increments of analytics_daily, analytics_monthly and profiles.tokens_used_this_month';
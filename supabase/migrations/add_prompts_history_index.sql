@@ -0,0 +1,4 @@
+-- Keyset pagination for /prompts/history/{user_id}
+-- The history query filters on user_id and walks (created_at DESC, id) from the cursor, so this
+-- index serves every page with a single range scan regardless of how deep the page is.
+CREATE INDEX IF NOT EXISTS idx_prompts_user_created_id ON prompts(user_id, created_at DESC, id);
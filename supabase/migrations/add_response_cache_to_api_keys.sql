@@ -0,0 +1,5 @@
+-- Per-key opt-in for the LLM response cache
+ALTER TABLE api_keys
+ADD COLUMN IF NOT EXISTS response_cache boolean DEFAULT false;
+
+COMMENT ON COLUMN api_keys.response_cache IS 'Serve /api/llm/chat from the exact/semantic response cache when possible';
@@ -0,0 +1,102 @@
+-- Rollup-backed usage analytics.
+-- analytics_daily / analytics_monthly are kept current by increment_usage (called by the backend
+-- every few seconds), so the dashboard reads a handful of rollup rows instead of every prompt.
+
+-- Summary for one user, aggregated server-side from analytics_monthly (one row per month of
+-- history) plus today's analytics_daily row for the partial day.
+CREATE OR REPLACE FUNCTION get_usage_summary(p_user_id uuid)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT jsonb_build_object(
+    'total_prompts', COALESCE(SUM(m.total_prompts), 0),
+    'total_tokens_saved', COALESCE(SUM(m.total_tokens_saved), 0),
+    'total_tokens_processed', COALESCE(SUM(m.total_tokens_processed), 0),
+    'total_cost_saved_usd', COALESCE(SUM(m.total_cost_saved_usd), 0),
+    'prompts_this_month', COALESCE(SUM(m.total_prompts) FILTER (
+      WHERE m.year = EXTRACT(YEAR FROM now() AT TIME ZONE 'UTC') AND m.month = EXTRACT(MONTH FROM now() AT TIME ZONE 'UTC')
+    ), 0),
+    'today', (
+      SELECT jsonb_build_object(
+        'prompts', COALESCE(d.total_prompts, 0),
+        'tokens_saved', COALESCE(d.total_tokens_saved, 0),
+        'cost_saved_usd', COALESCE(d.total_cost_saved_usd, 0)
+      )
+      FROM (SELECT 1) AS one
+      LEFT JOIN analytics_daily AS d ON d.user_id = p_user_id AND d.date = (now() AT TIME ZONE 'UTC')::date
+    )
+  )
+  FROM analytics_monthly AS m
+  WHERE m.user_id = p_user_id;
+$$;
+
+-- One-off (re)build of the rollups from the prompts table. Overwrites existing rollup rows, so
+-- it is NOT run by this migration. Maintenance step, with writers drained: stop the backend (its
+-- shutdown flushes the write-behind queue and pending usage), then
+--   SELECT backfill_usage_rollups();
+-- Otherwise increments for prompts whose rows are still queued are overwritten and lost.
+CREATE OR REPLACE FUNCTION backfill_usage_rollups()
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO analytics_daily (
+    user_id, date, total_prompts, successful_prompts,
+    total_tokens_processed, total_tokens_saved, total_cost_saved_usd, avg_compression_rate
+  )
+  SELECT
+    user_id,
+    (created_at AT TIME ZONE 'UTC')::date,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE status = 'completed'),
+    SUM(GREATEST(original_token_count, 0)),
+    SUM(GREATEST(tokens_saved, 0)),
+    SUM(GREATEST(cost_saved_usd, 0)),
+    COALESCE(LEAST(100, ROUND(100.0 * SUM(GREATEST(tokens_saved, 0)) / NULLIF(SUM(GREATEST(original_token_count, 0)), 0), 2)), 0)
+  FROM prompts
+  GROUP BY user_id, (created_at AT TIME ZONE 'UTC')::date
+  ON CONFLICT (user_id, date) DO UPDATE SET
+    total_prompts = EXCLUDED.total_prompts,
+    successful_prompts = EXCLUDED.successful_prompts,
+    total_tokens_processed = EXCLUDED.total_tokens_processed,
+    total_tokens_saved = EXCLUDED.total_tokens_saved,
+    total_cost_saved_usd = EXCLUDED.total_cost_saved_usd,
+    avg_compression_rate = EXCLUDED.avg_compression_rate,
+    updated_at = now();
+
+  INSERT INTO analytics_monthly (
+    user_id, year, month, total_prompts, successful_prompts,
+    total_tokens_processed, total_tokens_saved, total_cost_saved_usd, avg_compression_rate
+  )
+  SELECT
+    user_id,
+    EXTRACT(YEAR FROM date)::integer,
+    EXTRACT(MONTH FROM date)::integer,
+    SUM(total_prompts),
+    SUM(successful_prompts),
+    SUM(total_tokens_processed),
+    SUM(total_tokens_saved),
+    SUM(total_cost_saved_usd),
+    COALESCE(LEAST(100, ROUND(100.0 * SUM(total_tokens_saved) / NULLIF(SUM(total_tokens_processed), 0), 2)), 0)
+  FROM analytics_daily
+  GROUP BY 1, 2, 3
+  ON CONFLICT (user_id, year, month) DO UPDATE SET
+    total_prompts = EXCLUDED.total_prompts,
+    successful_prompts = EXCLUDED.successful_prompts,
+    total_tokens_processed = EXCLUDED.total_tokens_processed,
+    total_tokens_saved = EXCLUDED.total_tokens_saved,
+    total_cost_saved_usd = EXCLUDED.total_cost_saved_usd,
+    avg_compression_rate = EXCLUDED.avg_compression_rate,
+    updated_at = now();
+END;
+$$;
+
+REVOKE ALL ON FUNCTION get_usage_summary(uuid) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION get_usage_summary(uuid) TO service_role;
+REVOKE ALL ON FUNCTION backfill_usage_rollups() FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION backfill_usage_rollups() TO service_role;